@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashasync.py    #################################
+
+# asyncio versions of the serial, command and message classes.  Instead of
+# a reader thread per port, the event loop watches each port's file
+# descriptor (loop.add_reader) and frames whatever arrives.  Responses to
+# commands are handed to whoever is waiting for that message type; all
+# other messages go to a queue for the message loop.  That lets commands
+# and streaming data share a port, and lets many receivers run in one
+# event loop.  Linux (or other select-able serial ports) only.
+
+import asyncio
+import collections
+import sys
+import time
+
+from ashserial import *
+from ashcommand import *
+from ashmessage import *
+from ashframe import *
+
+
+class AsyncAshtechSerial(AshtechSerial):
+    QUEUE_SIZE = 1000			# data messages waiting for MsgSwitch
+
+###############################################################################
+###############################################################################
+    def __init__(self, ser_port, ser_baud, hw_port, verbose,
+                 timeout=AshtechSerial.TIMEOUT):
+        super().__init__(ser_port, ser_baud, hw_port, verbose, timeout)
+        self.loop = None
+        self.abuf = bytearray()
+        self.waiters = {}		# msg type: deque of futures
+        self.frames = None		# asyncio.Queue of data messages
+        self.dropped = 0		# messages thrown away when queue is full
+        self.error = None		# why the port stopped being read
+
+###############################################################################
+# OpenAsync -- open the port and find the receiver speed (the slow,
+# blocking part runs in an executor thread), then start watching the port
+###############################################################################
+    async def OpenAsync(self):
+        self.loop = asyncio.get_running_loop()
+        self.frames = None		# Open resets input from another thread
+        await self.loop.run_in_executor(None, self.Open, False)
+        self.frames = asyncio.Queue(self.QUEUE_SIZE)
+        self.error = None
+        self.serial.timeout = 0		# reads never block
+        self.loop.add_reader(self.serial.fileno(), self.OnReadable)
+
+###############################################################################
+# Close -- stop watching the port and close it
+###############################################################################
+    def Close(self):
+        if self.loop:
+            self.loop.remove_reader(self.serial.fileno())
+        self.serial.close()
+
+###############################################################################
+# reset_input -- reset input buffer, including messages already framed
+# but not yet handed out
+###############################################################################
+    def reset_input(self):
+        super().reset_input()
+        self.abuf.clear()
+        while self.frames and not self.frames.empty():
+            self.frames.get_nowait()
+
+###############################################################################
+# OnReadable -- called by the event loop when the port has data.  Frames
+# every complete message and dispatches it.  If the port can't be read
+# (the receiver or adapter is gone) we stop watching it, since it would
+# only be readable again at once, and next_frame raises the error.
+###############################################################################
+    def OnReadable(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except Exception:
+            self.error = sys.exc_info()[1]
+            print("Read error on", self.ser_port, "!", self.error)
+            self.loop.remove_reader(self.serial.fileno())
+            if self.frames.full():
+                self.frames.get_nowait()
+                self.dropped += 1
+            self.frames.put_nowait(None)	# wake up next_frame
+            return
+        if not data:
+            return
+        stamp = time.monotonic_ns()		# for the capture file
+
+        self.abuf += data
+        excess = len(self.abuf) - self.ring.size
+        if excess > 0:
+            del self.abuf[:excess]
+            self.ring.overruns += excess
+
+        while True:
+            (start, end) = self.framer.scan(self.abuf)
+            if start:
+                del self.abuf[:start]
+            if end is None:
+                break
+            end -= start
+            frame = bytes(self.abuf[:end])
+            del self.abuf[:end]
+            self.Dispatch(frame, stamp)
+
+###############################################################################
+# Dispatch -- give a message to the oldest command waiting for its type,
+# otherwise queue it for the message loop (dropping the oldest if the
+# loop has fallen behind).  Either way it goes to the capture file, with
+# stamp, the time it arrived.
+###############################################################################
+    def Dispatch(self, frame, stamp=None):
+        msg_type = split_frame(frame)[0]
+        waiting = self.waiters.get(msg_type)
+        while waiting:
+            future = waiting.popleft()
+            if not future.done():		# skip timed out/cancelled ones
+                future.set_result(frame)
+                if self.capture:
+                    self.capture.write(frame, stamp, True)
+                return
+
+        if self.capture:
+            self.capture.write(frame, stamp)
+        if self.frames.full():
+            self.frames.get_nowait()
+            self.dropped += 1
+        self.frames.put_nowait(frame)
+
+###############################################################################
+# expect -- return a future that gets the next message of any of the
+# given types.  Register before sending the command.
+###############################################################################
+    def expect(self, *msg_types):
+        future = self.loop.create_future()
+        for msg_type in msg_types:
+            self.waiters.setdefault(msg_type,
+                                    collections.deque()).append(future)
+        return future
+
+###############################################################################
+# next_frame -- return the next data message, or b'' on timeout.  Raises
+# the read error once the port has failed (see OnReadable).
+###############################################################################
+    async def next_frame(self, timeout=AshtechSerial.TIMEOUT):
+        if self.error:
+            raise self.error
+        try:
+            frame = await asyncio.wait_for(self.frames.get(), timeout)
+        except asyncio.TimeoutError:
+            return b''
+        if frame is None:
+            raise self.error
+        return frame
+
+
+class AsyncAshtechCommands(AshtechCommands):
+
+###############################################################################
+# SetCommand -- send $PASHS set command.  If ack, wait for the receiver's
+# ACK or NAK and return True or False (None on timeout).
+###############################################################################
+    async def SetCommand(self, command, verbose=False, ack=False,
+                         timeout=AshtechSerial.TIMEOUT):
+        command_string_bytes = b"$PASHS," + bytes(command, 'ascii') + b"\r\n"
+        if verbose:
+            print("SetCommand sent: ", command_string_bytes)
+        if ack:
+            future = self.SerPort.expect('ACK', 'NAK')
+        self.SerPort.write(command_string_bytes)
+        if not ack:
+            return
+
+        try:
+            frame = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        return split_frame(frame)[0] == 'ACK'
+
+###############################################################################
+# SetAcked -- SetCommand with ack, raising TimeoutError if the receiver
+# doesn't answer at all.  Returns True for ACK, False for NAK.
+###############################################################################
+    async def SetAcked(self, command, verbose=False):
+        result = await self.SetCommand(command, verbose, ack=True)
+        if result is None:
+            raise TimeoutError("no reply to " + command)
+        return result
+
+###############################################################################
+# QueryRespond -- send a $PASHQ query command and return the matching
+# $PASHR response with "$PASHR," stripped, or '' on timeout.  The response
+# type defaults to the command name.
+###############################################################################
+    async def QueryRespond(self, command, verbose=False,
+                           timeout=AshtechSerial.TIMEOUT, response_type=None):
+        if not response_type:
+            response_type = command.split(',')[0]
+        command_string_bytes = b"$PASHQ," + bytes(command, 'ascii') + b"\r\n"
+
+        future = self.SerPort.expect(response_type)
+        self.SerPort.write(command_string_bytes)
+        if verbose:
+            print("Query sent:", command_string_bytes)
+
+        try:
+            frame = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return ''
+        return frame[7:].decode('ascii').rstrip("\r\n")
+
+###############################################################################
+# QueryRID -- return receiver ID info as list; if verbose pretty print
+###############################################################################
+    async def QueryRID(self, verbose=False):
+        response = await self.QueryRespond("RID,A")
+        if not response:
+            print("no response from receiver to RID query!")
+            sys.exit(1)
+        response = response.split(',')
+        response = response[1:]
+
+        # sometimes there's a checksum, sometimes there isn't
+        response[4] = response[4].split('*', 1)[0]
+
+        self.g.rx_type = response[0]
+
+        # uZ sends two lines (dummy date field, then SN); output is off
+        # at this point so they are the next two messages
+        if response[0] == "UZ":
+            self.QueryCommand("SID")
+            date = await self.SerPort.next_frame()
+            ser_num = await self.SerPort.next_frame()
+            ser_num = ser_num[7:].decode('ascii')
+        else:
+            date = ""
+            ser_num = 0
+        response.append(ser_num)
+        self.g.rx_ser_num = ser_num
+        self.g.rx_id = response
+
+        if verbose:
+            string = "Rx type: {}".format(str(response[0]))
+            if ser_num:
+                string += ", SN: {}".format(str(ser_num))
+            string += ", options: {}/{}".format(
+                str(response[1]), str(response[3]))
+            string += ", versions: {}/{}".format(
+                str(response[2]), str(response[4]))
+            print(string)
+
+        return response
+
+
+class AsyncAshtechMessages(AshtechMessages):
+    QUIET_RATES = 3		# message intervals without data before giving up
+    QUIET_MIN = 60		# ...but wait at least this many seconds
+    DAL_WAIT = 60		# seconds to wait for a DAL sentence (3 periods)
+
+###############################################################################
+# MsgSwitch -- take data messages from the port's queue and hand them off
+# to the parsers.  Relies on another command to start message stream.
+# Raises TimeoutError if the receiver goes quiet for a few message
+# intervals, so the caller can start it again.
+###############################################################################
+    async def MsgSwitch(self, verbose=False):
+        quiet = max(self.QUIET_MIN,
+                    self.QUIET_RATES * int(self.g.opts['msg_rate']))
+
+        self.SerPort.reset_input()		# clear out garbage
+        last = time.monotonic()
+        while True:
+            message = await self.SerPort.next_frame()
+            if message:
+                last = time.monotonic()
+            elif time.monotonic() - last > quiet:
+                raise TimeoutError("no data for {} seconds".format(quiet))
+            self.HandleFrame(message, verbose)
+
+###############################################################################
+# GetGPSWeek -- same as AshtechMessages.GetGPSWeek, without blocking
+###############################################################################
+    async def GetGPSWeek(self, verbose=False):
+
+        if verbose:
+            print("Getting GPS week number...")
+
+        # uZ has a "GPS Week" command so use it if we can
+        if self.g.rx_type == "UZ":
+            gps_week = await self.Commands.QueryRespond("WKN")
+            if not gps_week:
+                raise TimeoutError("no reply to WKN")
+            gps_week = gps_week.split(',')[1]
+            gps_week = gps_week.split('*', 1)[0]
+        else:
+            # stream the DAL sentence until we get one (see ashmessage.py)
+            await self.Commands.SetAcked("OUT,A,NMEA")
+            await self.Commands.SetAcked("NME,PER,20")
+            await self.Commands.SetAcked("NME,DAL,A,ON")
+            self.SerPort.reset_input()		# clear out garbage
+
+            deadline = time.monotonic() + self.DAL_WAIT
+            gps_week = 0
+            while not gps_week:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("no DAL sentence")
+                message = await self.SerPort.next_frame()
+                if split_frame(message)[0] != 'DAL':
+                    continue
+                response = message[7:].split(b',')
+                gps_week = response[13].split(b'*', 1)[0]
+
+            # turn off NMEA sentences
+            await self.Commands.SetAcked("NME,ALL,A,OFF")
+            self.SerPort.reset_input()		# clear out leftovers
+
+        if verbose:
+            print("Raw GPS week:", gps_week)
+
+        # correct for epoch
+        gps_week = fix_rollover(gps_week)
+        self.g.gps_week = gps_week
+        if verbose:
+            print("Corrected GPS week:", gps_week)
+
+        return gps_week
+
+# end of ashasync.py
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashbatch.py    #################################
+
+# Reprocess RINEX 2.11 observation archives on every core.  Each file is
+# indexed (see ashreader.py) and split into chunks of whole epochs, which
+# a pool of worker processes parses for QC and, if there's output, turns
+# into the new file's body; the results are written out in order.  Only a
+# few chunks are in hand at once, however big the archive.  Along the way:
+#
+#   header fixes -- --marker, --observer, --antenna_type etc. (the same
+#	options ashcomm.py puts in the header) replace what's in the file;
+#	the body of a RINEX 2.11 file is copied as it is
+#   conversion   -- --rinex_version=3.04 writes RINEX 3, each record
+#	formatted by EpochFormatter (see ashrinex.py) with its epoch flag,
+#	clock offset and every value and flag as they were; events and
+#	their header records go through too
+#   QC           -- a line per file: epochs, gaps, satellites, missing
+#	observations, cycle slips (phase LLI bit 0) and events
+#
+# Without -o the files are only checked.
+#
+#   ./ashbatch.py -o fixed/ --antenna_type="ASH700936D_M SNOW" 2026/*.26o
+
+import os
+import sys
+import argparse
+import statistics
+import collections
+import concurrent.futures
+
+from ashglobal import *
+from ashrinex import *
+from ashreader import *
+
+BATCH_CHUNK = 2000		# epochs per task
+BATCH_AHEAD = 2			# tasks in hand per worker
+
+READERS = {}			# worker process: filename -> RinexObsReader
+FORMATTERS = {}			# ... version -> EpochFormatter
+
+###############################################################################
+# batch_columns -- where each of OBSERVABLES is in a file's types; raises
+# ValueError for types the RINEX 3 writer doesn't know
+###############################################################################
+
+
+def batch_columns(types):
+    codes = [o[0] for o in OBSERVABLES]
+    unknown = [t for t in types if t not in codes]
+    if unknown:
+        raise ValueError("observables " + " ".join(unknown) +
+                         " can't be written")
+    return [types.index(code) if code in types else None for code in codes]
+
+###############################################################################
+# batch_chunk -- worker: parse the records from epoch first up to last
+# (index numbers) of a file.  Returns the chunk of the new file's body as
+# bytes (b'' if write is False) and a QC dictionary.  RINEX 2.11 goes out
+# as it came in; anything else is formatted for version.  Readers are kept
+# open in each worker, so the index is only loaded once.
+###############################################################################
+
+
+def batch_chunk(task):
+    (filename, first, last, version, write) = task
+    reader = READERS.get(filename)
+    if reader is None:
+        for old in READERS.values():
+            old.close()
+        READERS.clear()
+        reader = READERS[filename] = RinexObsReader(filename)
+    formatter = None
+    if write and version >= 3:
+        formatter = FORMATTERS.get(version)
+        if formatter is None:
+            formatter = FORMATTERS[version] = EpochFormatter(version)
+    if formatter:
+        columns = batch_columns(reader.types)
+    phases = [n for (n, t) in enumerate(reader.types) if t[0] == 'L']
+
+    qc = {'epochs': 0, 'observations': 0, 'slips': 0, 'other': 0,
+          'events': 0, 'sats': set(), 'missing': [0] * len(reader.types)}
+    lines = []
+    for epoch in reader.records(first, last):
+        if epoch.flag in (2, 3, 4, 5):
+            qc['events'] += 1
+            if formatter:
+                lines += formatter.event(epoch.time, epoch.flag, epoch.lines)
+            continue
+        sats = []
+        for (sat, obs) in zip(epoch.sats, epoch.obs):
+            if sat[0] != 'G':
+                qc['other'] += 1
+                continue
+            sats.append((int(sat[1:]), obs))
+            qc['sats'].add(sat)
+            for (i, (value, lli, strength)) in enumerate(obs):
+                if value is None:
+                    qc['missing'][i] += 1
+            qc['slips'] += sum(1 for i in phases
+                               if obs[i][1] is not None and obs[i][1] & 1)
+        qc['epochs'] += 1
+        qc['observations'] += len(sats)
+        if formatter:
+            lines += formatter.header(epoch.time, [s[0] for s in sats],
+                                      epoch.flag, epoch.clock)
+            for (prn, obs) in sats:
+                lines += formatter.observations(
+                    prn, [None if c is None else obs[c] for c in columns])
+
+    if not write:
+        return b'', qc
+    if not formatter:
+        return reader.raw_epochs(first, last), qc
+    if not lines:
+        return b'', qc
+    return ("\n".join(lines) + "\n").encode('ascii'), qc
+
+###############################################################################
+# batch_results -- run tasks in the pool and yield their results in order,
+# with no more than ahead of them submitted or waiting to be yielded
+###############################################################################
+
+
+def batch_results(pool, tasks, ahead):
+    futures = collections.deque()
+    for task in tasks:
+        futures.append(pool.submit(batch_chunk, task))
+        if len(futures) >= ahead:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+###############################################################################
+# fix_header -- the file's header with the options' fixes and, if it's
+# being converted, the records for the new version.  A RINEX 2 body is
+# copied as it is, so then the version and observable types stay too.
+###############################################################################
+
+
+def fix_header(lines, opts, version):
+    fixed = []
+    typed = False
+    convert = version >= 3
+    for line in lines:
+        text = line.ljust(80)
+        label = text[60:].strip()
+        if label == "RINEX VERSION / TYPE" and convert:
+            line = version_line(version)
+        elif label == "PGM / RUN BY / DATE" and convert:
+            line = "{:<20}{:<20}{:<20}{:<20}".format(
+                text[:20].strip(), text[20:40].strip(), run_date(version),
+                label)
+        elif label == "WAVELENGTH FACT L1/2" and convert:
+            continue
+        elif label == "# / TYPES OF OBSERV" and convert:
+            if not typed:
+                fixed += obs_types_lines(version)
+                typed = True
+            continue
+        elif label == "MARKER NAME" and opts.marker is not None:
+            line = "{:<60}{:<20}".format(opts.marker, label)
+        elif label == "MARKER NUMBER" and opts.marker_number is not None:
+            line = "{:<60}{:<20}".format(opts.marker_number, label)
+        elif label == "OBSERVER / AGENCY":
+            observer = opts.observer
+            agency = opts.agency
+            line = "{:<20}{:<40}{:<20}".format(
+                text[:20].strip() if observer is None else observer,
+                text[20:60].strip() if agency is None else agency, label)
+        elif label == "ANT # / TYPE":
+            number = opts.antenna_number
+            antenna = opts.antenna_type
+            line = "{:<20}{:<20}{:<20}{:<20}".format(
+                text[:20].strip() if number is None else number,
+                text[20:40].strip() if antenna is None else antenna,
+                "", label)
+        elif label == "ANTENNA: DELTA H/E/N":
+            (h, e, n) = [float(text[i:i + 14]) for i in (0, 14, 28)]
+            if opts.antenna_height is not None:
+                h = opts.antenna_height
+            if opts.antenna_east is not None:
+                e = opts.antenna_east
+            if opts.antenna_north is not None:
+                n = opts.antenna_north
+            line = "{:14.4f}{:14.4f}{:14.4f}{:<18}{:<20}".format(
+                h, e, n, "", label)
+        elif label == "END OF HEADER" and opts.comment:
+            fixed.append("{:<60}{:<20}".format(opts.comment[:60], "COMMENT"))
+        fixed.append(line)
+    return fixed
+
+###############################################################################
+# qc_line -- one line of QC for a file from its chunks' QC and the index
+###############################################################################
+
+
+def qc_line(filename, reader, qcs):
+    epochs = sum(q['epochs'] for q in qcs)
+    observations = sum(q['observations'] for q in qcs)
+    slips = sum(q['slips'] for q in qcs)
+    sats = set().union(*(q['sats'] for q in qcs))
+    missing = [sum(q['missing'][i] for q in qcs)
+               for i in range(len(reader.types))]
+
+    # a gap is a step more than 1.5 times the usual interval
+    gaps = 0
+    keys = reader.keys
+    steps = [keys[i + 1] - keys[i] for i in range(len(keys) - 1)]
+    if steps:
+        interval = statistics.median(steps)
+        gaps = sum(1 for step in steps if step > 1.5 * interval)
+
+    line = "{}: {} epochs, {} gaps, {} satellites, {} observations, " \
+        "{} slips".format(os.path.basename(filename), epochs, gaps,
+                          len(sats), observations, slips)
+    blanks = ["{} {}".format(t, m) for (t, m) in zip(reader.types, missing)
+              if m]
+    if blanks:
+        line += "; missing " + ", ".join(blanks)
+    if sum(q['events'] for q in qcs):
+        line += "; {} events".format(sum(q['events'] for q in qcs))
+    if sum(q['other'] for q in qcs):
+        line += "; {} non-GPS skipped".format(sum(q['other'] for q in qcs))
+    return line
+
+###############################################################################
+# batch_chunks -- how many tasks a file is split into (one even if it has
+# no epochs, for whatever else is in its body)
+###############################################################################
+
+
+def batch_chunks(reader, chunk):
+    return max(1, (len(reader.keys) + chunk - 1) // chunk)
+
+###############################################################################
+# process -- run the tasks and write the results and QC, file by file
+###############################################################################
+
+
+def process(readers, tasks, opts, version):
+    jobs = opts.jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        done = batch_results(pool, tasks, BATCH_AHEAD * jobs)
+        for (filename, reader, header) in readers:
+            chunks = batch_chunks(reader, opts.chunk)
+            out = None
+            if opts.output:
+                output = os.path.join(opts.output,
+                                      os.path.basename(filename))
+                out = open(output + ".part", 'wb')
+                out.write(("\n".join(fix_header(header, opts, version)) +
+                           "\n").encode('ascii', 'replace'))
+            qcs = []
+            for n in range(chunks):
+                (text, qc) = next(done)
+                qcs.append(qc)
+                if out:
+                    out.write(text)
+            if out:
+                out.close()
+                os.replace(output + ".part", output)
+            print(qc_line(filename, reader, qcs))
+
+###############################################################################
+# MAIN PROGRAM
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="check, fix and convert RINEX 2.11 observation files "
+        "in parallel")
+    args.add_argument('files', nargs='+', type=str, help='.yyo files')
+    args.add_argument('-o', '--output', default='', type=str,
+                      help='directory for the new files (default: only '
+                      'check them)')
+    args.add_argument('-j', '--jobs', default=None, type=int,
+                      help='worker processes (default: one per core)')
+    args.add_argument('--chunk', default=BATCH_CHUNK, type=int,
+                      help='epochs per task')
+    args.add_argument('--rinex_version', default='2.11', type=str,
+                      choices=RINEX_VERSIONS, help='RINEX version to write')
+
+    # header fixes; the names are the same as ashcomm.py's
+    for name in ('comment', 'marker', 'marker_number', 'observer', 'agency',
+                 'antenna_number', 'antenna_type'):
+        args.add_argument('--' + name, default=None, type=str)
+    for name in ('antenna_height', 'antenna_east', 'antenna_north'):
+        args.add_argument('--' + name, default=None, type=float)
+    opts = args.parse_args()
+    version = float(opts.rinex_version)
+
+    if opts.output and not os.path.isdir(opts.output):
+        print(opts.output, "isn't a directory!")
+        sys.exit(1)
+
+    # index everything first (the workers use the saved indexes)
+    readers = []
+    tasks = []
+    for filename in opts.files:
+        try:
+            reader = RinexObsReader(filename)
+            if version >= 3:
+                batch_columns(reader.types)
+        except (OSError, ValueError) as e:
+            print("Skipping", filename, ":", e)
+            continue
+        # the workers open it themselves; keep the index and header
+        readers.append((filename, reader, reader.header()))
+        reader.close()
+        count = len(reader.keys)
+        for n in range(batch_chunks(reader, opts.chunk)):
+            first = n * opts.chunk
+            tasks.append((filename, first, min(first + opts.chunk, count),
+                          version, bool(opts.output)))
+
+    # chunks come back in order, so each file is written straight through
+    try:
+        process(readers, tasks, opts, version)
+    except ValueError as e:
+        print("Couldn't process the files:", e)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashbatch.py
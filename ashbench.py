@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashbench.py    #################################
+
+# Benchmarks that don't need a receiver.  Each one is a subcommand:
+#
+#   ./ashbench.py sim [--sats=12] [--seconds=10]
+#	runs ashsim.py's simulator in a thread and measures command round
+#	trip time, sustained epochs per second through MsgSwitch's parsers
+#	and the RINEX writer, and BLK download bytes per second
+#
+#   ./ashbench.py format [--sats=12] [--epochs=20000]
+#	checks that EpochFormatter (ashrinex.py) gives the same RINEX 2.11
+#	lines as the original obs_epoch (legacy_obs_epoch below) and times
+#	both, and the RINEX 3 formatter, in epochs per second
+#
+#   ./ashbench.py chksum [--messages=20000]
+#	checks that verify_chksum gives the same answers as the original
+#	version (legacy_verify_chksum below) on random MBN and PBN sized
+#	messages, good and corrupted, and times both and the batch version
+
+import io
+import os
+import sys
+import heapq
+import random
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+import statistics
+
+from ashserial import *
+from ashcommand import *
+from ashmessage import *
+from ashrinex import *
+from ashglobal import *
+from ashopt import *
+from ashsim import *
+from ashutil import *
+from ashframe import *
+from ashrecord import *
+
+# available from pip, but copy provided with this program
+from xmodem import XMODEM1k
+
+###############################################################################
+# report -- print one result line
+###############################################################################
+
+
+def report(name, value, units):
+    print("  {:<28} {:>12.1f} {}".format(name, value, units))
+
+###############################################################################
+# bench_sim -- talk to a simulated receiver the way ashcomm.py and
+# ashfile.py do
+###############################################################################
+
+
+def bench_sim(opts):
+    sim = AshtechSimulator('Z12', opts.sats, fast=True)
+    port = sim.Open()
+    threading.Thread(target=sim.Run, name="ashsim", daemon=True).start()
+
+    g = AshtechGlobals()
+    AshtechOpts(g).getargs([])
+    workdir = tempfile.mkdtemp(prefix="ashbench")
+    g.opts['rinex_file'] = os.path.join(workdir, "BNCH0010.00o")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        Serial = AshtechSerial(port, 115200, 'A', False)
+        Serial.Open()
+        Commands = AshtechCommands(Serial, g, False)
+        RINEX = Rinex(Commands, g, False)
+        Messages = AshtechMessages(Serial, Commands, g, RINEX, False)
+        Messages.Sinks.set_blocking()	# time every epoch, drop none
+        Commands.QueryRID()
+        g.gps_week = sim.week
+    print("Simulated Z12 on", port, "with", opts.sats, "satellites")
+
+    # command round trip: query and wait for the reply
+    times = []
+    for i in range(opts.queries):
+        start = time.perf_counter()
+        response = Commands.QueryRespond("PRT")
+        times.append(time.perf_counter() - start)
+        if not response.startswith("PRT"):
+            print("Bad response to PRT:", response)
+    report("command round trip (median)",
+           statistics.median(times) * 1000, "ms")
+
+    # streaming: as many epochs as MsgSwitch can take
+    g.start_time = datetime.datetime.utcnow()
+    with contextlib.redirect_stdout(io.StringIO()):
+        RINEX.create_rinex_obs_file(interactive=False)
+    Commands.SetCommand("OUT,A,PBN,MBN,BIN")
+    frames = 0
+    nbytes = 0
+    start = time.perf_counter()
+    stop = start + opts.seconds
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.perf_counter() < stop:
+            message = Serial.next_frame()
+            Messages.HandleFrame(message)
+            frames += 1
+            nbytes += len(message)
+    g.sinks.close()			# wait for the RINEX file to catch up
+    elapsed = time.perf_counter() - start
+    Commands.SetCommand("OUT,A")
+    time.sleep(0.5)
+    Serial.reset_input()
+    report("epochs written", g.obs_epoch_count / elapsed, "epochs/s")
+    report("messages", frames / elapsed, "messages/s")
+    report("data", nbytes / elapsed / 1000, "kB/s")
+    report("ring buffer overruns", Serial.overruns(), "bytes")
+
+    # download: the second file in the simulated memory
+    length = len(sim.memory) - (sim.FAT_SIZE + 4096)
+    modem = XMODEM1k(Serial.getc, Serial.putc)
+    download = io.BytesIO()
+    Commands.QueryCommand("BLK,%X,%X" % (sim.FAT_SIZE + 4096, length))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        received = modem.recv(download, crc_mode=1, retry=4)
+    elapsed = time.perf_counter() - start
+    if not received:
+        print("BLK download failed!")
+    else:
+        report("BLK download", received / elapsed / 1000, "kB/s")
+
+    sim.Stop()
+    Serial.Close()
+    sim.Close()
+    g.obs_writer.close()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+###############################################################################
+# legacy_verify_chksum -- verify_chksum as it was before it was sped up,
+# kept here to check the new one against
+###############################################################################
+
+
+def legacy_verify_chksum(payload, chksum_rcvd):
+    # single byte checksum is simple XOR
+    if len(chksum_rcvd) == 1:
+        chksum_rcvd = chksum_rcvd[0]
+        chksum = 0
+        for c in payload:
+            chksum = chksum ^ c
+
+    # two-byte checksum is sum of payload unpacked as unsigned shorts
+    # remember to change from big-endian
+    else:
+        try:
+            chksum_rcvd, = struct.unpack('> H', chksum_rcvd)
+        except:
+            print("Couldn't read checksum!")
+            return False
+        size = len(payload)
+        words = int(size / 2)
+        odd = None
+        if size % 2 == 0:                       # length is even
+            fmt = '> ' + str(words) + 'H'
+            try:
+                shorts = struct.unpack(fmt, payload)
+            except:
+                print("Couldn't read checksum!")
+                return False
+        else:                                   # length is odd
+            fmt = '>' + str(words) + 'H B'      # get odd byte too
+            try:
+                (shorts, odd) = struct.unpack(fmt, payload)
+            except:
+                print("Couldn't read checksum!")
+                return False
+        chksum = 0
+        for i in range(0, words):
+            chksum = chksum + shorts[i]
+        if odd:
+            chksum = chksum + odd
+
+        while chksum > 65535:
+            chksum = chksum - 65536
+
+    if chksum == chksum_rcvd:
+        return True
+    else:
+        return False
+
+###############################################################################
+# bench_chksum -- compare and time the checksum functions
+###############################################################################
+
+
+def bench_chksum(opts):
+    random.seed(1)
+    for (name, length, size) in (('MBN', 94, 1), ('PBN', 54, 2)):
+        messages = []
+        for i in range(opts.messages):
+            payload = bytes(random.getrandbits(8) for j in range(length))
+            chksum = make_chksum(payload, size)
+            if i % 3 == 0:		# corrupt a third of them
+                chksum = bytes([chksum[0] ^ (1 + i % 255)]) + chksum[1:]
+            messages.append(payload + chksum)
+        pairs = [(m[:-size], m[-size:]) for m in messages]
+
+        start = time.perf_counter()
+        legacy = [legacy_verify_chksum(p, c) for (p, c) in pairs]
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = [verify_chksum(p, c) for (p, c) in pairs]
+        new_time = time.perf_counter() - start
+
+        verify_chksum_batch(messages[:10], size)	# load NumPy first
+        start = time.perf_counter()
+        batch = verify_chksum_batch(messages, size)
+        batch_time = time.perf_counter() - start
+
+        same = legacy == new == batch
+        print("{} ({} bytes): {} messages, results {}".format(
+            name, length, len(messages),
+            "identical" if same else "DIFFERENT!"))
+        report("legacy", legacy_time / len(pairs) * 1e6, "us/message")
+        report("verify_chksum", new_time / len(pairs) * 1e6, "us/message")
+        report("verify_chksum_batch", batch_time / len(pairs) * 1e6,
+               "us/message")
+        if not same:
+            sys.exit(1)
+
+###############################################################################
+# legacy_obs_epoch -- Rinex.obs_epoch as it was before EpochFormatter, kept
+# here to check the new one against
+###############################################################################
+
+
+def legacy_obs_epoch(mben_list):
+    lines = []
+    for i in mben_list:
+        if i:
+            # line 1
+            l1p1 = "{:14.3f}{:1d}{:1d}".format(
+                i.ca_range, i.ca_lli, i.ca_sbyte)
+
+            l1p2 = "{:14.3f}{:1d}{:1d}".format(
+                i.l1_range, i.l1_lli, i.l1_sbyte)
+
+            l1p3 = "{:14.3f}{:1d}{:1d}".format(
+                i.l2_range, i.l2_lli, i.l2_sbyte)
+
+            l1p4 = "{:14.3f}{:1d}{:1d}".format(
+                i.l1_phase, i.l1_phase_lli, i.l1_sbyte)
+
+            l1p5 = "{:14.3f}{:1d}{:1d}".format(
+                i.l2_phase, i.l2_phase_lli, i.l2_sbyte)
+
+            # line 2
+            l2p1 = "{:14.3f}{:1d}{:1d}".format(
+                i.l1_dopp, i.l1_lli, i.l1_sbyte)
+
+            l2p2 = "{:14.3f}{:1d}{:1d}".format(
+                i.l2_dopp, i.l2_lli, i.l2_sbyte)
+
+            l2p3 = "{:14.3f}{:2s}".format(i.l1_snr, "")
+            l2p4 = "{:14.3f}".format(i.l2_snr)
+
+            lines.append(l1p1 + l1p2 + l1p3 + l1p4 + l1p5)
+            lines.append(l2p1 + l2p2 + l2p3 + l2p4)
+
+    return lines
+
+###############################################################################
+# bench_format -- compare and time the observation line formatters on
+# epochs from the simulator
+###############################################################################
+
+
+def bench_format(opts):
+    sim = AshtechSimulator('Z12', opts.sats, fast=True)
+    sim.outputs = {'MBN'}
+    epochs = []
+    for n in range(100):
+        sim.MakeEpoch(n)
+        mben_list = [None] * 33
+        while sim.queue:
+            frame = heapq.heappop(sim.queue)[2][:-2]	# no CR LF
+            (msg_type, payload) = split_frame(frame)
+            if msg_type == 'MPC':
+                mben = MbenRecord.decode(payload[:-1])
+                mben_list[mben.prn] = mben
+        epochs.append(mben_list)
+    count = opts.epochs
+
+    start = time.perf_counter()
+    legacy = [legacy_obs_epoch(epochs[n % 100]) for n in range(count)]
+    legacy_time = time.perf_counter() - start
+
+    formatter = EpochFormatter(2.11)
+    start = time.perf_counter()
+    new = [formatter.lines(epochs[n % 100]) for n in range(count)]
+    new_time = time.perf_counter() - start
+
+    formatter = EpochFormatter(3.04)
+    start = time.perf_counter()
+    for n in range(count):
+        formatter.lines(epochs[n % 100])
+    rinex3_time = time.perf_counter() - start
+
+    same = legacy == new
+    print("{} epochs of {} satellites, results {}".format(
+        count, opts.sats, "identical" if same else "DIFFERENT!"))
+    report("legacy obs_epoch", count / legacy_time, "epochs/s")
+    report("EpochFormatter (2.11)", count / new_time, "epochs/s")
+    report("EpochFormatter (3.04)", count / rinex3_time, "epochs/s")
+    if not same:
+        sys.exit(1)
+
+###############################################################################
+# MAIN PROGRAM
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="ashcomm benchmarks (no receiver needed)")
+    commands = args.add_subparsers(dest='bench', required=True)
+
+    sim = commands.add_parser('sim', help='run against the simulator')
+    sim.add_argument('--sats', default=12, type=int,
+                     help='number of satellites tracked')
+    sim.add_argument('--seconds', default=10, type=float,
+                     help='how long to stream')
+    sim.add_argument('--queries', default=20, type=int,
+                     help='number of command round trips to time')
+    sim.set_defaults(func=bench_sim)
+
+    fmt = commands.add_parser('format', help='RINEX observation lines')
+    fmt.add_argument('--sats', default=12, type=int,
+                     help='number of satellites tracked')
+    fmt.add_argument('--epochs', default=20000, type=int,
+                     help='number of epochs to format')
+    fmt.set_defaults(func=bench_format)
+
+    chksum = commands.add_parser('chksum', help='checksum functions')
+    chksum.add_argument('--messages', default=20000, type=int,
+                        help='number of messages of each type')
+    chksum.set_defaults(func=bench_chksum)
+
+    opts = args.parse_args()
+    opts.func(opts)
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashbench.py
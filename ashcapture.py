@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashcapture.py    ###############################
+
+# Raw capture files record every message read from the receiver, so a
+# session can be replayed later without it.
+#
+# File layout (all integers little-endian):
+#   header:  6s  magic "ASHCAP"
+#            B   format version (2)
+#            B   compression: 0 = raw, 1 = zlib, 2 = lzma
+#            Q   host wall clock at start (ns since 1970, UTC)
+#            Q   host monotonic clock at start (ns)
+#   records: Q   host monotonic clock when the message's last byte came
+#                off the port (ns)
+#            I   length; if the META bit is set the record is a JSON
+#                dictionary of session info (GPS week, receiver ID...);
+#                if the REPLY bit is set the message was the reply to a
+#                command, which a replay skips
+#            ... the message, as framed by AshtechFramer
+#
+# Version 1 files are read too; they have no replies, and their times are
+# when MsgSwitch got to each message rather than when it arrived.
+#
+# Everything after the header is one compressed stream if compression is
+# on, so the file can be written as it goes.
+#
+# Run this file to rebuild RINEX from a capture:
+#   ./ashcapture.py --replay=N8UR179o.19o.cap --speed=0 [ashcomm options]
+
+import sys
+import time
+import json
+import lzma
+import zlib
+import struct
+import signal
+import datetime
+
+from ashframe import *
+from ashcommand import *
+from ashmessage import *
+from ashrinex import *
+from ashglobal import *
+from ashopt import *
+from asherror import *
+from ashsink import *
+
+
+class AshtechCapture:
+    MAGIC = b'ASHCAP'
+    VERSION = 2
+    HEADER = struct.Struct('<6sBBQQ')
+    RECORD = struct.Struct('<QI')
+    META = 0x80000000				# length flag for metadata records
+    REPLY = 0x40000000				# ... for command replies
+    LENGTH = 0x3fffffff
+
+    COMPRESSION = {'raw': 0, 'zlib': 1, 'lzma': 2}
+
+###############################################################################
+###############################################################################
+    def __init__(self, filename, compression='raw'):
+        self.filename = filename
+        self.records = 0
+        try:
+            self.compression = self.COMPRESSION[compression]
+        except KeyError:
+            print("Unknown capture compression", compression, "!")
+            sys.exit(1)
+
+        if self.compression == 1:
+            self.compressor = zlib.compressobj()
+        elif self.compression == 2:
+            self.compressor = lzma.LZMACompressor()
+        else:
+            self.compressor = None
+
+        self.file = open(filename, 'wb')
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                         self.compression, time.time_ns(),
+                                         time.monotonic_ns()))
+
+###############################################################################
+# write -- add one message, stamped with the host monotonic clock when it
+# arrived (now if not given); reply if a command took it
+###############################################################################
+    def write(self, frame, timestamp=None, reply=False):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        length = len(frame) | (self.REPLY if reply else 0)
+        self.write_record(self.RECORD.pack(timestamp, length) + frame)
+        self.records += 1
+
+###############################################################################
+# write_meta -- add a dictionary of session info (must be JSON-able)
+###############################################################################
+    def write_meta(self, meta):
+        data = json.dumps(meta).encode('ascii')
+        self.write_record(self.RECORD.pack(time.monotonic_ns(),
+                                           len(data) | self.META) + data)
+
+###############################################################################
+# write_record -- write raw record bytes through the compressor
+###############################################################################
+    def write_record(self, record):
+        if self.compressor:
+            record = self.compressor.compress(record)
+        if record:
+            self.file.write(record)
+
+###############################################################################
+# flush -- push everything so far to disk.  zlib can do this mid-stream;
+# lzma can only finish the stream, so for lzma this only flushes the file.
+###############################################################################
+    def flush(self):
+        if self.compression == 1:
+            self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.file.flush()
+
+###############################################################################
+# close -- finish the compressed stream and close the file
+###############################################################################
+    def close(self):
+        if self.file.closed:
+            return
+        if self.compressor:
+            self.file.write(self.compressor.flush())
+        self.file.close()
+
+
+###############################################################################
+# AshtechCaptureReader -- read a capture file back.  records() yields
+# (timestamp, message) tuples; metadata records are collected in self.meta
+# as they go past, and command replies are skipped.
+###############################################################################
+class AshtechCaptureReader:
+    CHUNK = 65536
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        header = self.file.read(AshtechCapture.HEADER.size)
+        try:
+            (magic, version, self.compression, self.start_wall,
+             self.start_monotonic) = AshtechCapture.HEADER.unpack(header)
+        except struct.error:
+            magic = None
+        if magic != AshtechCapture.MAGIC:
+            print(filename, "is not a capture file!")
+            sys.exit(1)
+        if version > AshtechCapture.VERSION:
+            print(filename, "is capture format version", version,
+                  "which I don't understand!")
+            sys.exit(1)
+
+        if self.compression == 1:
+            self.decompressor = zlib.decompressobj()
+        elif self.compression == 2:
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            self.decompressor = None
+        self.meta = {}
+
+###############################################################################
+# start_time -- host UTC time when the capture started, as a datetime
+###############################################################################
+    def start_time(self):
+        return datetime.datetime.utcfromtimestamp(self.start_wall / 1e9)
+
+###############################################################################
+# read_meta -- read records until the first metadata record; returns
+# self.meta.  Any messages before it are buffered for records().
+###############################################################################
+    def read_meta(self):
+        self.pending = []
+        self.stream = self.raw_records()
+        for record in self.stream:
+            (timestamp, length, data) = record
+            if length & AshtechCapture.META:
+                self.meta.update(json.loads(data.decode('ascii')))
+                break
+            if not length & AshtechCapture.REPLY:
+                self.pending.append(record)
+        return self.meta
+
+###############################################################################
+# records -- generator of (timestamp, message)
+###############################################################################
+    def records(self):
+        if not hasattr(self, 'stream'):
+            self.pending = []
+            self.stream = self.raw_records()
+        for (timestamp, length, data) in self.pending:
+            yield timestamp, data
+        self.pending = []
+        for (timestamp, length, data) in self.stream:
+            if length & AshtechCapture.META:
+                self.meta.update(json.loads(data.decode('ascii')))
+                continue
+            if length & AshtechCapture.REPLY:
+                continue
+            yield timestamp, data
+
+###############################################################################
+# raw_records -- generator of (timestamp, length field, data) tuples,
+# decompressing as it goes
+###############################################################################
+    def raw_records(self):
+        record_size = AshtechCapture.RECORD.size
+        buf = bytearray()
+        pos = 0
+        while True:
+            chunk = self.file.read(self.CHUNK)
+            if not chunk:
+                break
+            if self.decompressor:
+                chunk = self.decompressor.decompress(chunk)
+            buf += chunk
+
+            while len(buf) - pos >= record_size:
+                (timestamp, length) = \
+                    AshtechCapture.RECORD.unpack_from(buf, pos)
+                end = pos + record_size + (length & AshtechCapture.LENGTH)
+                if end > len(buf):
+                    break
+                yield timestamp, length, bytes(buf[pos + record_size:end])
+                pos = end
+            del buf[:pos]
+            pos = 0
+
+        if buf:
+            print("Capture file", self.filename, "ends with a partial record")
+
+    def close(self):
+        self.file.close()
+
+
+###############################################################################
+# AshtechReplay -- stands in for AshtechSerial, feeding MsgSwitch from a
+# capture file.  speed is a multiple of real time; 0 means as fast as
+# possible.  next_frame raises EOFError at the end of the capture.
+###############################################################################
+class AshtechReplay:
+    TIMEOUT = 3
+
+    def __init__(self, filename, speed=1.0, verbose=False):
+        self.filename = filename
+        self.speed = speed
+        self.verbose = verbose
+        self.capture = None
+        self.reader = AshtechCaptureReader(filename)
+        self.records = None
+        self.first_timestamp = None
+        self.first_monotonic = None
+
+###############################################################################
+# Open -- read the session info from the capture
+###############################################################################
+    def Open(self, reader=True):
+        print("Replaying", self.filename, end=' ')
+        if self.speed:
+            print("at {}x real time".format(self.speed))
+        else:
+            print("at maximum speed")
+        meta = self.reader.read_meta()
+        self.records = self.reader.records()
+        return meta
+
+    def Close(self):
+        self.reader.close()
+
+###############################################################################
+# next_frame -- return the next recorded message when it's due
+###############################################################################
+    def next_frame(self, timeout=TIMEOUT):
+        try:
+            (timestamp, frame) = next(self.records)
+        except StopIteration:
+            raise EOFError
+
+        if self.speed:
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+                self.first_monotonic = time.monotonic_ns()
+            due = self.first_monotonic + \
+                (timestamp - self.first_timestamp) / self.speed
+            wait = (due - time.monotonic_ns()) / 1e9
+            if wait > 0:
+                time.sleep(wait)
+        return frame
+
+###############################################################################
+# read_line -- next message with "$PASHR," stripped, like AshtechSerial
+###############################################################################
+    def read_line(self, timeout=TIMEOUT):
+        return self.next_frame(timeout)[7:].rstrip()
+
+    # there's no receiver to talk to, so these do nothing
+    def write(self, message):
+        return len(message)
+
+    def reset_input(self):
+        pass
+
+    def reset_output(self):
+        pass
+
+    def flush(self):
+        pass
+
+###############################################################################
+# start_capture -- open a capture file next to the RINEX file and hook it to
+# the serial port, writing the session info we know so far.  The writing
+# is done on its own thread (see CaptureSink in ashsink.py).
+###############################################################################
+
+
+def start_capture(Serial, g):
+    if g.opts['capture'] == 'none':
+        return None
+    filename = g.obs_filename + ".cap"
+    print("Capturing raw messages to", filename)
+    g.capture = CaptureSink(AshtechCapture(filename, g.opts['capture']))
+    g.capture.write_meta({'gps_week': g.gps_week, 'rx_id': g.rx_id,
+                          'msg_rate': g.opts['msg_rate']})
+    Serial.capture = g.capture
+    return g.capture
+
+###############################################################################
+# MAIN PROGRAM -- rebuild RINEX from a capture file
+###############################################################################
+
+
+def main():
+    g = AshtechGlobals()
+    option = AshtechOpts(g)
+    args = option.parser()
+    args.add_argument('--replay', required=True, type=str,
+                      help='capture file to replay')
+    args.add_argument('--speed', default=0, type=float,
+                      help='multiple of real time; 0 for maximum speed')
+    g.opts = vars(args.parse_args())
+    g.opts['capture'] = 'none'			# don't capture the replay
+    verbose = g.opts['verbose']
+
+    original_sigint = signal.getsignal(signal.SIGINT)
+    error = AshtechError(original_sigint, g)
+    signal.signal(signal.SIGINT, error.exit_handler)
+
+    Serial = AshtechReplay(g.opts['replay'], g.opts['speed'], verbose)
+    Commands = AshtechCommands(Serial, g, verbose)
+    RINEX = Rinex(Commands, g, verbose)
+    Messages = AshtechMessages(Serial, Commands, g, RINEX, verbose)
+    Messages.Sinks.set_blocking()		# every epoch, however slow
+
+    meta = Serial.Open()
+    g.gps_week = meta.get('gps_week', 0)
+    g.opts['msg_rate'] = meta.get('msg_rate', g.opts['msg_rate'])
+    g.rx_id = meta.get('rx_id')
+    if g.rx_id:
+        g.rx_type = g.rx_id[0]
+        g.rx_ser_num = g.rx_id[5]
+    if not g.rx_id or not g.gps_week:
+        print("Capture file has no session info!")
+        sys.exit(1)
+
+    g.start_time = datetime.datetime.utcnow()
+    RINEX.create_rinex_obs_file(when=Serial.reader.start_time())
+
+    try:
+        Messages.MsgSwitch(verbose)
+    except EOFError:
+        pass
+    Serial.Close()
+    g.sinks.close()
+    g.obs_writer.close()
+    if g.obs_compressor:
+        g.obs_compressor.close()
+    error.stats()
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashcapture.py
@@ -33,6 +33,7 @@ from ashrinex import *
 from ashglobal import *
 from ashopt import *
 from asherror import *
+from ashcapture import *
 
 ###############################################################################
 # MAIN PROGRAM
@@ -63,10 +64,9 @@ def main():
     print()
     Serial.Open()
 
-    Commands.SetCommand("OUT,A", verbose=0)     # turn off output
+    Commands.SetCommand("OUT,A", ack=True)      # turn off output
     Serial.reset_input()                        # clean the sluices
     Serial.reset_output()
-    time.sleep(1)
 
     Commands.QueryRID(verbose=True)
     print()
@@ -78,19 +78,19 @@ def main():
     print()
 
     gps_week = Messages.GetGPSWeek(verbose)
-    time.sleep(1)
+
+    start_capture(Serial, g)
 
     # set message rate
     msg_rate = str(g.opts['msg_rate'])
     print("Setting message rate to", msg_rate, "seconds")
-    Commands.SetCommand("RCI," + msg_rate)
-    time.sleep(1)
+    if not Commands.SetCommand("RCI," + msg_rate, ack=True):
+        print("Receiver didn't accept message rate!")
 
     print("Waiting for data; it may take a while...")
     print()
 
-    Commands.SetCommand("OUT,A,PBN,MBN,BIN", verbose)
-    time.sleep(1)
+    Commands.SetCommand("OUT,A,PBN,MBN,BIN", verbose, ack=True)
     Messages.MsgSwitch(verbose)
     time.sleep(1)
     Serial.Close()
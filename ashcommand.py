@@ -19,6 +19,7 @@
 
 #############################   ashcommand.py    ###############################
 
+import sys
 import time
 
 from ashserial import *
@@ -27,6 +28,7 @@ from ashutil import *
 from ashmessage import *
 from ashposition import *
 from ashtime import *
+from ashframe import *
 
 
 class AshtechCommands:
@@ -39,9 +41,17 @@ class AshtechCommands:
         self.verbose = verbose
 
 ###############################################################################
-# SetCommand -- send $PASHS set command to Z12; don't wait for response
+# SetCommand -- send $PASHS set command to Z12.  If ack, wait for the
+# receiver's ACK or NAK and return True or False (None if neither came);
+# otherwise don't wait for response
 ##############################################################################
-    def SetCommand(self, command, verbose=False):
+    def SetCommand(self, command, verbose=False, ack=False):
+        if ack:
+            reply = self.Transact(command, query=False, verbose=verbose)
+            if not reply:
+                return None
+            return split_frame(reply)[0] == 'ACK'
+
         command_string_bytes = b"$PASHS," + bytes(command, 'ascii') + b"\r\n"
         if verbose:
             print("SetCommand sent: ", command_string_bytes)
@@ -86,10 +96,16 @@ class AshtechCommands:
 ###############################################################################
 # QueryRespond -- send a $PASHQ query command to Z12 and return response.  If
 # length specified, read that many bytes and return all, else read to EOL.
-# else return as list with $PASHR and command echo stripped
+# else return as list with $PASHR and command echo stripped.  With the
+# reader thread running, the response is picked out by its message type
+# (see Transact), so this works while data is streaming.
 ###############################################################################
     def QueryRespond(self, command, length=0, verbose=False):
 
+        if self.SerPort.reader_running and not length:
+            response = self.Transact(command, verbose=verbose)
+            return response[7:].decode('ascii')
+
         command_string_bytes = b"$PASHQ," + bytes(command, 'ascii') + b"\r\n"
         self.SerPort.reset_input()		# clear out garbage
         self.SerPort.reset_output()		# clear out garbage
@@ -114,6 +130,71 @@ class AshtechCommands:
                 break
         return response
 
+###############################################################################
+# Request -- send a $PASHQ query (or, if not query, a $PASHS set command)
+# without waiting, and return a future for the reply.  Query replies are
+# matched by message type (default: the command name); set commands by ACK
+# or NAK, oldest first.  Needs the serial reader thread.
+###############################################################################
+    def Request(self, command, query=True, response_type=None,
+                verbose=False):
+        if query:
+            prefix = b"$PASHQ,"
+            msg_types = [response_type or command.split(',')[0]]
+        else:
+            prefix = b"$PASHS,"
+            msg_types = ['ACK', 'NAK']
+
+        future = self.SerPort.expect(*msg_types)
+        command_string_bytes = prefix + bytes(command, 'ascii') + b"\r\n"
+        self.SerPort.write(command_string_bytes)
+        if verbose:
+            print("Request sent:", command_string_bytes)
+        return future
+
+###############################################################################
+# Transact -- send a command and wait for its reply, sending it again up to
+# retries times if nothing comes back within timeout.  Returns the reply
+# message as raw bytes (see AshtechSerial.next_frame) or b'' if none came.
+###############################################################################
+    COMMAND_TIMEOUT = 2			# seconds to wait for each reply
+    COMMAND_RETRIES = 1
+
+    def Transact(self, command, query=True, response_type=None,
+                 timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES,
+                 verbose=False):
+        for attempt in range(retries + 1):
+            future = self.Request(command, query, response_type, verbose)
+            reply = self.SerPort.wait_reply(future, timeout)
+            if reply:
+                return reply
+            if verbose:
+                print("No reply to", command)
+        return b''
+
+###############################################################################
+# Pipeline -- send several commands back to back, then collect the replies,
+# so the lot takes about one round trip.  commands is a list of (command,
+# query) tuples; returns the replies in the same order, b'' for any that
+# didn't come even after retries.
+###############################################################################
+    def Pipeline(self, commands, timeout=COMMAND_TIMEOUT,
+                 retries=COMMAND_RETRIES, verbose=False):
+        replies = [b''] * len(commands)
+        todo = list(range(len(commands)))
+        for attempt in range(retries + 1):
+            futures = [self.Request(commands[i][0], commands[i][1],
+                                    verbose=verbose) for i in todo]
+            give_up = time.monotonic() + timeout
+            for (i, future) in zip(todo, futures):
+                reply = self.SerPort.wait_reply(
+                    future, max(0, give_up - time.monotonic()))
+                replies[i] = reply or b''
+            todo = [i for i in todo if not replies[i]]
+            if not todo:
+                break
+        return replies
+
 ###############################################################################
 ###############################################################################
 # receiver queries and commands
@@ -123,7 +204,11 @@ class AshtechCommands:
 # QueryRID -- return receiver ID info as list; if verbose pretty print
 ###############################################################################
     def QueryRID(self, verbose=False):
-        response = self.QueryRespond("RID,A").split(',')
+        response = self.QueryRespond("RID,A")
+        if not response:
+            print("no response from receiver to RID query!")
+            sys.exit(1)
+        response = response.split(',')
         response = response[1:]
 
         # sometimes there's a checksum, sometimes there isn't
@@ -133,17 +218,19 @@ class AshtechCommands:
 
         # uZ has "SID" command to return serial number.  But it does it
         # with two lines (dummy date field, then SN) so simple query
-        # won't work
+        # won't work; output is off at this point so they are the next
+        # two messages
         if response[0] == "UZ":
             self.QueryCommand("SID")
-            date = self.SerPort.read_line()
-            ser_num = self.SerPort.read_line()
-            ser_num = ser_num.decode('ascii')
+            date = self.SerPort.next_frame()
+            ser_num = self.SerPort.next_frame()
+            ser_num = ser_num[7:].decode('ascii')
         else:
             date = ""
             ser_num = 0
         response.append(ser_num)
         self.g.rx_ser_num = ser_num
+        self.g.rx_id = response
 
         if verbose:
             # fields: 0 = rx type, 1 = channel option, 2 = nav version,
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashcrx.py    ###################################
+
+# Compact RINEX (Hatanaka) version 1.0, for RINEX 2 observation files: the
+# ".yyd" files made by RNX2CRX.  The RINEX header is copied with two lines
+# added in front.  Then for each epoch:
+#
+#   the epoch line, with the satellite list all on one line, as a text
+#	difference from the last one: a blank where a character is the same,
+#	"&" where it became a blank.  The first is written whole, with "&"
+#	in column 1.
+#   the receiver clock offset line (blank if there isn't one)
+#   one line per satellite: each observable as an integer (the value with
+#	the decimal point taken out) differenced from that satellite's
+#	earlier values, up to "order" times.  The first value of an arc is
+#	written "order&value"; a missing value is an empty field.  Then the
+#	LLI and signal strength characters of all the observables, as a text
+#	difference like the epoch line.
+#
+# Run this file to convert files:
+#   ./ashcrx.py N8UR2910.26o		-> N8UR2910.26d
+#   ./ashcrx.py -d N8UR2910.26d		-> N8UR2910.26o
+#
+# RinexWriter (ashrinex.py) uses CrxEncoder to write ".yyd" files directly
+# with --crx.
+
+import sys
+import time
+import argparse
+
+CRX_VERSION = "1.0"
+CRX_ORDER = 3			# RNX2CRX's default difference order
+
+###############################################################################
+# text_diff, text_undiff -- the text differencing used for epoch lines and
+# flags
+###############################################################################
+
+
+def text_diff(old, new):
+    diff = []
+    for (n, c) in enumerate(new):
+        o = old[n] if n < len(old) else ' '
+        if c == o:
+            diff.append(' ')
+        elif c == ' ':
+            diff.append('&')
+        else:
+            diff.append(c)
+    # anything past the end of the new text is blanked out
+    diff.extend(' ' if c == ' ' else '&' for c in old[len(new):])
+    return ''.join(diff).rstrip()
+
+
+def text_undiff(old, diff):
+    new = list(old.ljust(len(diff)))
+    for (n, c) in enumerate(diff):
+        if c == '&':
+            new[n] = ' '
+        elif c != ' ':
+            new[n] = c
+    return ''.join(new)
+
+###############################################################################
+# take -- the next n lines; a file that ends early is an error
+###############################################################################
+
+
+def take(lines, n):
+    taken = []
+    for line in lines:
+        taken.append(line)
+        if len(taken) == n:
+            break
+    if len(taken) < n:
+        raise ValueError("file ends in the middle of an epoch")
+    return taken
+
+###############################################################################
+# to_int, from_int -- fixed point text ("-123.456") <-> integer (-123456)
+###############################################################################
+
+
+def to_int(text):
+    return int(text.replace('.', ''))
+
+
+def from_int(value, places, width):
+    (whole, frac) = divmod(abs(value), 10 ** places)
+    text = "{}{}.{:0{}d}".format('-' if value < 0 else '', whole, frac,
+                                 places)
+    return text.rjust(width)
+
+
+class CrxArc:
+    __slots__ = ['diffs']
+
+###############################################################################
+# CrxArc -- the difference state of one observable of one satellite.
+# diffs holds the last value and its differences, up to order - 1.
+###############################################################################
+    def __init__(self, value):
+        self.diffs = [value]
+
+    def encode(self, value, order):
+        new = [value]
+        for d in self.diffs:
+            new.append(new[-1] - d)
+        out = new[-1]
+        self.diffs = new[:order]
+        return out
+
+    def decode(self, out, order):
+        new = [out]
+        for d in reversed(self.diffs):
+            new.append(new[-1] + d)
+        new.reverse()
+        self.diffs = new[:order]
+        return new[0]
+
+###############################################################################
+# observation_types -- number of observables in a RINEX 2 header
+###############################################################################
+
+
+def observation_types(lines):
+    for line in lines:
+        if line[60:].strip() == "# / TYPES OF OBSERV" and line[:6].strip():
+            return int(line[:6])
+    return 0
+
+
+class CrxEncoder:
+
+    ###############################################################################
+    def __init__(self, order=CRX_ORDER, program=None):
+        self.order = order
+        self.program = program
+        self.ntypes = 0
+        self.epoch_line = None		# last epoch line, for the difference
+        self.clock = None			# CrxArc for the clock offset
+        self.arcs = {}				# satellite -> list of CrxArc or None
+        self.flags = {}				# satellite -> last flag string
+
+###############################################################################
+# header -- the compact header: two lines in front of the RINEX header
+###############################################################################
+    def header(self, lines):
+        self.ntypes = observation_types(lines)
+        program = self.program or "ashcrx.py"
+        date = time.strftime("%d-%b-%y %H:%M", time.gmtime())
+        return ["{:<20}{:<40}{:<20}".format(
+                    CRX_VERSION, "COMPACT RINEX FORMAT",
+                    "CRINEX VERS   / TYPE"),
+                "{:<40}{:<20}{:<20}".format(
+                    program, date, "CRINEX PROG / DATE")] + list(lines)
+
+###############################################################################
+# epoch -- compact lines for one epoch record: the epoch line(s) and the
+# observation lines that follow
+###############################################################################
+    def epoch(self, lines):
+        first = lines[0]
+        flag = first[28:29]
+        count = int(first[29:32])
+
+        # event records go through as they are
+        if flag not in ('0', '1', '6', ' '):
+            self.epoch_line = None
+            return ['&' + first[1:]] + list(lines[1:])
+
+        # satellite list on one line; the clock offset goes on its own
+        sat_lines = (count + 11) // 12
+        sats = ''.join(line.ljust(68)[32:68] for line in lines[:sat_lines])
+        sats = sats[:3 * count]
+        line = first[:32] + sats
+        out = [self.epoch_text(line), self.clock_text(first[68:].strip())]
+
+        per_sat = (self.ntypes + 4) // 5
+        data = lines[sat_lines:]
+        arcs = {}
+        flags = {}
+        for n in range(count):
+            sat = sats[3 * n:3 * n + 3]
+            obs = ''.join(l.ljust(80) for l in
+                          data[n * per_sat:(n + 1) * per_sat])
+            (text, arcs[sat], flags[sat]) = self.sat_text(
+                obs, self.arcs.get(sat), self.flags.get(sat, ''))
+            out.append(text)
+        self.arcs = arcs
+        self.flags = flags
+        return out
+
+    def epoch_text(self, line):
+        old = self.epoch_line
+        self.epoch_line = line
+        if old is None:
+            return '&' + line[1:]
+        return text_diff(old, line)
+
+    def clock_text(self, clock):
+        if not clock:
+            self.clock = None
+            return ''
+        value = to_int(clock)
+        if self.clock is None:
+            self.clock = CrxArc(value)
+            return "{}&{}".format(self.order, value)
+        return str(self.clock.encode(value, self.order))
+
+    def sat_text(self, obs, arcs, old_flags):
+        if arcs is None:
+            arcs = [None] * self.ntypes
+        fields = []
+        flags = ''
+        for i in range(self.ntypes):
+            field = obs[16 * i:16 * i + 14]
+            flags += obs[16 * i + 14:16 * i + 16]
+            if not field.strip():
+                arcs[i] = None
+                fields.append('')
+                continue
+            value = to_int(field.strip())
+            if arcs[i] is None:
+                arcs[i] = CrxArc(value)
+                fields.append("{}&{}".format(self.order, value))
+            else:
+                fields.append(str(arcs[i].encode(value, self.order)))
+        text = ' '.join(fields)
+        diff = text_diff(old_flags, flags)
+        if diff:
+            text += ' ' + diff
+        return text.rstrip(), arcs, flags
+
+
+class CrxDecoder:
+
+    ###############################################################################
+    def __init__(self):
+        self.ntypes = 0
+        self.order = CRX_ORDER
+        self.epoch_line = None
+        self.clock = None
+        self.arcs = {}
+        self.flags = {}
+
+###############################################################################
+# header -- strip the compact header lines off a header
+###############################################################################
+    def header(self, lines):
+        if not lines or lines[0][60:].strip() != "CRINEX VERS   / TYPE":
+            raise ValueError("not a Compact RINEX file")
+        if lines[0][:20].strip() != CRX_VERSION:
+            raise ValueError("Compact RINEX version " + lines[0][:20].strip())
+        lines = [line for line in lines
+                 if not line[60:].startswith("CRINEX")]
+        self.ntypes = observation_types(lines)
+        return lines
+
+###############################################################################
+# epoch -- RINEX lines for one epoch.  lines() gets the next line of the
+# compact file.
+###############################################################################
+    def epoch(self, line, lines):
+        if line.startswith('&'):
+            line = ' ' + line[1:]
+        elif self.epoch_line is None:
+            raise ValueError("epoch line isn't initialized")
+        else:
+            line = text_undiff(self.epoch_line, line)
+        line = line.rstrip()
+        flag = line[28:29]
+        count = int(line[29:32])
+
+        if flag not in ('0', '1', '6', ' '):
+            self.epoch_line = None
+            return [line] + take(lines, count)
+        self.epoch_line = line
+
+        # the epoch line(s), with the satellites back in 12s
+        sats = [line[32 + 3 * n:35 + 3 * n] for n in range(count)]
+        out = [line[:32] + ''.join(sats[:12])]
+        for n in range(12, count, 12):
+            out.append(' ' * 32 + ''.join(sats[n:n + 12]))
+        clock = self.clock_value(take(lines, 1)[0])
+        if clock:
+            out[0] = out[0].ljust(68) + clock
+
+        arcs = {}
+        flags = {}
+        for sat in sats:
+            (obs, arcs[sat], flags[sat]) = self.sat_lines(
+                take(lines, 1)[0], self.arcs.get(sat), self.flags.get(sat, ''))
+            out.extend(obs)
+        self.arcs = arcs
+        self.flags = flags
+        return out
+
+    def clock_value(self, text):
+        text = text.strip()
+        if not text:
+            self.clock = None
+            return ''
+        if '&' in text:
+            (order, text) = text.split('&')
+            self.order = int(order)
+            value = int(text)
+            self.clock = CrxArc(value)
+        else:
+            value = self.clock.decode(int(text), self.order)
+        return from_int(value, 9, 12)
+
+    def sat_lines(self, text, arcs, old_flags):
+        if arcs is None:
+            arcs = [None] * self.ntypes
+        parts = text.split(' ', self.ntypes)
+        parts += [''] * (self.ntypes + 1 - len(parts))
+        flags = text_undiff(old_flags, parts[self.ntypes]).ljust(
+            2 * self.ntypes)
+
+        fields = []
+        for i in range(self.ntypes):
+            field = parts[i]
+            if not field:
+                arcs[i] = None
+                fields.append(' ' * 14)
+            elif '&' in field:
+                (order, value) = field.split('&')
+                self.order = int(order)
+                arcs[i] = CrxArc(int(value))
+                fields.append(from_int(int(value), 3, 14))
+            else:
+                value = arcs[i].decode(int(field), self.order)
+                fields.append(from_int(value, 3, 14))
+            fields[-1] += flags[2 * i:2 * i + 2]
+
+        obs = [''.join(fields[n:n + 5]).rstrip()
+               for n in range(0, self.ntypes, 5)]
+        return obs, arcs, flags
+
+###############################################################################
+# encode, decode -- whole files, as iterables of lines without newlines
+###############################################################################
+
+
+def read_header(lines):
+    header = []
+    for line in lines:
+        header.append(line)
+        if line[60:].strip() == "END OF HEADER":
+            break
+    return header
+
+
+def encode(lines, order=CRX_ORDER, program=None):
+    lines = iter(lines)
+    encoder = CrxEncoder(order, program)
+    yield from encoder.header(read_header(lines))
+    per_sat = (encoder.ntypes + 4) // 5
+    for first in lines:
+        if not first.strip():
+            continue
+        flag = first[28:29]
+        count = int(first[29:32])
+        if flag not in ('0', '1', '6', ' '):
+            more = count
+        else:
+            more = (count + 11) // 12 - 1 + count * per_sat
+        yield from encoder.epoch([first] + take(lines, more))
+
+
+def decode(lines):
+    lines = iter(lines)
+    decoder = CrxDecoder()
+    yield from decoder.header(read_header(lines))
+    for line in lines:
+        yield from decoder.epoch(line, lines)
+
+###############################################################################
+# MAIN PROGRAM
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="convert RINEX 2 observation files to and from "
+        "Compact RINEX 1.0")
+    args.add_argument('file', type=str, help='.yyo file (.yyd with -d)')
+    args.add_argument('-d', '--decode', action='store_true',
+                      help='decode a .yyd file')
+    args.add_argument('-o', '--output', default='', type=str,
+                      help='output file (default: same name ending in '
+                      'd or o)')
+    opts = args.parse_args()
+
+    output = opts.output
+    if not output:
+        if opts.file[-1:] not in ('o', 'd'):
+            print("Give an output file name for", opts.file, "!")
+            sys.exit(1)
+        output = opts.file[:-1] + ('o' if opts.decode else 'd')
+
+    with open(opts.file) as reader, open(output, 'w') as writer:
+        lines = (line.rstrip('\r\n') for line in reader)
+        try:
+            if opts.decode:
+                converted = decode(lines)
+            else:
+                converted = encode(lines)
+            for line in converted:
+                writer.write(line + "\n")
+        except ValueError as e:
+            print("Couldn't convert", opts.file, ":", e)
+            sys.exit(1)
+    print("Wrote", output)
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashcrx.py
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashdaemon.py    ################################
+
+# Collect from several receivers at once in one process.  The station list
+# is an INI-style file with one section per receiver; the keys are the
+# ashcomm.py command line options (without the "--") and anything in the
+# [DEFAULT] section applies to every station.  See stations.example.ini.
+#
+# Each station gets its own AshtechGlobals, RINEX file and message loop;
+# all of them run in one asyncio event loop (see ashasync.py).
+
+import argparse
+import asyncio
+import configparser
+import datetime
+import sys
+
+from ashasync import *
+from ashrinex import *
+from ashglobal import *
+from ashopt import *
+from asherror import *
+from ashcapture import *
+
+
+class AshtechStation:
+    RETRY_DELAY = 10			# seconds before reopening a failed port
+
+###############################################################################
+###############################################################################
+    def __init__(self, name, g):
+        self.name = name
+        self.g = g
+        verbose = g.opts['verbose']
+        self.verbose = verbose
+
+        self.Serial = AsyncAshtechSerial(g.opts['serport'],
+                                         g.opts['baud'], g.opts['hwport'],
+                                         verbose)
+        self.Commands = AsyncAshtechCommands(self.Serial, g, verbose)
+        self.RINEX = Rinex(self.Commands, g, verbose)
+        self.Messages = AsyncAshtechMessages(self.Serial, self.Commands,
+                                             g, self.RINEX, verbose)
+
+###############################################################################
+# Connect -- open the port and identify the receiver.  Open and QueryRID
+# exit if the port or the receiver isn't there; turn that into an OSError
+# so Run knows it is worth trying again.
+###############################################################################
+    async def Connect(self):
+        print("[{}] opening {}".format(self.name, self.g.opts['serport']))
+        try:
+            await self.Serial.OpenAsync()
+
+            await self.Commands.SetAcked("OUT,A")  # turn off output
+            self.Serial.reset_input()
+            self.Serial.reset_output()
+
+            await self.Commands.QueryRID(verbose=True)
+        except SystemExit:
+            raise ConnectionError("no receiver on " + self.g.opts['serport'])
+
+###############################################################################
+# Run -- start the receiver and collect from it forever, reopening the port
+# if it or the receiver goes away.  Anything else (a bad option, a file we
+# can't write) won't get better by waiting, so we give up on the station.
+###############################################################################
+    async def Run(self):
+        g = self.g
+        verbose = self.verbose
+        created_file = False
+
+        while True:
+            try:
+                await self.Connect()
+
+                if not created_file:
+                    g.start_time = datetime.datetime.utcnow()
+                    self.RINEX.create_rinex_obs_file(interactive=False)
+                    created_file = True
+
+                await self.Messages.GetGPSWeek(verbose)
+                if not g.capture:
+                    start_capture(self.Serial, g)
+                self.Serial.capture = g.capture
+
+                msg_rate = str(g.opts['msg_rate'])
+                print("[{}] setting message rate to {} seconds".format(
+                    self.name, msg_rate))
+                if not await self.Commands.SetAcked("RCI," + msg_rate):
+                    print("[{}] receiver didn't accept message rate!".format(
+                        self.name))
+
+                await self.Commands.SetAcked("OUT,A,PBN,MBN,BIN", verbose)
+                await self.Messages.MsgSwitch(verbose)
+
+            except asyncio.CancelledError:
+                raise
+            except OSError:
+                # serial errors, no receiver, or no data (TimeoutError)
+                print("[{}] error: {}; retrying in {} seconds".format(
+                    self.name, sys.exc_info()[1], self.RETRY_DELAY))
+                self.Shutdown()
+                await asyncio.sleep(self.RETRY_DELAY)
+            except (Exception, SystemExit):
+                print("[{}] error: {}; giving up".format(
+                    self.name, sys.exc_info()[1]))
+                self.Shutdown()
+                return
+
+###############################################################################
+# Shutdown -- flush what we have and close the port after a failure
+###############################################################################
+    def Shutdown(self):
+        self.Messages.FlushEpochs()	# nothing more for them
+        try:
+            self.Serial.Close()
+        except Exception:
+            pass
+
+###############################################################################
+# Close -- shut down the port and print the session stats
+###############################################################################
+    def Close(self):
+        try:
+            self.Serial.Close()
+        except Exception:
+            pass
+        if self.g.messages:		# epochs still being assembled
+            self.g.messages.FlushEpochs()
+        if self.g.sinks:
+            self.g.sinks.close()
+        if self.g.capture:
+            self.g.capture.close()
+        if self.g.obs_writer:
+            self.g.obs_writer.close()
+        if self.g.obs_compressor:
+            self.g.obs_compressor.close()
+        print("[{}]".format(self.name), end='')
+        AshtechError(None, self.g).stats()
+
+###############################################################################
+# read_station_list -- parse the station list and return a list of
+# AshtechStation objects.  Options are checked and converted by the same
+# parser ashcomm.py uses.
+###############################################################################
+
+
+def read_station_list(filename, verbose=False):
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(filename):
+        print("Couldn't read station list", filename, "!")
+        sys.exit(1)
+
+    stations = []
+    for name in config.sections():
+        argv = []
+        for key, value in config.items(name):
+            if key not in AshtechGlobals.opt_keys:
+                print("Unknown option", key, "for station", name, "!")
+                sys.exit(1)
+            argv.append("--" + key + "=" + value)
+
+        g = AshtechGlobals()
+        AshtechOpts(g).getargs(argv)
+        if verbose:
+            g.opts['verbose'] = True
+        stations.append(AshtechStation(name, g))
+
+    if not stations:
+        print("No stations in", filename, "!")
+        sys.exit(1)
+    return stations
+
+###############################################################################
+# run_stations -- run every station in one event loop
+###############################################################################
+
+
+async def run_stations(stations):
+    await asyncio.gather(*(station.Run() for station in stations))
+
+###############################################################################
+# MAIN PROGRAM
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="collect from several Ashtech receivers at once")
+    args.add_argument('-c', '--config', required=True, type=str,
+                      help='station list file')
+    args.add_argument('-v', '--verbose', action='store_true',
+                      help='be verbose (all stations)')
+    opts = args.parse_args()
+
+    stations = read_station_list(opts.config, opts.verbose)
+    print("Collecting from", len(stations), "stations; press Ctrl-C to exit")
+    print()
+
+    try:
+        asyncio.run(run_stations(stations))
+    except KeyboardInterrupt:
+        pass
+
+    print()
+    for station in stations:
+        station.Close()
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashdaemon.py
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashepoch.py    #################################
+
+# Putting MBN and PBN messages back together into epochs.
+#
+# Each epoch is one MBN per satellite (the last has struct_left == 0)
+# followed, about 3 seconds later, by one PBN (see the notes at the end of
+# ashglobal.py).  At short message intervals the next epoch's MBNs arrive
+# before this epoch's PBN, so rather than one set of "current" messages we
+# keep a few epochs in progress, keyed by GPS time in integer milliseconds
+# since the GPS epoch, and hand them back in time order as they fill up.
+#
+# An epoch is finished when it has its whole MBN set and its PBN.  If the
+# PBN never turns up, the epoch is written anyway once messages more than
+# "timeout" seconds newer have arrived (the position just isn't updated).
+# An epoch whose MBN set never finished is dropped at that point, as is the
+# oldest epoch if more than "window" are in progress.  When the messages
+# stop altogether, Flush() hands back whatever is left.
+#
+# In low latency mode an epoch is handed back as soon as its MBN set is
+# complete, about 3 seconds sooner, with the last known position.  When
+# its PBN does arrive the epoch is handed back again by Updates().
+
+import datetime
+
+from ashtime import *
+
+EPOCH_TIMEOUT = 10		# seconds of GPS time to wait for missing messages
+EPOCH_WINDOW = 8		# most epochs in progress at once
+
+WEEK_MS = 604800 * 1000
+BLOCK_MS = 1800 * 1000		# MBN seq counts 50 ms units modulo 30 minutes
+SEQ_MS = 50
+
+###############################################################################
+# gps_ms -- GPS week and tow (seconds) to milliseconds since the GPS epoch
+###############################################################################
+
+
+def gps_ms(week, tow):
+    return int(week) * WEEK_MS + int(round(tow * 1000))
+
+###############################################################################
+# clock_gps_ms -- the same, from the host clock (see current_gps_time)
+###############################################################################
+
+
+def clock_gps_ms():
+    elapsed = current_gps_time() - datetime.datetime(1980, 1, 6)
+    return elapsed // datetime.timedelta(milliseconds=1)
+
+###############################################################################
+# seq_gps_ms -- turn an MBN seq into GPS time, choosing the 30 minute block
+# that puts it nearest to reference (GPS ms).  Weeks are a whole number of
+# blocks, so this works across the end of the week too.
+###############################################################################
+
+
+def seq_gps_ms(seq, reference):
+    ms = reference - reference % BLOCK_MS + (int(seq) * SEQ_MS) % BLOCK_MS
+    if ms - reference > BLOCK_MS // 2:
+        ms -= BLOCK_MS
+    elif reference - ms > BLOCK_MS // 2:
+        ms += BLOCK_MS
+    return ms
+
+
+class AshtechEpoch:
+    __slots__ = ['key', 'mben_list', 'pben', 'complete', 'guessed']
+
+    def __init__(self, key, guessed=False):
+        self.key = key				# GPS ms
+        self.mben_list = [None] * 33		# MbenRecords; index = PRN
+        self.pben = None			# PbenRecord
+        self.complete = False			# got struct_left == 0
+        self.guessed = guessed			# key came from the host clock
+
+###############################################################################
+# ready -- have everything; gps_time -- the epoch time as a GPS_Time
+###############################################################################
+    def ready(self):
+        return self.complete and self.pben is not None
+
+    def gps_time(self):
+        return GPS_Time.from_ns(0, self.key * 10**6)
+
+    def __repr__(self):
+        return "AshtechEpoch(key={}, sats={}, complete={}, pben={})".format(
+            self.key, sum(1 for i in self.mben_list if i), self.complete,
+            self.pben is not None)
+
+
+class AshtechEpochAssembler:
+
+    ###############################################################################
+    def __init__(self, timeout=EPOCH_TIMEOUT, window=EPOCH_WINDOW,
+                 low_latency=False, verbose=False):
+        self.timeout = int(timeout * 1000)
+        self.window = window
+        self.low_latency = low_latency
+        self.verbose = verbose
+        self.pending = {}		# key -> AshtechEpoch
+        self.awaiting = {}		# key -> epoch handed back without PBN
+        self.updates = []		# ... that have since got it
+        self.reference = None	# newest GPS ms known from a PBN
+        self.newest = None		# newest key not guessed
+        self.last_key = None	# last key handed back by Ready()
+
+        # counters
+        self.emitted = 0		# epochs handed back
+        self.unpaired = 0		# ... of those, without their PBN
+        self.dropped = 0		# incomplete epochs given up on
+        self.late = 0			# messages for epochs already handed back
+        self.updated = 0		# PBNs that came after their epoch
+
+###############################################################################
+# AddMben -- file an MbenRecord under its epoch, which is returned (None if
+# that epoch has already been handed back).  Until the first PBN the seq
+# can only be placed using the host clock; AddPben corrects that.
+###############################################################################
+    def AddMben(self, mben):
+        if self.reference is None:
+            epoch = self.Epoch(seq_gps_ms(mben.seq, clock_gps_ms()), True)
+        else:
+            epoch = self.Epoch(seq_gps_ms(mben.seq, self.reference))
+        if epoch is None:
+            return None
+        epoch.mben_list[mben.prn] = mben
+        if mben.struct_left == 0:		# last message for this epoch
+            epoch.complete = True
+        return epoch
+
+###############################################################################
+# AddPben -- file a PbenRecord under key (GPS ms, see gps_ms)
+###############################################################################
+    def AddPben(self, pben, key):
+        epoch = self.awaiting.pop(key, None)
+        if epoch is not None:			# low latency: a late update
+            epoch.pben = pben
+            self.updates.append(epoch)
+            self.updated += 1
+            return epoch
+
+        first = self.reference is None
+        if first or key > self.reference:
+            self.reference = key
+
+        # the first PBN tells us which 30 minute block we're in
+        if first:
+            for epoch in [e for e in self.pending.values() if e.guessed]:
+                del self.pending[epoch.key]
+                epoch.key = seq_gps_ms(epoch.key % BLOCK_MS // SEQ_MS, key)
+                epoch.guessed = False
+                if self.last_key is None or epoch.key > self.last_key:
+                    self.pending.setdefault(epoch.key, epoch)
+                    self.Newest(epoch.key)
+
+        epoch = self.Epoch(key)
+        if epoch is None:
+            return None
+        epoch.pben = pben
+        return epoch
+
+###############################################################################
+# Epoch -- find or start the epoch for key; None if it's too late for it
+###############################################################################
+    def Epoch(self, key, guessed=False):
+        if self.last_key is not None and key <= self.last_key:
+            self.late += 1
+            return None
+        epoch = self.pending.get(key)
+        if epoch is None:
+            epoch = self.pending[key] = AshtechEpoch(key, guessed)
+        if not guessed:
+            self.Newest(key)
+            if key > self.reference:
+                self.reference = key
+        return epoch
+
+    def Newest(self, key):
+        if self.newest is None or key > self.newest:
+            self.newest = key
+
+###############################################################################
+# Ready -- hand back, oldest first, the epochs that are finished or that
+# have waited long enough.  Stops at the oldest one that's still waiting,
+# so epochs always come out in order.  With flush, nothing waits any
+# longer (see Flush).
+###############################################################################
+    def Ready(self, flush=False):
+        epochs = []
+        while self.pending:
+            key = min(self.pending)
+            epoch = self.pending[key]
+            early = (self.low_latency and epoch.complete and
+                     not epoch.guessed)
+            if not epoch.ready() and not early:
+                stale = flush or (not epoch.guessed and
+                                  self.newest - key > self.timeout)
+                if not stale and len(self.pending) <= self.window:
+                    break
+                if not epoch.complete or epoch.guessed:
+                    if self.verbose:
+                        print("dropping incomplete epoch:", epoch)
+                    del self.pending[key]
+                    self.dropped += 1
+                    continue
+                if self.verbose:
+                    print("no PBN for epoch:", epoch)
+                self.unpaired += 1
+            del self.pending[key]
+            self.last_key = key
+            self.emitted += 1
+            epochs.append(epoch)
+
+            # hold on to it for its PBN
+            if early and epoch.pben is None:
+                self.awaiting[key] = epoch
+                if len(self.awaiting) > self.window:
+                    del self.awaiting[min(self.awaiting)]
+        return epochs
+
+###############################################################################
+# Flush -- the messages have stopped (end of a replay, a lost receiver, or
+# we're exiting), so no newer data will come to make the waiting epochs
+# stale.  Hand back all of them that have their MBN set, in order, as if
+# they had timed out; the rest are dropped.
+###############################################################################
+    def Flush(self):
+        epochs = self.Ready(flush=True)
+        self.awaiting.clear()
+        return epochs
+
+###############################################################################
+# Updates -- hand back the epochs whose PBN arrived after Ready() had
+# already handed them back (low latency mode only)
+###############################################################################
+    def Updates(self):
+        (epochs, self.updates) = (self.updates, [])
+        return epochs
+
+# end of ashepoch.py
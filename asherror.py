@@ -48,6 +48,16 @@ class AshtechError:
         def real_handler(signum, frame):
             # restore the original signal handler
             signal.signal(signal.SIGINT, self.original_sigint)
+            if self.g.messages:		# epochs still being assembled
+                self.g.messages.FlushEpochs()
+            if self.g.sinks:
+                self.g.sinks.close()
+            if self.g.capture:
+                self.g.capture.close()
+            if self.g.obs_writer:
+                self.g.obs_writer.close()
+            if self.g.obs_compressor:
+                self.g.obs_compressor.close()
             self.stats()
             sys.exit(1)
             try:
@@ -75,4 +85,6 @@ class AshtechError:
                 string += "; wrote {} epochs to {}".format(
                     self.g.obs_epoch_count, self.g.obs_filename)
         print(string)
+        if self.g.sinks:
+            self.g.sinks.report()
         print()
@@ -163,7 +163,7 @@ class AshtechFile:
         filebuf.write(bytearray(CombinedFileHeader))
 
         modem = XMODEM1k(self.Serial.getc, self.Serial.putc)
-        self.Serial.serial.read(1000)
+        self.Serial.reset_input()
         QueryString = str.encode("$PASHQ,BLK,%X,%X\n\r" % (SegBeg, filelen))
         self.Serial.serial.timeout = 2
 
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashframe.py    #################################
+
+from ashutil import *
+
+
+###############################################################################
+# AshtechFramer -- find message boundaries in the receiver byte stream.
+#
+# Every response starts with "$PASHR,XXX," where XXX is the message type.
+# The binary messages have a fixed length, so rather than searching for the
+# next "$PASHR" (which can turn up inside the binary payload) we count bytes
+# and check the checksum.  If the checksum fails we assume we locked onto a
+# false header and search again one byte further on.  ASCII responses run
+# to the CRLF.
+#
+# A "frame" is the message from the "$" through the checksum, without the
+# trailing CRLF.
+###############################################################################
+class AshtechFramer:
+    HEADER = b'$PASHR,'
+    HEADER_LEN = 11			# "$PASHR,MPC,"
+
+    # message type: (payload length, checksum length)
+    # these are struct.calcsize() of mben_struct and pben_struct in
+    # ashglobal.py; the manual's 95 bytes for MPC includes the checksum
+    BINARY_LENGTHS = {
+        b'MPC': (94, 1),
+        b'PBN': (54, 2),
+    }
+
+    # longest ASCII response we'll wait for before giving up on it
+    MAX_LINE = 1024
+
+    def __init__(self):
+        self.frames = 0			# good frames found
+        self.bad_frames = 0		# false headers / checksum failures
+
+###############################################################################
+# scan -- look for a complete frame in buf (bytes, bytearray or mmap)
+# starting at pos.  Returns (start, end):
+#   start -- index of the first byte worth keeping; anything before it
+#            is garbage
+#   end   -- index just past the frame's checksum, or None if the frame
+#            starting at "start" hasn't completely arrived yet
+###############################################################################
+    def scan(self, buf, pos=0):
+        header = self.HEADER
+        view = memoryview(buf)
+        size = len(buf)
+
+        while True:
+            start = buf.find(header, pos)
+            if start < 0:
+                # keep a possible partial header at the end
+                return max(pos, size - len(header) + 1), None
+
+            msg_type = bytes(view[start + 7:start + 10])
+            lengths = self.BINARY_LENGTHS.get(msg_type)
+
+            if lengths:
+                (length, chklen) = lengths
+                data = start + self.HEADER_LEN
+                end = data + length + chklen
+                if end > size:
+                    return start, None
+                if verify_chksum(view[data:end - chklen],
+                                 view[end - chklen:end]):
+                    self.frames += 1
+                    return start, end
+                # false header or corrupted message; resync
+                self.bad_frames += 1
+                pos = start + 1
+                continue
+
+            # ASCII -- runs to CRLF, unless a new header shows up first
+            eol = buf.find(b'\r\n', start)
+            next_header = buf.find(header, start + 1, start + self.MAX_LINE)
+            if 0 <= next_header and (eol < 0 or next_header < eol):
+                # truncated message
+                self.bad_frames += 1
+                pos = next_header
+                continue
+            if eol < 0:
+                if size - start > self.MAX_LINE:
+                    self.bad_frames += 1
+                    pos = start + 1
+                    continue
+                return start, None
+            self.frames += 1
+            return start, eol
+
+###############################################################################
+# iter_frames -- generator yielding every frame in a complete buffer (e.g.,
+# a file read into memory or mmapped) as a memoryview, without copying.
+###############################################################################
+    def iter_frames(self, buf):
+        view = memoryview(buf)
+        pos = 0
+        while True:
+            start, end = self.scan(buf, pos)
+            if end is None:
+                return
+            yield view[start:end]
+            pos = end
+
+###############################################################################
+# split_frame -- return (message type, payload including checksum) for a
+# frame returned by scan/iter_frames/next_frame
+###############################################################################
+def split_frame(frame):
+    msg_type = bytes(frame[7:10]).decode('ascii', 'replace').strip()
+    payload = frame[AshtechFramer.HEADER_LEN:]
+    return msg_type, payload
+
+# end of ashframe.py
@@ -34,7 +34,15 @@ class AshtechGlobals:
     ###############################################################################
     ###############################################################################
     def __init__(self):
-        pass
+        # the per-receiver state below is defined at class level; give each
+        # instance its own copies of the mutable parts so that several
+        # receivers can run in one process (see ashdaemon.py)
+        self.opts = dict.fromkeys(self.opt_keys, None)
+        self.mben_list = [None] * 33
+        self.mben_flag_list = [None] * 33
+        self.current_pben = dict.fromkeys(self.pben_keys, None)
+        self.current_fix = [None]
+        self.epoch_data = [self.mben_list, self.current_pben]
 
 ###############################################################################
 # Constants
@@ -73,12 +81,17 @@ class AshtechGlobals:
                 'elmask', 'dopmask', 'site_name', 'project_name', 'msg_rate',
                 'operator', 'comment', 'marker', 'marker_number', 'observer',
                 'agency', 'rx_number', 'antenna_number', 'antenna_type',
-                'antenna_height', 'antenna_east', 'antenna_north']
+                'antenna_height', 'antenna_east', 'antenna_north',
+                'capture', 'epoch_timeout', 'epoch_window',
+                'low_latency', 'rinex_sync', 'rotate', 'compress',
+                'crx', 'rinex_version', 'json', 'publish', 'sink_queue',
+                'store']
 
     opts = dict.fromkeys(opt_keys, None)  # make empty dict
 
     rx_type = None					# set by QueryRID()
     rx_ser_num = None				# set by QueryRID() if rx_type = "UZ"
+    rx_id = None					# full QueryRID() response
 
 ###############################################################################
 # mben measurement has the key observation data.  There is one data dictionary
@@ -96,7 +109,9 @@ class AshtechGlobals:
 		B d d l l B B c B B d d l l"""
 
     # any data munging is done in the parse_mben function and presented
-    # here (ie, this is not raw Z12 data).
+    # here (ie, this is not raw Z12 data).  The records themselves are
+    # MbenRecord and PbenRecord objects (see ashrecord.py), which also
+    # answer to these names as keys.
     mben_keys = [
         'seq', 'struct_left', 'prn', 'el', 'az', 'ch_id',
 
@@ -107,7 +122,7 @@ class AshtechGlobals:
         'l1_phase', 'l1_range', 'l1_dopp', 'l1_correction',
 
         'l2_warn', 'l2_goodbad', 'l2_spare', 'l2_snr', 'l2_qual',
-        'l2_phase', 'l2_range', 'l2_dopp', 'l1_correction']
+        'l2_phase', 'l2_range', 'l2_dopp', 'l2_correction']
 
     mben_flag_keys = [
         'ca_phase_lli', 'ca_phase_sbyte',
@@ -128,9 +143,6 @@ class AshtechGlobals:
 
     mben_list = [None] * 33         # current observables; index = PRN (1-32)
     mben_flag_list = [None] * 33    # current observables; index = PRN
-    mben_list_full = False          # keep track of messages per epoch
-    current_mben_epoch = GPS_Time(0, 0)  # set in parse_mben()
-    current_mben_epoch_string = ""
 
 ###############################################################################
 # pben is "navigation" message which includes time of week, llh, vlvlvh,
@@ -142,9 +154,6 @@ class AshtechGlobals:
                  'velx', 'vely', 'velz', 'drift', 'pdop']
 
     current_pben = dict.fromkeys(pben_keys, None)  # make empty dict
-    new_pben = False        # toggles in MsgSwitch
-    current_pben_epoch = GPS_Time(0, 0)  # set in parse_pben()
-    current_pben_epoch_string = ""  # set in parse_pben()
     current_fix = [None]
 
     # this contains all the data for one epoch
@@ -152,8 +161,9 @@ class AshtechGlobals:
 
 ###############################################################################
 # time stuff
-    first_observation = GPS_Time(0, 0)     # set in parse_pben()
-    first_observation_string = ""  # set in parse_pben()
+    current_epoch = GPS_Time(0, 0)         # set in WriteEpoch()
+    first_observation = GPS_Time(0, 0)     # set in WriteEpoch()
+    first_observation_string = ""  # set in WriteEpoch()
 
     # these have to be available in the exit hanlder. how???
     start_time = None			# set in main()
@@ -168,6 +178,11 @@ class AshtechGlobals:
 # stuff for building RINEX files
 ###############################################################################
     obs_filename = ""						# from create_obs_file()
+    obs_writer = None						# from create_obs_file()
+    obs_compressor = None					# from check_rotation()
+    capture = None						# from start_capture()
+    sinks = None						# from start_sinks()
+    messages = None						# from AshtechMessages()
     wrote_rinex_obs_file_header = False		# set by write_rinex_obs_epoch()
 
 ###############################################################################
@@ -193,6 +208,8 @@ class AshtechGlobals:
 #
 # The mben messages are output first and take a second or so.  The pben
 # messge comes about 3 seconds later.  This might change depending on
-# what other messages the receiver is outputting.
+# what other messages the receiver is outputting.  At short message
+# intervals the next epoch's mben messages can arrive before the pben, so
+# ashepoch.py keeps several epochs in progress and matches them by time.
 
 # end of ashglobals.py
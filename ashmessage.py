@@ -26,6 +26,10 @@ from ashposition import *
 from ashtime import *
 from ashrinex import *
 from ashglobal import *
+from ashframe import *
+from ashrecord import *
+from ashepoch import *
+from ashsink import *
 
 
 class AshtechMessages:
@@ -39,6 +43,16 @@ class AshtechMessages:
         self.RINEX = rinex
         self.verbose = verbose
 
+        # pairs up MBN and PBN messages (see ashepoch.py)
+        self.Epochs = AshtechEpochAssembler(
+            self.g.opts.get('epoch_timeout') or EPOCH_TIMEOUT,
+            self.g.opts.get('epoch_window') or EPOCH_WINDOW,
+            bool(self.g.opts.get('low_latency')), verbose)
+
+        # where finished epochs go (see ashsink.py)
+        self.Sinks = start_sinks(self.g, rinex)
+        self.g.messages = self			# for the exit handlers
+
 ###############################################################################
 ###############################################################################
 # MsgSwitch -- sit on serial port and hand messages off to appropriate handler
@@ -46,223 +60,150 @@ class AshtechMessages:
 ###############################################################################
     def MsgSwitch(self, verbose=False):
 
-        self.SerPort.inter_byte_timeout = 5  # tenths of second?
-        delimiter = b'$PASHR'
-
         self.SerPort.reset_input()		# clear out garbage
-        while True:
-            message = self.SerPort.read_anything(delimiter, 0)
-            if len(message) > 9:  # ignore leftover b'$PASHR' in buffer
-
-                # strip crlf and beyond from end
-                if (message[-8:] == b'\r\n$PASHR'):
-                    message = message[:-8]
-                # sometimes we don't get the $PASHR part
-                elif (message[-2:] == b'\r\n'):
-                    message = message[:-2]
-                else:
-                    print("Bad message trailer: \"", message[-8:], "\"")
-                    continue
-
-                # extract message type, strip whitespace
-                msg_type = message[1:4].decode('ascii')
-                msg_type = msg_type.strip()
-                # trim off msg type including comma, leave checksum byte(s)
-                payload = message[5:]
-
-                if verbose:
-                    print ("msg_type:", msg_type, "length:", len(payload))
-                if msg_type == 'MPC':
-                    self.parse_mben(payload, verbose)
-                elif msg_type == 'PBN':
-                    self.parse_pben(payload, verbose)
-                elif msg_type == 'SNV':
-                    pass  # self.parse_snav(payload,verbose)
-                elif msg_type == 'SAL':
-                    pass  # self.parse_salm(payload,verbose)
-                elif msg_type == 'EPB':
-                    pass  # self.parse_epb(payload,verbose)
-                elif msg_type == 'RPC':
-                    pass  # self.parse_dben(payload,verbose)
-                elif msg_type == 'DAL':
-                    pass  # not processed here
-                else:
-                    print("Message type", msg_type, "is unknown!")
-
-            # test whether we're ready to print a RINEX epoch
-            # mben_list_full means we have all the SV data for an epoch
-            if self.g.mben_list_full:
-                # new_pben means we have a pben message
-                if self.g.new_pben:
-                    # but it might have prior epoch
-                    if (self.g.current_mben_epoch_string !=
-                            self.g.current_pben_epoch_string):
-                        # so ignore it
-                        self.g.new_pben = False
-                        if verbose:
-                            print(str(datetime.datetime.utcnow().time())[:-5],
-                                  "epoch mismatch!",
-                                  "mben:", self.g.current_mben_epoch_string,
-                                  "pben:", self.g.current_pben_epoch_string)
-                        continue
-                    else:
-
-                        if verbose:
-                            print(str(datetime.datetime.utcnow().time())[:-5],
-                                  "mben:", self.g.current_mben_epoch_string,
-                                  "pben:", self.g.current_pben_epoch_string)
-                            print("Off to RINEX...")
-
-                        self.RINEX.write_rinex_obs()
-
-                        # we're done with mben, so
-                        # clear for another cycle
-                        self.g.mben_list_full = False
-                        self.g.mben_list = [None] * 33  # 1 - 32
-
-                # we never reuse pben
-                self.g.new_pben = False
+        try:
+            while True:
+                # one "$PASHR,..." message, framed by length and checksum
+                message = self.SerPort.next_frame()
+                self.HandleFrame(message, verbose)
+        except EOFError:			# end of a replay
+            self.FlushEpochs(verbose)
+            raise
+
+        return
+
+###############################################################################
+# HandleFrame -- dispatch one message (b'' on timeout) to its parser and
+# pass on any epochs that completed.  Shared by MsgSwitch and the
+# asyncio message loop in ashasync.py.
+###############################################################################
+    def HandleFrame(self, message, verbose=False):
+
+        if message:
+            # message type, and payload including checksum byte(s)
+            (msg_type, payload) = split_frame(message)
+
+            if verbose:
+                print ("msg_type:", msg_type, "length:", len(payload))
+            if msg_type == 'MPC':
+                self.parse_mben(payload, verbose)
+            elif msg_type == 'PBN':
+                self.parse_pben(payload, verbose)
+            elif msg_type == 'SNV':
+                pass  # self.parse_snav(payload,verbose)
+            elif msg_type == 'SAL':
+                pass  # self.parse_salm(payload,verbose)
+            elif msg_type == 'EPB':
+                pass  # self.parse_epb(payload,verbose)
+            elif msg_type == 'RPC':
+                pass  # self.parse_dben(payload,verbose)
+            elif msg_type == 'DAL':
+                pass  # not processed here
+            else:
+                print("Message type", msg_type, "is unknown!")
+
+        # write out whatever epochs the messages finished (see ashepoch.py)
+        for epoch in self.Epochs.Ready():
+            self.WriteEpoch(epoch, verbose)
+        for epoch in self.Epochs.Updates():
+            self.UpdateEpoch(epoch, verbose)
 
         return
 
+###############################################################################
+# FlushEpochs -- the messages have stopped, so write out the epochs still
+# being assembled (see AshtechEpochAssembler.Flush)
+###############################################################################
+    def FlushEpochs(self, verbose=False):
+
+        for epoch in self.Epochs.Flush():
+            self.WriteEpoch(epoch, verbose)
+
+###############################################################################
+# WriteEpoch -- hand an assembled epoch to the outputs (see ashsink.py);
+# the RINEX sink makes it the current one and writes it
+###############################################################################
+    def WriteEpoch(self, epoch, verbose=False):
+
+        if verbose:
+            print(str(datetime.datetime.utcnow().time())[:-5],
+                  "epoch:", epoch.gps_time().timestring(),
+                  "pben:", epoch.pben is not None)
+            print("Off to the outputs...")
+
+        self.Sinks.put(epoch)
+
+###############################################################################
+# UpdateEpoch -- the PBN for an epoch already written in low latency mode.
+# The RINEX record stays as written (it used the last known position);
+# this brings the current position up to date and tells the other outputs.
+###############################################################################
+    def UpdateEpoch(self, epoch, verbose=False):
+
+        self.g.current_pben = epoch.pben
+        self.Sinks.put(epoch, update=True)
+
+        if verbose:
+            print(str(datetime.datetime.utcnow().time())[:-5],
+                  "late pben for epoch:",
+                  epoch.gps_time().timestring())
+
 ###############################################################################
 # parse_mben -- parse measurement binary response ($PASHQ,MBN)
-# returns a dict with a header as the first item, followed by 1 to 3 items
-# depending on which observations were made.  Raw values are converted to
-# properly scaled ones.
+# and file it as an MbenRecord (see ashrecord.py) with its epoch, indexed
+# by PRN.  Raw values are converted to properly scaled ones.
 ###############################################################################
     def parse_mben(self, message, verbose=False):
-        LIGHTSPEED = self.g.LIGHTSPEED		# speed of light, km/s
-        Z12_SNR_SCALE = self.g.Z12_SNR_SCALE  # scale to sensible range
 
         # first, strip off checksum byte and test
+        message = memoryview(message)
         chksum = message[-1:]
         message = message[:-1]
         if not verify_chksum(message, chksum):
             print("Checksum error!")
             return
 
-        # message structure and keys defined in ashglobal.py
+        # message structure and keys defined in ashglobal.py; values are
+        # converted and flags made by MbenRecord (see ashrecord.py)
         try:
-            mben_list = struct.unpack(self.g.mben_struct, message)
-        except:
+            mben = MbenRecord.decode(message)
+        except struct.error:
             print("Corrupted mben record!")
             return
-        mben_dict = dict(zip(self.g.mben_keys, mben_list))
-        mben_flag_list = [None] * 33
-        mben_flag_dict = dict(zip(self.g.mben_flag_keys, mben_flag_list))
 
-        prn = mben_dict['prn']
+        prn = mben.prn
 
         if not prn in range(1, 32):
             return
 
-        # convert "seq" (unit: 50ms modulo 30 minutes) to real time
-        seq = int(mben_dict['seq'])
-        # get current gps time (set by pben)
-        temp = GPS_Time(self.g.gps_week, self.g.gps_tow)
-        # use that plus seq to get epoch tow
-        seq_seconds = temp.time_from_seq(self.g.gps_week, self.g.gps_tow, seq)
-        # turn tow and gps_week into epoch time
-        self.g.current_mben_epoch = GPS_Time(self.g.gps_week, seq_seconds)
-        self.g.current_mben_epoch_string = \
-            GPS_Time(self.g.gps_week, seq_seconds).timestring()
-
-        # convert values (formulas from Lady Heather -- thanks, Mark!)
-        mben_dict['az'] = mben_dict['az'] * 2
-        mben_dict['ca_snr'] /= Z12_SNR_SCALE
-        mben_dict['l1_snr'] /= Z12_SNR_SCALE
-        mben_dict['l2_snr'] /= Z12_SNR_SCALE
-
-        # see below for phase processing
-
-        mben_dict['ca_range'] *= (LIGHTSPEED * 1000.0)
-        mben_dict['l1_range'] *= (LIGHTSPEED * 1000.0)
-        mben_dict['l2_range'] *= (LIGHTSPEED * 1000.0)
-
-        mben_dict['ca_dopp'] /= 10000.0
-        mben_dict['l1_dopp'] /= 10000.0
-        mben_dict['l2_dopp'] /= 10000.0
-
-        # add the lli values to mben_flag_dict; one flag for
-        # each of ca, l1, l2 so calc once copy thrice
-        flag_tmp = make_lli(mben_dict['ca_warn'], mben_dict['ca_goodbad'])
-        mben_flag_dict['ca_phase_lli'] = \
-            mben_flag_dict['ca_range_lli'] = \
-            mben_flag_dict['ca_dopp_lli'] = \
-            flag_tmp
-
-        flag_tmp = make_lli(mben_dict['l1_warn'], mben_dict['l1_goodbad'])
-        mben_flag_dict['l1_phase_lli'] = \
-            mben_flag_dict['l1_range_lli'] = \
-            mben_flag_dict['l1_dopp_lli'] = \
-            flag_tmp
-
-        flag_tmp = make_lli(mben_dict['l2_warn'], mben_dict['l2_goodbad'])
-        mben_flag_dict['l2_phase_lli'] = \
-            mben_flag_dict['l2_range_lli'] = \
-            mben_flag_dict['l2_dopp_lli'] = \
-            flag_tmp
-
-        # fix phase overflows and update lli if necessary
-        mben_dict['ca_phase'], mben_flag_dict['ca_phase_lli'] = \
-            fixphase(mben_dict['ca_phase'], mben_flag_dict['ca_phase_lli'])
-        mben_dict['l1_phase'], mben_flag_dict['l1_phase_lli'] = \
-            fixphase(mben_dict['l1_phase'], mben_flag_dict['l1_phase_lli'])
-        mben_dict['l2_phase'], mben_flag_dict['l2_phase_lli'] = \
-            fixphase(mben_dict['l2_phase'], mben_flag_dict['l2_phase_lli'])
-
-        # add the sbyte values to mben_flag_dict; one flag for
-        # each of ca, l1, l2 so calc once copy thrice
-        sbyte_tmp = make_sbyte(mben_dict['ca_snr'])
-        mben_flag_dict['ca_phase_sbyte'] = \
-            mben_flag_dict['ca_range_sbyte'] = \
-            mben_flag_dict['ca_dopp_sbyte'] = \
-            sbyte_tmp
-
-        sbyte_tmp = make_sbyte(mben_dict['l1_snr'])
-        mben_flag_dict['l1_phase_sbyte'] = \
-            mben_flag_dict['l1_range_sbyte'] = \
-            mben_flag_dict['l1_dopp_sbyte'] = \
-            sbyte_tmp
-
-        sbyte_tmp = make_sbyte(mben_dict['l2_snr'])
-        mben_flag_dict['l2_phase_sbyte'] = \
-            mben_flag_dict['l2_range_sbyte'] = \
-            mben_flag_dict['l2_dopp_sbyte'] = \
-            sbyte_tmp
-
-        self.g.mben_list[prn] = mben_dict
-        self.g.mben_flag_list[prn] = mben_flag_dict
+        # "seq" (unit: 50ms modulo 30 minutes) gives the epoch time,
+        # which the assembler works out from the last PBN's tow
+        epoch = self.Epochs.AddMben(mben)
+        if epoch is None:
+            if verbose:
+                print("late MBN for prn", prn, "seq", mben.seq)
+            return
 
         if verbose:
             print()
-            print("Epoch:", epoch)
-            mbn = "MBN" + str(mben_dict['struct_left'])
-            print(mbn, "seq:", mben_dict['seq'], "prn:", mben_dict['prn'],
-                  "el:", mben_dict['el'], "az:", mben_dict['az'],
-                  "ch_id:", mben_dict['ch_id'])
-            print("CA:", mben_dict['ca_qual'], mben_dict['ca_snr'],
-                  mben_dict['ca_phase'], mben_dict['ca_prange'],
-                  mben_dict['ca_dop'])
-            print("L1:", mben_dict['l1_qual'], mben_dict['l1_snr'],
-                  mben_dict['l1_phase'], mben_dict['l1_prange'],
-                  mben_dict['l1_dop'])
-            print("L2:", mben_dict['l2_qual'], mben_dict['l2_snr'],
-                  mben_dict['l2_phase'], mben_dict['l2_prange'],
-                  mben_dict['l2_dop'])
-            if mben_dict['struct_left'] == 0:
+            print("Epoch:", epoch.gps_time().timestring())
+            mbn = "MBN" + str(mben.struct_left)
+            print(mbn, "seq:", mben.seq, "prn:", mben.prn,
+                  "el:", mben.el, "az:", mben.az,
+                  "ch_id:", mben.ch_id)
+            print("CA:", mben.ca_qual, mben.ca_snr,
+                  mben.ca_phase, mben.ca_range, mben.ca_dopp)
+            print("L1:", mben.l1_qual, mben.l1_snr,
+                  mben.l1_phase, mben.l1_range, mben.l1_dopp)
+            print("L2:", mben.l2_qual, mben.l2_snr,
+                  mben.l2_phase, mben.l2_range, mben.l2_dopp)
+            if mben.struct_left == 0:
                 print("PRNs in this epoch:", end=' ', flush=True)
-                for i in self.g.mben_list:
+                for i in epoch.mben_list:
                     if i != None:
-                        print(i['prn'], end=' ', flush=True)
+                        print(i.prn, end=' ', flush=True)
                 print()
 
-        if mben_dict['struct_left'] == 0:  # last message for this epoch
-            if verbose:
-                print("setting mben_list_full")
-            self.g.mben_list_full = True
-
         return
 
 ###############################################################################
@@ -271,11 +212,8 @@ class AshtechMessages:
 ###############################################################################
     def parse_pben(self, message, verbose=False):
 
-        # only get pben after we've received the first mben
-        if not self.g.current_mben_epoch_string:
-            return
-
         # first, strip off checksum bytes and test
+        message = memoryview(message)
         chksum = message[-2:]
         message = message[:-2]
         if not verify_chksum(message, chksum):
@@ -284,40 +222,25 @@ class AshtechMessages:
 
         # message structure and keys defined in ashglobal.py
         try:
-            vallist = list(struct.unpack(self.g.pben_struct, message))
-        except:
+            pben = PbenRecord.decode(message)
+        except struct.error:
             print("Corrupted pben record!")
             return
-        pben_dict = dict(zip(self.g.pben_keys, vallist))
-
-        pben_dict['tow'] = pben_dict['tow'] / 1000.0
-        pben_dict['site'] = pben_dict['site'].decode('ascii')
-        pben_dict['pdop'] = pben_dict['pdop'] / 100.0
-        self.g.current_pben = pben_dict
+        self.g.current_pben = pben
 
-        fix = Position(pben_dict['navx'], pben_dict['navy'], pben_dict['navz'])
+        fix = Position(pben.navx, pben.navy, pben.navz)
         self.g.current_fix = fix
 
-        self.g.gps_tow = pben_dict['tow']
+        self.g.gps_tow = pben.tow
 
         # have we entered a new week?
-        if pben_dict['tow'] < self.g.last_tow:
+        if pben.tow < self.g.last_tow:
             self.g.gps_week += 1
-            print("New GPS week: {}".format(self.gps_week))
+            print("New GPS week: {}".format(self.g.gps_week))
         self.g.last_tow = self.g.gps_tow
 
-        self.g.current_pben_epoch = \
-            GPS_Time(self.g.gps_week, self.g.gps_tow)
-
-        self.g.current_pben_epoch_string = \
-            GPS_Time(self.g.gps_week, self.g.gps_tow).timestring()
-
-        if not self.g.first_observation_string:
-            self.g.first_observation = self.g.current_pben_epoch
-            self.g.first_observation_string = self.g.current_pben_epoch_string
-
-        # set flag for MsgSwitch
-        self.g.new_pben = True
+        # file it with its MBNs (see ashepoch.py)
+        self.Epochs.AddPben(pben, gps_ms(self.g.gps_week, self.g.gps_tow))
 
         if verbose:
             #			print("navx,navy,navz:",navx,navy,navz)
@@ -329,16 +252,16 @@ class AshtechMessages:
             print(fix.ddmmssxxx_string_list())
             print()
             print("PBN:   %6.0f %4s %7.2f %7.2f %7.2f" %
-                  (pben_dict['tow'], pben_dict['site'], pben_dict['navx'],
-                   pben_dict['navy'], pben_dict['navz']))
+                  (pben.tow, pben.site, pben.navx,
+                   pben.navy, pben.navz))
             print("       %5.4f %.4E %.4E %.4E %3.5f, %1.2f" %
-                  (pben_dict['offset'], pben_dict['velx'], pben_dict['vely'],
-                   pben_dict['velz'], pben_dict['drift'], pben_dict['pdop']))
+                  (pben.offset, pben.velx, pben.vely,
+                   pben.velz, pben.drift, pben.pdop))
             print()
             print("WGS84:", fix.ddmmxxx_string_list())
-            print("current epoch seconds:", pben_dict['tow'])
+            print("current epoch seconds:", pben.tow)
 
-        return fix, pben_dict['tow']
+        return fix, pben.tow
 
 ###############################################################################
 # parse_salm -- parse almanac binary response ($PASHQ,SLM)
@@ -416,28 +339,21 @@ class AshtechMessages:
         # after we get one.
 
         # enable NMEA output
-        self.Commands.SetCommand("OUT,A,NMEA")
-        time.sleep(1)
+        self.Commands.SetCommand("OUT,A,NMEA", ack=True)
 
         # set sentence rate to every 20 seconds, so we
         # have time to turn it off before getting flooded
-        self.Commands.SetCommand("NME,PER,20")
-        time.sleep(1)
+        self.Commands.SetCommand("NME,PER,20", ack=True)
 
         # start streaming DAL sentence
-        self.Commands.SetCommand("NME,DAL,A,ON")
-        time.sleep(1)
-
-        self.SerPort.reset_input()		# clear out garbage
+        self.Commands.SetCommand("NME,DAL,A,ON", ack=True)
 
         gps_week = 0
-        messasge = b''
         while not gps_week:
-            # get one sentence
-            time.sleep(0.1)
-            message = self.SerPort.read_line()
-            if message:
-                response = message.split(b',')
+            # get one sentence, skipping any other NMEA output
+            message = self.SerPort.next_frame()
+            if split_frame(message)[0] == 'DAL':
+                response = message[7:].split(b',')
 
                 # Wn is contained in field 13 before "*" and checksum,
                 # except some receivers don't include the checksum
@@ -447,7 +363,7 @@ class AshtechMessages:
                     gps_week = response[13]
 
         # turn off NMEA sentences
-        self.Commands.SetCommand("NME,ALL,A,OFF")
+        self.Commands.SetCommand("NME,ALL,A,OFF", ack=True)
         self.SerPort.reset_input()		# clear out leftovers
 
         if verbose:
@@ -35,7 +35,17 @@ class AshtechOpts:
 ###############################################################################
 # getargs -- get command line arguments and supply defaults
 ###############################################################################
-    def getargs(self):
+    def getargs(self, argv=None):
+        args = self.parser()
+        self.g.opts = vars(args.parse_args(argv))
+
+        return
+
+###############################################################################
+# parser -- build the argument parser.  ashdaemon.py also uses it to
+# check and convert the options in its station list.
+###############################################################################
+    def parser(self):
         args = argparse.ArgumentParser()
 
         def str2bool(v):
@@ -48,6 +58,17 @@ class AshtechOpts:
             else:
                 raise argparse.ArgumentTypeError('Boolean value expected.')
 
+        def sync_policy(v):
+            if v in ('epoch', 'fsync', 'exit'):
+                return v
+            try:
+                if float(v) > 0:
+                    return v
+            except ValueError:
+                pass
+            raise argparse.ArgumentTypeError(
+                'epoch, fsync, exit or a number of seconds expected.')
+
         # setup options with defaults
         args.add_argument('-v', '--verbose', default='False', type=str2bool,
                           nargs='?', const=True, help='be verbose')
@@ -60,6 +81,42 @@ class AshtechOpts:
                           help='receiver hardware port')
         args.add_argument('-f', '--rinex_file', default='', type=str,
                           help='file name -- blank to auto-generate; \"NONE\" to skip')
+        args.add_argument('--capture', default='none', type=str,
+                          choices=['none', 'raw', 'zlib', 'lzma'],
+                          help='also record raw messages next to the RINEX file')
+        args.add_argument('--epoch_timeout', default=10, type=float,
+                          help='seconds to wait for an epoch\'s missing messages')
+        args.add_argument('--epoch_window', default=8, type=int,
+                          help='most epochs being assembled at once')
+        args.add_argument('--rinex_sync', default='epoch', type=sync_policy,
+                          help='when RINEX data goes to disk: epoch, fsync, '
+                          'exit, or every so many seconds')
+        args.add_argument('--rinex_version', default='2.11', type=str,
+                          choices=['2.11', '3.04'],
+                          help='RINEX version to write (default 2.11)')
+        args.add_argument('--crx', default='False', type=str2bool,
+                          nargs='?', const=True,
+                          help='write Compact RINEX (.yyd) files')
+        args.add_argument('--rotate', default='none', type=str,
+                          choices=['none', 'hourly', 'daily'],
+                          help='start a new RINEX file every hour or day')
+        args.add_argument('--compress', default='none', type=str,
+                          choices=['none', 'gzip', 'lzma'],
+                          help='compress RINEX files as they are finished')
+        args.add_argument('--json', default='', type=str,
+                          help='also write epochs to this file as JSON lines')
+        args.add_argument('--publish', default='', type=str,
+                          help='also send epochs as JSON lines to TCP '
+                          'clients on [host:]port')
+        args.add_argument('--store', default='', type=str,
+                          help='also write epochs to this columnar store '
+                          'directory (needs NumPy)')
+        args.add_argument('--sink_queue', default=100, type=int,
+                          help='epochs each output may fall behind before '
+                          'they are dropped')
+        args.add_argument('--low_latency', default='False', type=str2bool,
+                          nargs='?', const=True,
+                          help='write epochs without waiting for the PBN')
 
         # receiver configuration options
         args.add_argument('--elmask', default=10, type=int,
@@ -101,6 +158,4 @@ class AshtechOpts:
         args.add_argument('--antenna_north', default=0, type=float,
                           help='antenna northing')
 
-        self.g.opts = vars(args.parse_args())
-
-        return
+        return args
@@ -19,6 +19,7 @@
 
 ############################   ashposition.py    ###############################
 
+import sys
 import math
 
 class Position:
@@ -26,13 +27,26 @@ class Position:
     #        'lat_minute','lat_second_float','lon_float','lon_deg',
     #        'lon_minute_float','lon_minute','lon_second_float','height']
 
+    # one of these is made for every PBN, so no per-object dictionary
+    __slots__ = ['x', 'y', 'z', '_llh']
+
     def __init__(self, x, y, z):
         # x,y,z are ECEF coordinates
         self.x = x
         self.y = y
         self.z = z
+        self._llh = None
         return
 
+###############################################################################
+# llh -- lat, lon (decimal degrees) and height for x,y,z.  All the formats
+# below start from this, so it's only worked out the first time.
+###############################################################################
+    def llh(self):
+        if self._llh is None:
+            self._llh = self.ecef_to_wgs84(self.x, self.y, self.z)
+        return self._llh
+
     def xyz_float_list(self):
         return self.x, self.y, self.z
 
@@ -43,12 +57,10 @@ class Position:
         return lat, lon, height
 
     def ddxxx_float_list(self):
-        (lat, lon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
-        lat
-        return lat, lon, height
+        return self.llh()
 
     def ddxxx_string_list(self, x_places=6, y_places=6, z_places=3, quad=True):
-        (lat, lon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (lat, lon, height) = self.llh()
         lat = '{1:.{0}f}'.format(x_places, lat)
         lon = '{1:.{0}f}'.format(y_places, lon)
         height = '{1:.{0}f}M'.format(z_places, height)
@@ -65,13 +77,13 @@ class Position:
         return lat, lon, height
 
     def ddmmxxx_float_list(self):
-        (lat, lon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (lat, lon, height) = self.llh()
         (latdeg, latmin) = self.decdeg_to_dm(lat)
         (londeg, lonmin) = self.decdeg_to_dm(lon)
         return int(latdeg), latmin, int(londeg), lonmin, height
 
     def ddmmxxx_string_list(self, x_places=4, y_places=4, z_places=3, quad=True):
-        (rawlat, rawlon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (rawlat, rawlon, height) = self.llh()
         (latdeg, latmin) = self.decdeg_to_dm(rawlat)
         (londeg, lonmin) = self.decdeg_to_dm(rawlon)
 
@@ -95,7 +107,7 @@ class Position:
         return lat + " " + lon + " " + height
 
     def ddmmssxxx_float_list(self):
-        (lat, lon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (lat, lon, height) = self.llh()
         (latdeg, latmin, latsec) = self.decdeg_to_dms(lat)
         (londeg, lonmin, lonsec) = self.decdeg_to_dms(lon)
         return int(latdeg), int(latmin), latsec, \
@@ -103,7 +115,7 @@ class Position:
 
     def ddmmssxxx_string_list(self, x_places=3, y_places=3, 
             z_places=3, quad=True):
-        (rawlat, rawlon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (rawlat, rawlon, height) = self.llh()
         (latdeg, latmin, latsec) = self.decdeg_to_dms(rawlat)
         (londeg, lonmin, lonsec) = self.decdeg_to_dms(rawlon)
 
@@ -140,7 +152,7 @@ class Position:
         upper = 'ABCDEFGHIJKLMNOPQRSTUVWX'
         lower = 'abcdefghijklmnopqrstuvwx'
 
-        (lat, lon, height) = self.ecef_to_wgs84(self.x, self.y, self.z)
+        (lat, lon, height) = self.llh()
 
         if not (-180 <= lon < 180):
             sys.stderr.write(
@@ -236,8 +248,8 @@ class Position:
         return xEast, yNorth, zUp
 
     def geodetic_to_enu(self, lat, lon, h, lat_ref, lon_ref, h_ref):
-        x, y, z = geodetic_to_ecef(lat, lon, h)
-        return ecef_to_enu(x, y, z, lat_ref, lon_ref, h_ref)
+        x, y, z = self.geodetic_to_ecef(lat, lon, h)
+        return self.ecef_to_enu(x, y, z, lat_ref, lon_ref, h_ref)
 
 
 ###############################################################################
@@ -317,4 +329,59 @@ class Position:
                 seconds = -seconds
         return (degrees, minutes)
 
-# end of ashutils.py
+###############################################################################
+# NOT IN Position class
+###############################################################################
+# bulk_ecef_to_wgs84, bulk_ecef_to_enu -- Position.ecef_to_wgs84 and
+# Position.ecef_to_enu for whole arrays of fixes (e.g. the PBN messages
+# decoded by ashbulk.py) at once.  Need NumPy.
+###############################################################################
+
+
+def bulk_ecef_to_wgs84(x, y, z):
+    import numpy as np
+    a = 6378137.0				# see ecef_to_wgs84 above
+    b = 6356752.314245
+    f = (a - b) / a
+    e_sq = f * (2 - f)
+    eps = e_sq / (1.0 - e_sq)
+
+    (x, y, z) = (np.asarray(x, float), np.asarray(y, float),
+                 np.asarray(z, float))
+    p = np.hypot(x, y)
+    q = np.arctan2(z * a, p * b)
+    phi = np.arctan2(z + eps * b * np.sin(q) ** 3,
+                     p - e_sq * a * np.cos(q) ** 3)
+    v = a / np.sqrt(1.0 - e_sq * np.sin(phi) ** 2)
+
+    return (np.degrees(phi), np.degrees(np.arctan2(y, x)),
+            p / np.cos(phi) - v)
+
+
+def bulk_ecef_to_enu(x, y, z, lat0=0, lon0=0, h0=0):
+    import numpy as np
+    a = 6378137				# see ecef_to_enu above
+    b = 6356752.3142
+    f = (a - b) / a
+    e_sq = f * (2 - f)
+
+    lamb = math.radians(lat0)
+    phi = math.radians(lon0)
+    sin_lambda = math.sin(lamb)
+    cos_lambda = math.cos(lamb)
+    sin_phi = math.sin(phi)
+    cos_phi = math.cos(phi)
+    N = a / math.sqrt(1 - e_sq * sin_lambda * sin_lambda)
+
+    xd = np.asarray(x, float) - (h0 + N) * cos_lambda * cos_phi
+    yd = np.asarray(y, float) - (h0 + N) * cos_lambda * sin_phi
+    zd = np.asarray(z, float) - (h0 + (1 - e_sq) * N) * sin_lambda
+
+    east = -sin_phi * xd + cos_phi * yd
+    north = (-cos_phi * sin_lambda * xd - sin_lambda * sin_phi * yd +
+             cos_lambda * zd)
+    up = cos_lambda * cos_phi * xd + cos_lambda * sin_phi * yd + \
+        sin_lambda * zd
+    return east, north, up
+
+# end of ashposition.py
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+############################   ashreader.py    #################################
+
+# Reading RINEX 2.11 observation files back, as Rinex writes them, without
+# loading them: the file is memory-mapped and epochs are parsed as they're
+# asked for.
+#
+# The first time a file is opened it's scanned once to find the byte offset
+# and time of every epoch; that index is kept next to it in "<file>.idx" so
+# later opens don't scan at all.  read(start, end) then finds the first and
+# last epochs by bisecting the index and parses only what's in between, and
+# raw(start, end) hands back those bytes as they are.
+#
+# Index layout (little-endian): the header below, then "count" epoch times
+# (int64 ns since the GPS epoch, GPS time as in the file), then "count"
+# offsets (int64).  "size" and "mtime" are the file's when it was indexed
+# and "end" is how far the scan got.  A file that has only grown since (one
+# still being written) has its index extended from "end"; anything else
+# makes a new index.
+#
+# Run this file to cut a time window out of an observation file:
+#   ./ashreader.py N8UR2950.26o --start="2026-10-22 10:00" \
+#	--end="2026-10-22 11:00" -o N8UR295k.26o
+
+import os
+import sys
+import mmap
+import array
+import bisect
+import struct
+import argparse
+import datetime
+
+from ashtime import *
+
+INDEX_MAGIC = b'ASHIDX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<6sBxQqQQ')	# magic version size mtime end count
+
+
+###############################################################################
+# rinex_ns -- nanoseconds since the GPS epoch for the fields of a RINEX 2
+# epoch record (two digit year, "80" to "99" being 1900s)
+###############################################################################
+
+
+def rinex_ns(year, mon, mday, hour, minute, sec):
+    year = int(year)
+    if year < 80:
+        year += 2000
+    elif year < 100:
+        year += 1900
+    day = datetime.date(year, int(mon), int(mday)).toordinal() - GPS_EPOCH
+    (whole, _, fraction) = sec.strip().partition('.')
+    ns = int(whole) * 10**9 + int((fraction + '000000000')[:9])
+    return day * DAY_NS + (int(hour) * 60 + int(minute)) * 60 * 10**9 + ns
+
+###############################################################################
+# time_ns -- a read() time (GPS_Time, datetime in GPS time, or ns) in ns
+###############################################################################
+
+
+def time_ns(when):
+    if isinstance(when, GPS_Time):
+        return when.week * WEEK_NS + when.ns
+    if isinstance(when, datetime.datetime):
+        return rinex_ns(when.year, when.month, when.day, when.hour,
+                        when.minute, "{}.{:06d}".format(when.second,
+                                                         when.microsecond))
+    return int(when)
+
+
+class RinexObsEpoch:
+    __slots__ = ['time', 'flag', 'clock', 'sats', 'obs', 'lines', 'offset',
+                 'end']
+
+###############################################################################
+# RinexObsEpoch -- one epoch: its GPS_Time, the epoch flag, the receiver
+# clock offset (None if not given), the satellites ("G05"...) and, for each,
+# a list of (value, LLI, signal strength) in the file's observable order.
+# Blank fields are None.  An event (flags 2-5) has no satellites, lines
+# holding the header records that follow it, and may have no time (None).
+# offset and end are where the record starts and ends in the file.
+###############################################################################
+    def get(self, sat, obs_type, types):
+        return self.obs[self.sats.index(sat)][types.index(obs_type)][0]
+
+    def __repr__(self):
+        return "RinexObsEpoch({}, flag={}, sats={})".format(
+            self.time.timestring(), self.flag, len(self.sats))
+
+
+class RinexObsReader:
+
+###############################################################################
+# RinexObsReader -- an observation file, mapped, with its header read and
+# its epochs indexed.  Raises ValueError if it isn't RINEX 2 observations.
+# index=False keeps the index in memory only.
+###############################################################################
+    def __init__(self, filename, index=True):
+        self.filename = filename
+        self.index_name = filename + ".idx"
+        self.file = open(filename, 'rb')
+        stat = os.fstat(self.file.fileno())
+        if not stat.st_size:
+            raise ValueError("empty file")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+
+        self.read_header()
+        self.keys = array.array('q')		# epoch times, ns
+        self.offsets = array.array('q')		# ... and where they start
+        self.end = self.header_end		# how far we've indexed
+
+        if not (index and self.load_index()):
+            self.scan()
+            if index:
+                self.save_index()
+
+###############################################################################
+# read_header -- version, observable types and where the header ends
+###############################################################################
+    def read_header(self):
+        self.types = []
+        pos = 0
+        while True:
+            eol = self.map.find(b'\n', pos)
+            if eol < 0:
+                raise ValueError("no END OF HEADER")
+            line = self.map[pos:eol].decode('ascii', 'replace').rstrip('\r')
+            pos = eol + 1
+            label = line[60:].strip()
+            if label == "RINEX VERSION / TYPE":
+                self.version = float(line[:9])
+                if int(self.version) != 2 or line[20:21] != 'O':
+                    raise ValueError("not a RINEX 2 observation file")
+            elif label == "# / TYPES OF OBSERV":
+                if line[:6].strip():
+                    self.ntypes = int(line[:6])
+                for n in range(6, 60, 6):
+                    if line[n:n + 6].strip():
+                        self.types.append(line[n:n + 6].strip())
+            elif label == "END OF HEADER":
+                break
+        if not self.types:
+            raise ValueError("no # / TYPES OF OBSERV")
+        self.header_end = pos
+        self.lines_per_sat = (len(self.types) + 4) // 5
+
+###############################################################################
+# scan -- index the epochs from self.end on.  Stops at the end of the file,
+# or before an epoch that isn't all there yet.
+###############################################################################
+    def scan(self):
+        data = self.map
+        size = len(data)
+        pos = self.end
+        while pos < size:
+            start = pos
+            eol = data.find(b'\n', pos)
+            if eol < 0:
+                break
+            line = data[pos:eol]
+            pos = eol + 1
+            if not line.strip():
+                self.end = pos
+                continue
+            try:
+                flag = int(line[28:29] or b'0')
+                count = int(line[29:32])
+            except ValueError:
+                raise ValueError("bad epoch record at byte {}".format(start))
+
+            # events (2-5) are followed by count header lines; epochs
+            # (0, 1 and 6) by any more satellites and their observations
+            if flag in (2, 3, 4, 5):
+                lines = count
+            else:
+                lines = (count - 1) // 12 + count * self.lines_per_sat
+            for n in range(lines):
+                eol = data.find(b'\n', pos)
+                if eol < 0:
+                    break
+                pos = eol + 1
+            if eol < 0:
+                break
+
+            if flag not in (2, 3, 4, 5):
+                self.keys.append(rinex_ns(line[1:3], line[4:6], line[7:9],
+                                          line[10:12], line[13:15],
+                                          line[15:26].decode('ascii')))
+                self.offsets.append(start)
+            self.end = pos
+
+###############################################################################
+# load_index -- use the sidecar index if it still fits the file, extending
+# it if the file has grown.  Returns False if it has to be rebuilt.
+###############################################################################
+    def load_index(self):
+        try:
+            with open(self.index_name, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                (magic, version, size, mtime, end, count) = \
+                    INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                    return False
+                self.keys.fromfile(f, count)
+                self.offsets.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return False
+
+        if size == self.size and mtime == self.mtime:
+            self.end = end
+            return True
+        if self.size <= size or end < self.header_end:
+            return False
+
+        # grown: the last indexed epoch must still be where it was
+        if count:
+            last = self.offsets[-1]
+            eol = self.map.find(b'\n', last)
+            line = self.map[last:eol]
+            try:
+                key = rinex_ns(line[1:3], line[4:6], line[7:9], line[10:12],
+                               line[13:15], line[15:26].decode('ascii'))
+            except ValueError:
+                return False
+            if key != self.keys[-1]:
+                return False
+        self.end = end
+        self.scan()
+        self.save_index()
+        return True
+
+###############################################################################
+# save_index -- write the index next to the file (quietly doing without if
+# that directory isn't writable)
+###############################################################################
+    def save_index(self):
+        part = self.index_name + ".part"
+        try:
+            with open(part, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                          self.size, self.mtime, self.end,
+                                          len(self.keys)))
+                self.keys.tofile(f)
+                self.offsets.tofile(f)
+            os.replace(part, self.index_name)
+        except OSError:
+            pass
+
+###############################################################################
+# span -- index numbers of the first epoch at or after start and the first
+# at or after end (None for either end of the file)
+###############################################################################
+    def span(self, start=None, end=None):
+        first = 0
+        last = len(self.keys)
+        if start is not None:
+            first = bisect.bisect_left(self.keys, time_ns(start))
+        if end is not None:
+            last = bisect.bisect_left(self.keys, time_ns(end), first)
+        return first, last
+
+###############################################################################
+# read -- generator of the RinexObsEpochs from start up to (not including)
+# end; epochs() is every one
+###############################################################################
+    def read(self, start=None, end=None):
+        (first, last) = self.span(start, end)
+        for n in range(first, last):
+            yield self.epoch_at(self.offsets[n])
+
+    def epochs(self):
+        return self.read()
+
+###############################################################################
+# raw -- the bytes of the epochs from start up to end, as in the file
+###############################################################################
+    def raw(self, start=None, end=None):
+        (first, last) = self.span(start, end)
+        if first >= last:
+            return b''
+        return self.raw_epochs(first, last)
+
+###############################################################################
+# bounds -- where the records from index number first up to last start and
+# end.  From the first epoch on that takes in anything between the header
+# and it (events, say); up to the last, everything indexed.
+###############################################################################
+    def bounds(self, first, last):
+        start = self.offsets[first] if first else self.header_end
+        stop = self.offsets[last] if last < len(self.offsets) else self.end
+        return start, stop
+
+###############################################################################
+# raw_epochs -- the bytes of the records from index number first up to
+# last, as in the file (see bounds)
+###############################################################################
+    def raw_epochs(self, first, last):
+        (start, stop) = self.bounds(first, last)
+        return self.map[start:stop]
+
+###############################################################################
+# records -- generator of every record from index number first up to last
+# (see bounds), epochs and events both, parsed by epoch_at
+###############################################################################
+    def records(self, first=0, last=None):
+        if last is None:
+            last = len(self.offsets)
+        (pos, stop) = self.bounds(first, last)
+        while pos < stop:
+            eol = self.map.find(b'\n', pos, stop)
+            if eol < 0:
+                eol = stop
+            if not self.map[pos:eol].strip():
+                pos = eol + 1
+                continue
+            epoch = self.epoch_at(pos)
+            yield epoch
+            pos = epoch.end
+
+###############################################################################
+# header -- the header lines, as text
+###############################################################################
+    def header(self):
+        return self.map[:self.header_end].decode('ascii', 'replace'). \
+            splitlines()
+
+###############################################################################
+# epoch_at -- parse the epoch (or event) starting at offset
+###############################################################################
+    def epoch_at(self, offset):
+        data = self.map
+        pos = offset
+
+        def line():
+            nonlocal pos
+            eol = data.find(b'\n', pos)
+            text = data[pos:eol].decode('ascii').rstrip('\r')
+            pos = eol + 1
+            return text
+
+        first = line()
+        epoch = RinexObsEpoch()
+        epoch.offset = offset
+        epoch.flag = int(first[28:29].strip() or 0)
+        count = int(first[29:32])
+        clock = first[68:80].strip()
+        epoch.clock = float(clock) if clock else None
+        epoch.lines = []
+        if first[1:26].strip():
+            epoch.time = GPS_Time.from_ns(0, rinex_ns(
+                first[1:3], first[4:6], first[7:9], first[10:12],
+                first[13:15], first[15:26]))
+        else:				# only allowed for events
+            epoch.time = None
+
+        if epoch.flag in (2, 3, 4, 5):
+            epoch.lines = [line() for n in range(count)]
+            epoch.sats = []
+            epoch.obs = []
+            epoch.end = pos
+            return epoch
+
+        sats = first[32:68]
+        for n in range((count - 1) // 12):
+            sats += line()[32:68]
+        epoch.sats = []
+        for n in range(0, count * 3, 3):
+            sat = sats[n:n + 3]
+            if sat[0] == ' ':			# blank system is GPS
+                sat = 'G' + sat[1:]
+            epoch.sats.append(sat.replace(' ', '0'))
+
+        epoch.obs = []
+        ntypes = len(self.types)
+        for sat in epoch.sats:
+            text = ''.join(line().ljust(80) for n in range(self.lines_per_sat))
+            fields = []
+            for n in range(ntypes):
+                field = text[n * 16:n * 16 + 16]
+                value = field[:14].strip()
+                fields.append((float(value) if value else None,
+                               int(field[14]) if field[14] != ' ' else None,
+                               int(field[15]) if field[15] != ' ' else None))
+            epoch.obs.append(fields)
+        epoch.end = pos
+        return epoch
+
+###############################################################################
+# close -- unmap and close the file
+###############################################################################
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+###############################################################################
+# first_obs_line -- a TIME OF FIRST OBS header line for a GPS_Time
+###############################################################################
+
+
+def first_obs_line(when):
+    (year, mon, mday, hour, minute, sec) = when.fields()[:6]
+    return "{:6d}    {:02d}    {:02d}    {:02d}    {:02d}{:13.7f}     GPS" \
+        "         TIME OF FIRST OBS".format(year, mon, mday, hour, minute, sec)
+
+###############################################################################
+# MAIN PROGRAM -- write the epochs in a time window to a new file (with
+# the original header, TIME OF FIRST OBS changed), or list them
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="cut a time window out of a RINEX 2 observation file")
+    args.add_argument('file', type=str, help='.yyo file')
+    args.add_argument('--start', default=None, type=str,
+                      help='first epoch (GPS time, YYYY-MM-DD HH:MM:SS)')
+    args.add_argument('--end', default=None, type=str,
+                      help='stop before this epoch')
+    args.add_argument('-o', '--output', default='', type=str,
+                      help='write the window here; otherwise list it')
+    opts = args.parse_args()
+
+    try:
+        start = opts.start and datetime.datetime.fromisoformat(opts.start)
+        end = opts.end and datetime.datetime.fromisoformat(opts.end)
+        reader = RinexObsReader(opts.file)
+    except ValueError as e:
+        print("Couldn't read", opts.file, ":", e)
+        sys.exit(1)
+
+    (first, last) = reader.span(start or None, end or None)
+    if not opts.output:
+        for epoch in reader.read(start or None, end or None):
+            print(epoch.time.timestring(), epoch.flag, len(epoch.sats))
+        print(last - first, "of", len(reader.keys), "epochs")
+        return
+
+    if first >= last:
+        print("No epochs in that window!")
+        sys.exit(1)
+    header = reader.header()
+    begin = GPS_Time.from_ns(0, reader.keys[first])
+    for (n, line) in enumerate(header):
+        if line[60:].strip() == "TIME OF FIRST OBS":
+            header[n] = first_obs_line(begin)
+    with open(opts.output, 'wb') as f:
+        f.write(("\n".join(header) + "\n").encode('ascii'))
+        f.write(reader.raw(start or None, end or None))
+    print("Wrote", last - first, "epochs to", opts.output)
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashreader.py
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashrecord.py    ################################
+
+# Decoded MBN and PBN messages.  The message layouts (mben_struct,
+# pben_struct) and field names (mben_keys, pben_keys) are defined in
+# ashglobal.py; the structs are compiled once, the first time a message is
+# decoded.  The records use __slots__ rather than a dictionary per message,
+# but still answer record['key'] so older code keeps working.
+
+import struct
+
+from ashutil import *
+
+STRUCTS = {}			# filled in by compile_structs()
+
+###############################################################################
+# compile_structs -- precompile the message layouts and scale factors.
+# (ashglobal imports half the program, so we can't import it at the top.)
+###############################################################################
+
+
+def compile_structs():
+    from ashglobal import AshtechGlobals
+    STRUCTS['mben'] = struct.Struct(AshtechGlobals.mben_struct)
+    STRUCTS['pben'] = struct.Struct(AshtechGlobals.pben_struct)
+    STRUCTS['range_scale'] = AshtechGlobals.LIGHTSPEED * 1000.0
+    STRUCTS['snr_scale'] = AshtechGlobals.Z12_SNR_SCALE
+
+
+class MbenRecord:
+    # raw fields, in message order (same as AshtechGlobals.mben_keys)
+    KEYS = [
+        'seq', 'struct_left', 'prn', 'el', 'az', 'ch_id',
+
+        'ca_warn', 'ca_goodbad', 'ca_spare', 'ca_snr', 'ca_qual',
+        'ca_phase', 'ca_range', 'ca_dopp', 'ca_correction',
+
+        'l1_warn', 'l1_goodbad', 'l1_spare', 'l1_snr', 'l1_qual',
+        'l1_phase', 'l1_range', 'l1_dopp', 'l1_correction',
+
+        'l2_warn', 'l2_goodbad', 'l2_spare', 'l2_snr', 'l2_qual',
+        'l2_phase', 'l2_range', 'l2_dopp', 'l2_correction']
+
+    # RINEX flags for each signal.  Range and doppler share one LLI;
+    # phase has its own because fixphase can set loss of lock.  All three
+    # observables share one signal strength byte.
+    FLAGS = [
+        'ca_lli', 'ca_phase_lli', 'ca_sbyte',
+        'l1_lli', 'l1_phase_lli', 'l1_sbyte',
+        'l2_lli', 'l2_phase_lli', 'l2_sbyte']
+
+    __slots__ = KEYS + FLAGS
+
+    # old flag dictionary keys (AshtechGlobals.mben_flag_keys) -> slots
+    ALIASES = {}
+    for sig in ('ca', 'l1', 'l2'):
+        ALIASES[sig + '_phase_lli'] = sig + '_phase_lli'
+        ALIASES[sig + '_range_lli'] = sig + '_lli'
+        ALIASES[sig + '_dopp_lli'] = sig + '_lli'
+        for obs in ('phase', 'range', 'dopp'):
+            ALIASES[sig + '_' + obs + '_sbyte'] = sig + '_sbyte'
+    del sig, obs
+
+###############################################################################
+# decode -- build a record from a message payload (checksum stripped off),
+# any bytes-like object.  Ranges come out in meters, doppler in Hz, azimuth
+# in degrees.  Raises struct.error if the message is the wrong size.
+###############################################################################
+    @classmethod
+    def decode(cls, payload):
+        if not STRUCTS:
+            compile_structs()
+        self = cls.__new__(cls)
+        (self.seq, self.struct_left, self.prn, self.el, az, self.ch_id,
+
+         self.ca_warn, self.ca_goodbad, self.ca_spare, ca_snr, self.ca_qual,
+         ca_phase, ca_range, ca_dopp, self.ca_correction,
+
+         self.l1_warn, self.l1_goodbad, self.l1_spare, l1_snr, self.l1_qual,
+         l1_phase, l1_range, l1_dopp, self.l1_correction,
+
+         self.l2_warn, self.l2_goodbad, self.l2_spare, l2_snr, self.l2_qual,
+         l2_phase, l2_range, l2_dopp, self.l2_correction) = \
+            STRUCTS['mben'].unpack_from(payload)
+
+        # convert values (formulas from Lady Heather -- thanks, Mark!)
+        range_scale = STRUCTS['range_scale']
+        snr_scale = STRUCTS['snr_scale']
+        self.az = az * 2
+        self.ca_snr = ca_snr / snr_scale
+        self.l1_snr = l1_snr / snr_scale
+        self.l2_snr = l2_snr / snr_scale
+        self.ca_range = ca_range * range_scale
+        self.l1_range = l1_range * range_scale
+        self.l2_range = l2_range * range_scale
+        self.ca_dopp = ca_dopp / 10000.0
+        self.l1_dopp = l1_dopp / 10000.0
+        self.l2_dopp = l2_dopp / 10000.0
+
+        # one lli for each of ca, l1, l2; phase starts out the same but
+        # fixphase may set the loss-of-lock bit
+        self.ca_lli = make_lli(self.ca_warn, self.ca_goodbad)
+        self.l1_lli = make_lli(self.l1_warn, self.l1_goodbad)
+        self.l2_lli = make_lli(self.l2_warn, self.l2_goodbad)
+        (self.ca_phase, self.ca_phase_lli) = fixphase(ca_phase, self.ca_lli)
+        (self.l1_phase, self.l1_phase_lli) = fixphase(l1_phase, self.l1_lli)
+        (self.l2_phase, self.l2_phase_lli) = fixphase(l2_phase, self.l2_lli)
+
+        self.ca_sbyte = make_sbyte(self.ca_snr)
+        self.l1_sbyte = make_sbyte(self.l1_snr)
+        self.l2_sbyte = make_sbyte(self.l2_snr)
+        return self
+
+###############################################################################
+# record['key'] works for the raw field names and the old flag names
+###############################################################################
+    def __getitem__(self, key):
+        return getattr(self, self.ALIASES.get(key, key))
+
+    def __repr__(self):
+        return "MbenRecord(prn={}, seq={}, struct_left={})".format(
+            self.prn, self.seq, self.struct_left)
+
+
+class PbenRecord:
+    KEYS = ['tow', 'site', 'navx', 'navy', 'navz', 'offset',
+            'velx', 'vely', 'velz', 'drift', 'pdop']
+
+    __slots__ = KEYS
+
+###############################################################################
+# decode -- build a record from a message payload (checksum stripped off).
+# tow comes out in seconds and pdop unscaled.
+###############################################################################
+    @classmethod
+    def decode(cls, payload):
+        if not STRUCTS:
+            compile_structs()
+        self = cls.__new__(cls)
+        (tow, site, self.navx, self.navy, self.navz, self.offset,
+         self.velx, self.vely, self.velz, self.drift, pdop) = \
+            STRUCTS['pben'].unpack_from(payload)
+        self.tow = tow / 1000.0
+        self.site = site.decode('ascii', 'replace')
+        self.pdop = pdop / 100.0
+        return self
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "PbenRecord(tow={}, site={!r})".format(self.tow, self.site)
+
+# end of ashrecord.py
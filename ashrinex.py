@@ -21,14 +21,83 @@
 
 import sys
 import os
+import time
+import gzip
+import lzma
+import queue
+import shutil
 import serial
 import getpass
+import operator
+import threading
 
 from ashserial import *
 from ashcommand import *
 from ashutil import *
 from ashmessage import *
 from ashposition import *
+from ashcrx import *
+
+###############################################################################
+# The observables we write, by RINEX 2.11 and RINEX 3 code, with the
+# MbenRecord fields (see ashrecord.py) for the value, the loss of lock
+# indicator and the signal strength.  The CA block is the C/A code on L1,
+# the L1 and L2 blocks are the (Z-tracked) P codes, hence "W" in RINEX 3.
+# The phase, Doppler and SNR come from the P code blocks as they always
+# have in the 2.11 files, so they are "W" on both frequencies too.
+###############################################################################
+OBSERVABLES = [
+    # 2.11   3      value         LLI              signal strength
+    ('C1', 'C1C', 'ca_range', 'ca_lli', 'ca_sbyte'),
+    ('P1', 'C1W', 'l1_range', 'l1_lli', 'l1_sbyte'),
+    ('P2', 'C2W', 'l2_range', 'l2_lli', 'l2_sbyte'),
+    ('L1', 'L1W', 'l1_phase', 'l1_phase_lli', 'l1_sbyte'),
+    ('L2', 'L2W', 'l2_phase', 'l2_phase_lli', 'l2_sbyte'),
+    ('D1', 'D1W', 'l1_dopp', 'l1_lli', 'l1_sbyte'),
+    ('D2', 'D2W', 'l2_dopp', 'l2_lli', 'l2_sbyte'),
+    ('S1', 'S1W', 'l1_snr', None, None),
+    ('S2', 'S2W', 'l2_snr', None, None),
+]
+
+RINEX_VERSIONS = ['2.11', '3.04']
+
+###############################################################################
+# version_line, run_date, obs_types_lines -- the header records that differ
+# between RINEX 2.11 and RINEX 3 (also used by ashbatch.py)
+###############################################################################
+
+
+def version_line(version):
+    if version >= 3:
+        return "{:9.2f}{:11}{:<20}{:<20}{:<20}".format(
+            version, " ", "OBSERVATION DATA", "G: GPS", "RINEX VERSION / TYPE")
+    return "{:9.2f}{:11}{:<20}{:<20}{:<20}".format(
+        2.11, " ", "OBSERVATION", "GPS ", "RINEX VERSION / TYPE")
+
+
+def run_date(version):
+    if version >= 3:
+        return datetime.datetime.utcnow().strftime("%Y%m%d %H%M%S UTC")
+    return datetime.date.today().strftime("%d %B %Y")
+
+
+def obs_types_lines(version):
+    lines = []
+    if version >= 3:
+        types = "".join(" {:3s}".format(o[1]) for o in OBSERVABLES)
+        lines.append("{:1s}{:2s}{:3d}{:<54}{:<20}".format(
+            "G", "", len(OBSERVABLES), types, "SYS / # / OBS TYPES"))
+
+        # the phase shifts aren't known, so the record is left blank
+        lines.append("{:<60}{:<20}".format("G", "SYS / PHASE SHIFT"))
+    else:
+        lines.append("{:6d}{:6d}{:6s}{:<42}{:<20}".format(
+            1, 1, "", "", "WAVELENGTH FACT L1/2"))
+
+        types = "".join("{:>6s}".format(o[0]) for o in OBSERVABLES)
+        lines.append("{:6d}{:<54}{:<20}".format(
+            len(OBSERVABLES), types, "# / TYPES OF OBSERV"))
+    return lines
 
 
 class Rinex:
@@ -38,18 +107,47 @@ class Rinex:
         self.Commands = commands
         self.g = globs
         self.verbose = verbose
+        self.session = None		# for --rotate; see check_rotation
+        self.formatter = None		# EpochFormatter; see create_rinex_obs_file
 
 ###############################################################################
     # help us keep columns lined up
     ruler = "xxxx5xxxx0xxxx5xxxx0xxxx5xxxx0xxxx5xxxx0xxxx5xxxx0xxxx5xxxx6xxxx5xxxx0xxxx5xxxx0"
 ###############################################################################
 
+###############################################################################
+# version -- the RINEX version we're writing (--rinex_version)
+###############################################################################
+    def version(self):
+        return float(self.g.opts.get('rinex_version') or RINEX_VERSIONS[0])
+
+###############################################################################
+# WriteEpoch -- make an assembled epoch (see ashepoch.py) the current one
+# and write it.  Called from the RINEX sink's thread (see ashsink.py).
+###############################################################################
+    def WriteEpoch(self, epoch):
+        self.g.current_epoch = epoch.gps_time()
+        self.g.mben_list = epoch.mben_list
+        self.g.mben_flag_list = epoch.mben_list
+        if epoch.pben is not None:
+            self.g.current_pben = epoch.pben
+
+        if not self.g.first_observation_string:
+            self.g.first_observation = self.g.current_epoch
+            self.g.first_observation_string = \
+                self.g.current_epoch.timestring()
+
+        self.write_rinex_obs()
+
 ###############################################################################
 # write_rinex_obs -- write header if haven't already, the write one epoch
 # of data (header and obs)
 ###############################################################################
     def write_rinex_obs(self, verbose=False):
 
+        if self.g.opts.get('rotate') not in (None, 'none'):
+            self.check_rotation()
+
         if not self.g.wrote_rinex_obs_file_header:
             print("First Observation: {} (GPS week: {})".format(
                 self.g.first_observation_string, self.g.gps_week))
@@ -66,16 +164,57 @@ class Rinex:
         print(".", end="")
         sys.stdout.flush()  # flush so the dots appear right away
 
-        self.obs_epoch_header(verbose)
-        self.obs_epoch(verbose)
+        lines = self.obs_epoch_header(verbose) + self.obs_epoch(verbose)
+        self.g.obs_writer.write_epoch(lines)
         self.g.obs_epoch_count += 1
 
 ###############################################################################
-# create_rinex_obs_file -- use name if provided, otherwise build it up
+# check_rotation -- start a new file, with its own header, when the epoch
+# is in a new hour or day (--rotate).  Sessions go by the GPS time of the
+# epochs.  The file just finished is handed to the background compressor
+# if --compress asks for it.
+###############################################################################
+    def check_rotation(self):
+        (year, mon, mday, hour, minute, sec,
+         weeknum, yday) = self.g.current_epoch.fields()
+        if self.g.opts['rotate'] == 'daily':
+            session = (year, yday)
+        else:
+            session = (year, yday, hour)
+
+        if self.session is None:		# first epoch: file already open
+            self.session = session
+            return
+        if session == self.session:
+            return
+        self.session = session
+
+        finished = self.g.obs_filename
+        print()
+        self.create_rinex_obs_file(interactive=False, rotating=True,
+                                   when=datetime.datetime(year, mon, mday, hour))
+        self.g.wrote_rinex_obs_file_header = False
+        self.g.first_observation = self.g.current_epoch
+        self.g.first_observation_string = self.g.current_epoch.timestring()
+
+        if self.g.opts.get('compress') not in (None, 'none'):
+            if not self.g.obs_compressor:
+                self.g.obs_compressor = RinexCompressor(self.g.opts['compress'])
+            self.g.obs_compressor.compress(finished)
+
+###############################################################################
+# create_rinex_obs_file -- use name if provided, otherwise build it up from
+# the site name and "when" (a UTC datetime; default now).
+# If not interactive (e.g., running under ashdaemon.py) an existing file
+# is moved aside instead of asking whether to overwrite it.
+# Files after the first when rotating (see check_rotation) always get a
+# built-up name, in the same directory; with daily rotation the hour
+# letter is "0".
 ###############################################################################
-    def create_rinex_obs_file(self):
+    def create_rinex_obs_file(self, interactive=True, when=None,
+                              rotating=False):
         clean_name = ''
-        if self.g.opts['rinex_file']:
+        if self.g.opts['rinex_file'] and not rotating:
             filename = self.g.opts['rinex_file']
             for c in filename:
                 if c.isalnum() or c in [' ', '.', '/']:
@@ -88,7 +227,7 @@ class Rinex:
             if filename != clean_name:
                 print("changed requested file name",
                       filename, "to:", clean_name)
-            filename = clean_name
+            obs_filename = clean_name
         else:
             if self.g.opts['site_name']:
                 sitename = self.g.opts['site_name']
@@ -98,31 +237,61 @@ class Rinex:
                 sitename = clean_name
             else:
                 sitename = "NONE"
-            yday = str(datetime.datetime.utcnow().timetuple().tm_yday)
-            hour = int(datetime.datetime.utcnow().timetuple().tm_hour)
+            if not when:
+                when = datetime.datetime.utcnow()
+            yday = "{:03d}".format(when.timetuple().tm_yday)
+            hour = int(when.timetuple().tm_hour)
             hour_letter = chr(ord('a') + hour)
-            year = \
-                str(int(datetime.datetime.utcnow().timetuple().tm_year) - 2000)
+            if self.g.opts.get('rotate') == 'daily':
+                hour_letter = '0'
+            year = "{:02d}".format(when.timetuple().tm_year % 100)
             obs_filename = sitename + yday + hour_letter + "." + year + "o"
-            self.g.obs_filename = obs_filename
-
-            print("Attempting to create RINEX observations file:", obs_filename)
-
-            if os.path.isfile(obs_filename):
-                print(obs_filename,
-                      "already exists!  Do you want to overwrite? (y/n):", end='')
-                if input().lower().startswith('y'):
-                    os.remove(obs_filename)
-                else:
-                    print("Exiting so you can try again...")
-                    sys.exit(1)
-            try:
-                # Here we just create the file; we'll write to it elsewhere
-                open(obs_filename, 'x').close()
-            except:
-                print("Couldn't create", obs_filename,
-                      "!  Exiting so you can try again...")
+            if rotating:			# next to the last one
+                obs_filename = os.path.join(
+                    os.path.dirname(self.g.obs_filename), obs_filename)
+        if self.g.opts.get('crx') and self.version() >= 3:
+            print("--crx only works with RINEX 2.11 files")
+            sys.exit(1)
+        if self.g.opts.get('crx') and obs_filename.endswith('o'):
+            obs_filename = obs_filename[:-1] + 'd'	# compact RINEX
+        self.g.obs_filename = obs_filename
+
+        print("Attempting to create RINEX observations file:", obs_filename)
+
+        if os.path.isfile(obs_filename) and not interactive:
+            n = 1
+            while os.path.exists(obs_filename + "." + str(n)):
+                n += 1
+            print(obs_filename, "already exists; moving it to",
+                  obs_filename + "." + str(n))
+            os.rename(obs_filename, obs_filename + "." + str(n))
+
+        if os.path.isfile(obs_filename):
+            print(obs_filename,
+                  "already exists!  Do you want to overwrite? (y/n):", end='')
+            if input().lower().startswith('y'):
+                os.remove(obs_filename)
+            else:
+                print("Exiting so you can try again...")
                 sys.exit(1)
+        try:
+            # Here we just create the file; we'll write to it elsewhere
+            open(obs_filename, 'x').close()
+        except:
+            print("Couldn't create", obs_filename,
+                  "!  Exiting so you can try again...")
+            sys.exit(1)
+
+        self.formatter = EpochFormatter(self.version())
+
+        # the file stays open from here on (see RinexWriter below)
+        if self.g.obs_writer:
+            self.g.obs_writer.close()
+        program = None
+        if self.g.opts.get('crx'):
+            program = "{} {}".format(self.g.PROG_NAME, self.g.VER_NUM)
+        self.g.obs_writer = RinexWriter(obs_filename,
+                                        self.g.opts.get('rinex_sync'), program)
 
 ###############################################################################
 # obs_file_header -- assemble and return the file header at
@@ -136,10 +305,8 @@ class Rinex:
         # column count starts with 1.  header ID is columns 61-80
         # print(self.ruler)
         header = []
-        string = "{:9.2f}{:11}{:<20}{:<20}{:<20}".format(2.11,
-                                                         " ", "OBSERVATION", "GPS ", "RINEX VERSION / TYPE")
-        header.append(string)
-        date = datetime.date.today().strftime("%d %B %Y")
+        header.append(version_line(self.version()))
+        date = run_date(self.version())
 
         string = "{:<20}{:<20}{:<20}{:<20}".format(self.g.PROG_NAME,
                                                    self.g.opts['operator'], date, "PGM / RUN BY / DATE")
@@ -163,8 +330,10 @@ class Rinex:
                                              self.g.opts['agency'], "OBSERVER / AGENCY")
         header.append(string)
 
-        # Receiver Info
-        (rx_type, ch_opt, nav_ver, opts, ch_ver, ser_num) = self.Commands.QueryRID()
+        # Receiver Info -- use the answer from startup if we have it, so we
+        # don't have to query in the middle of the data stream
+        rx_id = self.g.rx_id or self.Commands.QueryRID()
+        (rx_type, ch_opt, nav_ver, opts, ch_ver, ser_num) = rx_id
 
         # for receiver number, use in this priority: (1) opts[rx_number],
         # (2) if uZ, receiver serial number; (3) "NONE"
@@ -211,14 +380,7 @@ class Rinex:
             "ANTENNA: DELTA H/E/N")
         header.append(string)
 
-        string = "{:6d}{:6d}{:6s}{:<42}{:<20}".format(
-            1, 1, "", "", "WAVELENGTH FACT L1/2")
-        header.append(string)
-
-        string = "{:6d}{:<54}{:<20}".format(
-            9, "    C1    P1    P2    L1    L2    D1    D2    S1    S2",
-            "# / TYPES OF OBSERV")
-        header.append(string)
+        header += obs_types_lines(self.version())
 
         string = "{:10.3f}{:<50}{:<20}".format(
             self.g.opts['msg_rate'], "", "INTERVAL")
@@ -231,9 +393,7 @@ class Rinex:
         string = "{:<60}{:<20}".format("", "END OF HEADER")
         header.append(string)
 
-        with open(self.g.obs_filename, 'a') as writer:
-            for i in header:
-                writer.write(i + "\n")
+        self.g.obs_writer.write_header(header)
 
         return
 
@@ -242,8 +402,8 @@ class Rinex:
 ###############################################################################
     def first_obs_time(self):
 
-        (sec, minute, hour, mday, mon, year,
-         weeknum, yday) = self.g.first_observation.time_list
+        (year, mon, mday, hour, minute, sec,
+         weeknum, yday) = self.g.first_observation.fields()
 
         timestring = "{:2s}{:4d}".format(' ', int(year))
         timestring += "{:4s}{:02d}".format(' ', int(mon))
@@ -259,93 +419,308 @@ class Rinex:
         return timestring
 
 ###############################################################################
-# obs_epoch_header -- assemble and return the observation header before
-# each stanza of mben records
+# obs_epoch_header -- assemble and return the observation header lines
+# before each stanza of mben records
 ###############################################################################
     def obs_epoch_header(self, verbose=False):
 
-        # get PRN list
-        prn_list = ''
-        count = 0
-        for i in self.g.mben_list:
-            if i:
-                count += 1
-                tmp = i['prn']
-                prn_list += 'G{:02d}'.format(i['prn'])
-        prn_list = '{:3d}'.format(count) + prn_list
-
-        # now get pben records for position and epoch
-        week = self.g.gps_week
-        tow = self.g.gps_tow
-        navx = self.g.current_pben['navx']
-        navy = self.g.current_pben['navy']
-        navz = self.g.current_pben['navz']
-
-        (sec, minute, hour, mday, mon, year,
-         weeknum, yday) = GPS_Time(week, tow).time_list
-        timestring = \
-            "{:1s}{:02d}{:1s}{:02d}{:1s}{:02d}{:1s}{:02d}{:1s}{:02d}{:11.7f}". \
-            format(
-                "", int(year) - 2000, "", int(mon), "", int(mday), "", int(hour),
-                "", int(minute), float(sec))
-
-        flagstring = \
-            "{:2s}{:1d}".format(
-                "", 0)  # need to figure out what to do with flag
-
-        header = timestring + flagstring + prn_list
-
-        with open(self.g.obs_filename, 'a') as writer:
-            writer.write(header + "\n")
+        prns = [i.prn for i in self.g.mben_list if i]
+        header = self.formatter.header(self.g.current_epoch, prns)
 
         if verbose:
-            print(header)
+            print("\n".join(header))
 
         return header
 
 ###############################################################################
-# obs_epoch -- create list of observables, one for each satellite
+# obs_epoch -- create list of observables, one for each satellite, and
+# return the lines (see EpochFormatter)
 # 9 measurements: C1 P1 P2 L1 L2 D1 D2 S1 S2
 # I get confused so C and P are (pseudo)range, L is phase. C/A phase not used
+###############################################################################
     def obs_epoch(self, verbose):
-        for i in self.g.mben_list:
-            if i:
-                counter = self.g.mben_list.index(i)
-                j = self.g.mben_flag_list[counter]
+        return self.formatter.lines(self.g.mben_list)
 
-                # line 1
-                l1p1 = "{:14.3f}{:1d}{:1d}".format(
-                    i['ca_range'], j['ca_range_lli'], j['ca_range_sbyte'])
 
-                l1p2 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l1_range'], j['l1_range_lli'], j['l1_range_sbyte'])
+class EpochFormatter:
+    FIELD = "%14.3f%d%d"		# value, LLI, signal strength
+    VALUE = "%14.3f  "			# value only (SNR)
+    BLANK = " " * 16			# missing observable
 
-                l1p3 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l2_range'], j['l2_range_lli'], j['l2_range_sbyte'])
+###############################################################################
+# EpochFormatter -- turns an epoch into RINEX observation records.  The
+# satellite template (every observable in OBSERVABLES, split into lines
+# the way the version wants them) and the attrgetter that pulls a flat
+# tuple of its values out of an MbenRecord are built once; each epoch is
+# then one %-format over all the satellites' values.  A satellite with a
+# missing observable (0.0 -- the receiver isn't tracking that signal) is
+# formatted a field at a time instead, with that field left blank.
+###############################################################################
+    def __init__(self, version=2.11):
+        self.rinex3 = version >= 3
+        if self.rinex3:			# one line per satellite
+            (prefix, per_line, names) = ("G%02d", len(OBSERVABLES), ['prn'])
+        else:				# five observables to a line
+            (prefix, per_line, names) = ("", 5, [])
+
+        # (template, number of values) for each observable
+        self.fields = []
+        for (v2, v3, value, lli, sbyte) in OBSERVABLES:
+            if lli:
+                self.fields.append((self.FIELD, 3))
+                names += [value, lli, sbyte]
+            else:
+                self.fields.append((self.VALUE, 1))
+                names.append(value)
+        self.prefix = prefix
+        self.per_line = per_line
+        self.values = operator.attrgetter(*names)
+        self.observed = operator.attrgetter(*[o[2] for o in OBSERVABLES])
+
+        # a value-only field at the end of a line needs no blank flags
+        lines = []
+        for n in range(0, len(self.fields), per_line):
+            line = "".join(f[0] for f in self.fields[n:n + per_line])
+            if line.endswith(self.VALUE):
+                line = line[:-2]
+            lines.append(line)
+        self.template = prefix + "\n".join(lines)
+
+        if self.rinex3:
+            self.time_template = "> %4d %02d %02d %02d %02d%11.7f"
+            self.clock_template = "      %15.12f"
+        else:
+            self.time_template = " %02d %02d %02d %02d %02d%11.7f"
+            self.clock_template = "%12.9f"
 
-                l1p4 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l1_phase'], j['l1_phase_lli'], j['l1_phase_sbyte'])
+###############################################################################
+# header -- the epoch record lines for a GPS_Time and list of PRNs.  The
+# live writer's flag is always 0 (OK) and it has no clock offset; ashbatch.py
+# passes on a file's.  In RINEX 2 the satellites follow, twelve to a line
+# with continuation lines after that; in RINEX 3 they're on the
+# observation lines.
+###############################################################################
+    SATS_PER_LINE = 12
+    CONTINUATION = " " * 32
+
+    def header(self, when, prns, flag=0, clock=None):
+        header = self.epoch_time(when) + "  %d%3d" % (flag, len(prns))
+        if self.rinex3:
+            if clock is not None:
+                header += self.clock_template % clock
+            return [header]
+        sats = ["G%02d" * len(chunk) % tuple(chunk) for chunk in
+                [prns[n:n + self.SATS_PER_LINE]
+                 for n in range(0, len(prns), self.SATS_PER_LINE)]] or [""]
+        header += sats[0]
+        if clock is not None:
+            header = header.ljust(68) + self.clock_template % clock
+        return ([header] +
+                [self.CONTINUATION + line for line in sats[1:]])
+
+###############################################################################
+# event -- an event record (flags 2-5) and the header records that go
+# with it; when may be None
+###############################################################################
+    def event(self, when, flag, lines):
+        return ([self.epoch_time(when) + "  %d%3d" % (flag, len(lines))] +
+                list(lines))
 
-                l1p5 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l2_phase'], j['l2_phase_lli'], j['l2_phase_sbyte'])
+###############################################################################
+# epoch_time -- the time part of an epoch record; blank for None
+###############################################################################
+    def epoch_time(self, when):
+        if when is None:
+            return (">" if self.rinex3 else "").ljust(
+                len(self.time_template % (0, 0, 0, 0, 0, 0.0)))
+        (year, mon, mday, hour, minute, sec,
+         weeknum, yday) = when.fields()
+        if not self.rinex3:
+            year = year % 100
+        return self.time_template % (year, mon, mday, hour, minute, sec)
 
-                # line 2
-                l2p1 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l1_dopp'], j['l1_dopp_lli'], j['l1_dopp_sbyte'])
+###############################################################################
+# observations -- one satellite's observation lines from a file rather
+# than an MbenRecord: obs has a (value, LLI, signal strength) tuple for
+# each of OBSERVABLES, None for any the file doesn't have, and None for
+# blank parts.  Every value and flag is kept as it was, zeros included.
+###############################################################################
+    def observations(self, prn, obs):
+        fields = []
+        for field in obs:
+            if field is None:
+                fields.append(self.BLANK)
+                continue
+            (value, lli, sbyte) = field
+            fields.append(
+                (" " * 14 if value is None else "%14.3f" % value) +
+                (" " if lli is None else str(lli)) +
+                (" " if sbyte is None else str(sbyte)))
+        if self.rinex3:
+            return [(self.prefix % prn + "".join(fields)).rstrip()]
+        return ["".join(fields[n:n + self.per_line]).rstrip()
+                for n in range(0, len(fields), self.per_line)]
 
-                l2p2 = "{:14.3f}{:1d}{:1d}".format(
-                    i['l2_dopp'], j['l2_dopp_lli'], j['l2_dopp_sbyte'])
+###############################################################################
+# lines -- the observation lines for a list of MbenRecords (None for the
+# PRNs not in the epoch)
+###############################################################################
+    def lines(self, mben_list):
+        parts = []
+        values = []
+        for mben in mben_list:
+            if not mben:
+                continue
+            if 0.0 in self.observed(mben):
+                parts.append(self.missing(mben))
+            else:
+                parts.append(self.template)
+                values.extend(self.values(mben))
+        if not parts:
+            return []
+        return ("\n".join(parts) % tuple(values)).split("\n")
 
-                l2p3 = "{:14.3f}".format(i['l1_snr'])
-                l2p4 = "{:14.3f}".format(i['l2_snr'])
+###############################################################################
+# missing -- one satellite, a field at a time, blanks for missing values.
+# (No "%" can appear in the result, so it can go into lines' template.)
+###############################################################################
+    def missing(self, mben):
+        values = self.values(mben)
+        if self.rinex3:
+            text = self.prefix % values[0]
+            values = values[1:]
+        else:
+            text = ""
+        lines = []
+        n = 0
+        for (i, (template, count)) in enumerate(self.fields):
+            if i and i % self.per_line == 0:
+                lines.append(text.rstrip())
+                text = ""
+            if values[n] == 0.0:
+                text += self.BLANK
+            else:
+                text += template % values[n:n + count]
+            n += count
+        lines.append(text.rstrip())
+        return "\n".join(lines)
 
-                line1 = l1p1 + l1p2 + l1p3 + l1p4 + l1p5
-                line2 = l2p1 + l2p2 + l2p3 + l2p4
 
-                with open(self.g.obs_filename, 'a') as writer:
-                    writer.write(line1 + "\n")
-                    writer.write(line2 + "\n")
+class RinexWriter:
+    BUFFER_SIZE = 65536
 
-        return
+###############################################################################
+# RinexWriter -- holds the observation file open and writes each epoch in
+# one piece.  sync says when the data goes to the OS and to the disk:
+#   "epoch" -- write each epoch as it's done (the default)
+#   "fsync" -- the same, and fsync it too
+#   seconds -- hold epochs and write and fsync them that often
+#   "exit"  -- write when the buffer fills; fsync at close
+# Whichever it is, close() (from the exit handler) writes everything out.
+# If crx_program is given, the file is written as Compact RINEX (see
+# ashcrx.py) by that program name.
+###############################################################################
+    def __init__(self, filename, sync='epoch', crx_program=None):
+        self.filename = filename
+        self.encoder = None
+        if crx_program:
+            self.encoder = CrxEncoder(program=crx_program)
+        self.sync = sync or 'epoch'
+        self.interval = None
+        if self.sync not in ('epoch', 'fsync', 'exit'):
+            self.interval = float(self.sync)
+        self.last_sync = time.monotonic()
+        self.file = open(filename, 'a', buffering=self.BUFFER_SIZE)
+
+###############################################################################
+# write_header -- the file header always goes out right away
+###############################################################################
+    def write_header(self, lines):
+        if self.encoder:
+            lines = self.encoder.header(lines)
+        self.file.write("\n".join(lines) + "\n")
+        self.flush()
+
+###############################################################################
+# write_epoch -- one epoch's lines, in one write
+###############################################################################
+    def write_epoch(self, lines):
+        if self.encoder:
+            lines = self.encoder.epoch(lines)
+        self.file.write("\n".join(lines) + "\n")
+        if self.sync == 'epoch':
+            self.file.flush()
+        elif self.sync == 'fsync':
+            self.flush()
+        elif self.interval is not None:
+            if time.monotonic() - self.last_sync >= self.interval:
+                self.flush()
+
+###############################################################################
+# flush -- write out everything and fsync it
+###############################################################################
+    def flush(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+class RinexCompressor:
+    SUFFIX = {'gzip': '.gz', 'lzma': '.xz'}
+
+###############################################################################
+# RinexCompressor -- compresses finished RINEX files on its own thread, so
+# acquisition never waits for it.  Each file is written to a ".part" file,
+# renamed when complete, and only then is the original removed.
+###############################################################################
+    def __init__(self, method):
+        self.method = method
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="compress",
+                                       daemon=True)
+        self.thread.start()
+
+    def compress(self, filename):
+        self.queue.put(filename)
+
+    def run(self):
+        while True:
+            filename = self.queue.get()
+            if filename is None:
+                return
+            try:
+                self.compress_file(filename)
+            except OSError as e:
+                print("Couldn't compress", filename, ":", e)
+
+    def compress_file(self, filename):
+        target = filename + self.SUFFIX[self.method]
+        with open(filename, 'rb') as source, \
+                open(target + ".part", 'wb') as raw:
+            if self.method == 'gzip':
+                dest = gzip.GzipFile(os.path.basename(filename), 'wb',
+                                     fileobj=raw)
+            else:
+                dest = lzma.LZMAFile(raw, 'wb')
+            with dest:
+                shutil.copyfileobj(source, dest, 1 << 20)
+        os.replace(target + ".part", target)
+        os.remove(filename)
+
+###############################################################################
+# close -- finish the files already queued (the exit handler calls this)
+###############################################################################
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
 
 # end of rinex.py
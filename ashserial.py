@@ -19,14 +19,161 @@
 
 #############################   ashserial.py    ################################
 
+import os
 import sys
 import time
+import threading
+import collections
+import concurrent.futures
 import serial
 
 from ashcommand import *
 from ashutil import *
 from ashmessage import *
 from ashposition import *
+from ashframe import *
+
+
+###############################################################################
+# AshtechRingBuffer -- bounded byte buffer filled by the serial reader
+# thread and drained by the read functions.  If the consumer falls behind
+# and the buffer fills up, the oldest bytes are thrown away (and counted in
+# overruns) so the reader thread never blocks on the port.
+#
+# Each chunk put is stamped with the time it came off the port, so a
+# message can be given the time its last byte arrived (see read_frame)
+# however long it then sat in the buffer.
+###############################################################################
+class AshtechRingBuffer:
+    SIZE = 65536			# about 5 seconds at 115200 baud
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.buf = bytearray()
+        self.overruns = 0               # number of bytes dropped
+        self.cond = threading.Condition()
+
+        # (stream offset just past a chunk, host monotonic ns it arrived);
+        # buf[0] is at stream offset self.offset
+        self.arrivals = collections.deque()
+        self.offset = 0
+
+###############################################################################
+# put -- add bytes from the port and wake up anybody waiting for them
+###############################################################################
+    def put(self, data):
+        stamp = time.monotonic_ns()
+        with self.cond:
+            self.buf += data
+            self.arrivals.append((self.offset + len(self.buf), stamp))
+            excess = len(self.buf) - self.size
+            if excess > 0:
+                self.discard(excess)
+                self.overruns += excess
+            self.cond.notify_all()
+
+###############################################################################
+# discard -- drop length bytes from the front, and the arrival times of
+# chunks now wholly gone.  Caller must hold self.cond.
+###############################################################################
+    def discard(self, length):
+        # bytearray deletes from the front without copying
+        del self.buf[:length]
+        self.offset += length
+        while self.arrivals and self.arrivals[0][0] <= self.offset:
+            self.arrivals.popleft()
+
+###############################################################################
+# arrival -- when the byte before buf[end] came off the port (monotonic
+# ns).  Caller must hold self.cond.
+###############################################################################
+    def arrival(self, end):
+        end += self.offset
+        for (offset, stamp) in self.arrivals:
+            if offset >= end:
+                return stamp
+        return None
+
+###############################################################################
+# clear -- throw away anything buffered
+###############################################################################
+    def clear(self):
+        with self.cond:
+            self.buf.clear()
+            self.arrivals.clear()
+            self.offset = 0
+
+###############################################################################
+# waiting -- number of bytes buffered
+###############################################################################
+    def waiting(self):
+        return len(self.buf)
+
+###############################################################################
+# wait_for -- block until test(buf) returns something other than None or
+# the timeout expires.  Caller must hold self.cond.  Returns result of test.
+###############################################################################
+    def wait_for(self, test, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            result = test(self.buf)
+            if result is not None:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.cond.wait(remaining)
+
+###############################################################################
+# read -- return up to length bytes, waiting until that many are available
+# or the timeout expires
+###############################################################################
+    def read(self, length, timeout):
+        with self.cond:
+            self.wait_for(lambda buf: True if len(buf) >= length else None,
+                          timeout)
+            data = bytes(self.buf[:length])
+            self.discard(len(data))
+        return data
+
+###############################################################################
+# read_until -- return bytes up to and including delimiter.  On timeout
+# return whatever has arrived so far (like pyserial's read_until)
+###############################################################################
+    def read_until(self, delimiter, timeout):
+        def test(buf):
+            index = buf.find(delimiter)
+            return None if index < 0 else index + len(delimiter)
+
+        with self.cond:
+            end = self.wait_for(test, timeout)
+            if end is None:
+                end = len(self.buf)
+            data = bytes(self.buf[:end])
+            self.discard(end)
+        return data
+
+###############################################################################
+# read_frame -- use framer (see ashframe.py) to pull one complete message
+# out of the buffer, throwing away any garbage in front of it.  Returns
+# the message and the time its last byte arrived (see arrival), or
+# (b'', None) on timeout, leaving any partial message in the buffer.
+###############################################################################
+    def read_frame(self, framer, timeout):
+        def test(buf):
+            (start, end) = framer.scan(buf)
+            if start:
+                self.discard(start)
+            return None if end is None else end - start
+
+        with self.cond:
+            end = self.wait_for(test, timeout)
+            if end is None:
+                return (b'', None)
+            data = bytes(self.buf[:end])
+            stamp = self.arrival(end)
+            self.discard(end)
+        return (data, stamp)
 
 
 class AshtechSerial:
@@ -54,6 +201,18 @@ class AshtechSerial:
         self.hw_port = hw_port
         self.verbose = verbose
         self.timeout = timeout
+        self.ring = AshtechRingBuffer()
+        self.framer = AshtechFramer()
+        self.capture = None             # see ashcapture.py
+        self.reader = None              # set by StartReader()
+        self.reader_running = False
+
+        # command replies (see expect and wait_reply)
+        self.waiters = {}               # msg type: deque of futures
+        self.waiters_lock = threading.Lock()
+        self.pump_lock = threading.Lock()   # one thread framing at a time
+        self.held = collections.deque()     # data messages read by commands
+        self.dropped = 0                # held messages thrown away
 
 ##############################################################################
 # SpeedToIndex -- convert numeric baud rate to index number for Z12
@@ -66,9 +225,9 @@ class AshtechSerial:
             print("Invalid Baud Rate: ", speed)
 
 ###############################################################################
-# Open -- open Z12 serial port
+# Open -- open Z12 serial port; start the reader thread unless told not to
 ###############################################################################
-    def Open(self):
+    def Open(self, reader=True):
         index = self.SpeedToIndex(self.ser_baud)
 
         try:
@@ -85,6 +244,9 @@ class AshtechSerial:
         time.sleep(0.5)
         print("Trying to find hardware speed...", end=' ')
         rate = self.FindHardwareSpeed()
+        if not rate:
+            print("no response from receiver!")
+            sys.exit(1)
         print("detected baudrate: %s" % rate)
 
         if int(rate) != int(self.ser_baud):
@@ -92,9 +254,9 @@ class AshtechSerial:
             self.SetHardwareSpeed(self.ser_baud)
             time.sleep(0.5)
             self.SetPortSpeed(self.ser_baud)
+            self.save_speed(self.ser_baud)	# so it's tried first
             time.sleep(0.5)
-            rate = self.FindHardwareSpeed()
-            time.sleep(0.5)
+            rate = self.FindHardwareSpeed() or rate
             if int(rate) == int(self.ser_baud):
                 print("Set and confirmed requested speed: %s" % rate)
             else:
@@ -104,58 +266,160 @@ class AshtechSerial:
         self.reset_input()
         self.reset_output()
 
+        if reader:
+            self.StartReader()
+
         return serial
 
 ###############################################################################
 # Close -- close Z12 serial port
 ###############################################################################
     def Close(self):
+        self.StopReader()
         self.serial.close()
 
 ###############################################################################
-# FindHardwareSpeed -- probe the Z12 for its current serial port speed
+# StartReader -- start the thread that drains the port into the ring buffer.
+# Once it's running, all the read functions take their data from the
+# buffer instead of touching the port.
+###############################################################################
+    def StartReader(self):
+        if self.reader_running:
+            return
+        self.ring.clear()
+        self.reader_running = True
+        self.reader = threading.Thread(target=self.ReaderLoop,
+                                       name="ashserial-reader", daemon=True)
+        self.reader.start()
+
+###############################################################################
+# StopReader -- stop the reader thread; reads go back to the port directly
+###############################################################################
+    def StopReader(self):
+        if not self.reader_running:
+            return
+        self.reader_running = False
+        self.reader.join()
+        self.reader = None
+
+###############################################################################
+# ReaderLoop -- body of the reader thread.  The read blocks in the driver
+# until at least one byte arrives (or READER_TIMEOUT passes so we can notice
+# StopReader), then picks up whatever else is waiting in the same call.
+###############################################################################
+    READER_TIMEOUT = 0.5
+
+    def ReaderLoop(self):
+        self.serial.timeout = self.READER_TIMEOUT
+        while self.reader_running:
+            try:
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except Exception:
+                print("Read error on", self.ser_port, "!",
+                      sys.exc_info()[1])
+                time.sleep(self.READER_TIMEOUT)
+                continue
+            if data:
+                self.ring.put(data)
+        self.serial.timeout = self.TIMEOUT
+
+###############################################################################
+# overruns -- number of bytes dropped because the ring buffer was full
+###############################################################################
+    def overruns(self):
+        return self.ring.overruns
+
+###############################################################################
+# FindHardwareSpeed -- probe the Z12 for its current serial port speed.
+# Tries the speed that worked last time on this port first (see
+# load_speed), then the requested speed, then the rest of the table from
+# fastest to slowest, until something answers or deadline seconds pass.
+# Each pass through the table waits twice as long for an answer as the one
+# before, for receivers that are slow to respond.  Returns the speed, or
+# None if the receiver never answered.
 ###############################################################################
-    def FindHardwareSpeed(self):
-        starting_index = len(self.BAUDRATES) - 1
-        index = starting_index
-        TEST_TIMEOUT = 0.5
+    SEARCH_DEADLINE = 30		# seconds to keep trying
+    PROBE_LATENCY = 0.3			# seconds for the receiver to answer
+    PROBE_LATENCY_MAX = 1.2		# ...on the slowest pass
+
+    def FindHardwareSpeed(self, deadline=SEARCH_DEADLINE):
+        rates = [self.load_speed(), str(self.ser_baud)]
+        rates += reversed(self.BAUDRATES)
+        rates = [r for (i, r) in enumerate(rates) if r and r not in rates[:i]]
+
+        give_up = time.monotonic() + deadline
+        latency = self.PROBE_LATENCY
+        found = None
+        while not found and time.monotonic() < give_up:
+            for rate in rates:
+                if self.ProbeSpeed(rate, latency, give_up):
+                    found = rate
+                    break
+                if time.monotonic() >= give_up:
+                    break
+            latency = min(2 * latency, self.PROBE_LATENCY_MAX)
+
+        self.serial.timeout = self.TIMEOUT
+        if found:
+            self.save_speed(found)
+        return found
 
+###############################################################################
+# ProbeSpeed -- set the port to rate, send a port query and return True as
+# soon as anything starting with "$PASH" comes back.  Waits latency seconds
+# plus long enough for a ~30 character response at that rate, but not past
+# the monotonic time limit.
+###############################################################################
+    def ProbeSpeed(self, rate, latency, limit):
         # Ashtech responses start with "$PASHR,"
         look_for = b"$PASH"
 
-        # first see if we're already there
-        self.SetPortSpeed(self.ser_baud)
-        self.write("$PASHQ,PRT\r\n")
-        time.sleep(0.5)
-        response = self.read_anything('', 16, TEST_TIMEOUT)
-        if look_for in response:
-            return self.ser_baud
+        self.SetPortSpeed(rate)
 
-        # we weren't lucky, so step through rate table
-        while (index > 0):
-            rate = self.BAUDRATES[index]
+        # clear out the sluices, so an earlier probe's answer (or garbage
+        # at the wrong speed) isn't taken for this one's
+        self.reset_output()
+        self.reset_input()
 
-            # set host comm port speed
-            self.SetPortSpeed(rate)
+        self.write("$PASHQ,PRT\r\n")
+        self.serial.timeout = 0.05
+        give_up = min(limit, time.monotonic() + latency + 300 / int(rate))
+        response = b''
+        while time.monotonic() < give_up:
+            response += self.serial.read(max(1, self.serial.in_waiting))
+            if look_for in response:
+                return True
+        return False
 
-            # clear out the sluices
-            self.reset_output()
-            self.reset_input()
+###############################################################################
+# load_speed, save_speed -- remember the last speed that worked on each
+# port, in STATE_DIR, so we can try it first next time
+###############################################################################
+    STATE_DIR = os.path.expanduser("~/.ashcomm")
 
-            # send port query
-            self.write("$PASHQ,PRT\r\n")
-            time.sleep(1)
-            response = self.serial.readline()
-            if look_for in response:
-                break
-            index -= 1
-            # loop until it works
-            if (index == 0):
-                index = starting_index
+    def speed_file(self):
+        name = self.ser_port.strip('/').replace('/', '_')
+        return os.path.join(self.STATE_DIR, name + ".speed")
 
-        self.serial.timeout = self.TIMEOUT
+    def load_speed(self):
+        try:
+            with open(self.speed_file()) as f:
+                rate = f.read().strip()
+        except OSError:
+            return None
+        if rate not in self.BAUDRATES:
+            return None
         return rate
 
+    def save_speed(self, rate):
+        try:
+            os.makedirs(self.STATE_DIR, exist_ok=True)
+            with open(self.speed_file(), 'w') as f:
+                f.write(str(rate) + "\n")
+        except OSError:
+            if self.verbose:
+                print("Couldn't save port speed to", self.speed_file())
+
 ###############################################################################
 # SetPortSpeed -- set computer port to desired speed
 ###############################################################################
@@ -185,6 +449,8 @@ class AshtechSerial:
 ###############################################################################
     def reset_input(self):
         self.serial.reset_input_buffer()
+        self.ring.clear()
+        self.held.clear()
 
 ###############################################################################
 # reset_output -- reset output buffer
@@ -204,6 +470,15 @@ class AshtechSerial:
 # byte object with crlf and "$PASHR," header stripped off
 ###############################################################################
     def read_line(self, timeout=TIMEOUT):
+        if self.reader_running:
+            # skip the CRLF that next_frame leaves behind
+            give_up = time.monotonic() + timeout
+            message = b'\r\n'
+            while message in (b'\r\n', b'\n'):
+                message = self.ring.read_until(
+                    b'\n', max(0, give_up - time.monotonic()))
+            return message[7:].rstrip()
+
         orig_timeout = self.serial.timeout
         self.serial.timeout = timeout
         while True:
@@ -238,6 +513,14 @@ class AshtechSerial:
 # without stripping anything
 ###############################################################################
     def read_anything(self, delimiter=b'', length=0, timeout=TIMEOUT):
+        if self.reader_running:
+            message = b''
+            if delimiter:
+                message = self.ring.read_until(delimiter, timeout)
+            if length:
+                message = self.ring.read(length, timeout)
+            return message
+
         orig_timeout = self.serial.timeout
         self.serial.timeout = timeout
         self.serial.inter_byte_timeout = 5  # tenths of second?
@@ -252,11 +535,113 @@ class AshtechSerial:
         self.serial.inter_byte_timeout = None  # default
         return message
 
+###############################################################################
+# next_frame -- return one complete message starting with "$PASHR" as a raw
+# byte object (through the checksum, without CRLF), blocking until it has
+# arrived.  Returns b'' on timeout.  Replies that a command is waiting for
+# go to the command instead.  Needs the reader thread.
+###############################################################################
+    def next_frame(self, timeout=TIMEOUT):
+        give_up = time.monotonic() + timeout
+        with self.pump_lock:
+            while True:
+                if self.held:
+                    return self.held.popleft()
+                (frame, reply) = self.take_frame(
+                    max(0, give_up - time.monotonic()))
+                if not frame:
+                    return b''
+                if not reply:
+                    return frame
+
+###############################################################################
+# take_frame -- the next message out of the ring buffer (b'' on timeout).
+# It goes to the command waiting for it, if there is one (see Dispatch),
+# and to the capture file, if any, stamped with the time it arrived.
+# Returns the message and whether a command took it.  Caller must hold
+# pump_lock, so messages are captured in the order they arrived.
+###############################################################################
+    def take_frame(self, timeout):
+        (frame, stamp) = self.ring.read_frame(self.framer, timeout)
+        if not frame:
+            return (b'', False)
+        reply = self.Dispatch(frame)
+        if self.capture:
+            self.capture.write(frame, stamp, reply)
+        return (frame, reply)
+
+###############################################################################
+# expect -- return a future that gets the next message of any of the given
+# types.  Register before sending the command.  Futures for the same type
+# are answered oldest first.
+###############################################################################
+    def expect(self, *msg_types):
+        future = concurrent.futures.Future()
+        with self.waiters_lock:
+            for msg_type in msg_types:
+                self.waiters.setdefault(msg_type,
+                                        collections.deque()).append(future)
+        return future
+
+###############################################################################
+# Dispatch -- give a message to the oldest command waiting for its type.
+# Returns True if somebody took it.
+###############################################################################
+    def Dispatch(self, frame):
+        msg_type = split_frame(frame)[0]
+        with self.waiters_lock:
+            waiting = self.waiters.get(msg_type)
+            while waiting:
+                future = waiting.popleft()
+                # skip ones already answered, timed out or cancelled
+                if not future.done() and \
+                        future.set_running_or_notify_cancel():
+                    future.set_result(frame)
+                    return True
+        return False
+
+###############################################################################
+# wait_reply -- wait up to timeout for a future from expect and return the
+# message, or None if it didn't come.  If no other thread is reading
+# messages (i.e., MsgSwitch isn't running) we read them ourselves, holding
+# on to any data messages for next_frame.
+###############################################################################
+    PUMP_INTERVAL = 0.1
+    HOLD_SIZE = 1000
+
+    def wait_reply(self, future, timeout=TIMEOUT):
+        give_up = time.monotonic() + timeout
+        while not future.done():
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                break
+            wait = min(remaining, self.PUMP_INTERVAL)
+            if self.pump_lock.acquire(blocking=False):
+                try:
+                    (frame, reply) = self.take_frame(wait)
+                    if frame and not reply:
+                        if len(self.held) >= self.HOLD_SIZE:
+                            self.held.popleft()
+                            self.dropped += 1
+                        self.held.append(frame)
+                finally:
+                    self.pump_lock.release()
+            else:
+                # somebody's in next_frame and will hand us the reply
+                concurrent.futures.wait([future], wait)
+
+        if future.cancel():
+            return None
+        return future.result()
+
 ###############################################################################
 # getc -- used by xmodem() for input
 ###############################################################################
     def getc(self, size, timeout=1):
-        data = self.serial.read(size)
+        if self.reader_running:
+            data = self.ring.read(size, timeout)
+        else:
+            data = self.serial.read(size)
         return data or None
 
 ###############################################################################
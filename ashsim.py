@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashsim.py    ###################################
+
+# A pretend Z12 / micro-Z on a Linux pseudo-terminal.  It answers the
+# queries and set commands ashcomm.py and ashfile.py use, streams made-up
+# MBN/PBN (and DAL) messages and serves BLK downloads over XMODEM, so the
+# rest of the programs can run against it unchanged:
+#
+#   ./ashsim.py --sats=12 &			(prints the pty name)
+#   ./ashcomm.py --serport=/dev/pts/5 --msg_rate=1
+#
+# The observables are smooth functions of time, not real orbits; they're
+# only meant to exercise the code.  See ashbench.py for benchmarks that
+# use the simulator.
+
+import os
+import pty
+import sys
+import tty
+import time
+import math
+import heapq
+import struct
+import select
+import argparse
+import datetime
+
+from ashutil import *
+from ashtime import *
+from ashglobal import *
+from ashposition import *
+
+# available from pip, but copy provided with this program
+from xmodem import XMODEM1k
+
+
+class AshtechSimulator:
+    # receiver ID (RID) fields: type, channels, nav version, options,
+    # channel version
+    RID = {
+        'UZ': "UZ,12,UC00,-------,0A07",
+        'Z12': "ZX,12,1L00,-------,1C05",
+    }
+    SERIAL_NUMBER = "UC2001234"
+
+    # the satellites we pretend to track, in order
+    PRNS = [2, 5, 6, 9, 12, 13, 15, 17, 19, 24, 25, 29,
+            1, 3, 4, 7, 8, 10, 11, 14, 16, 18, 20, 21,
+            22, 23, 26, 27, 28, 30, 31]
+
+    # where we pretend to be
+    LAT = 39.7
+    LON = -84.1
+    HEIGHT = 250.0
+
+    L1_WAVELENGTH = 0.190293672798		# meters
+    L2_WAVELENGTH = 0.244210213425
+
+###############################################################################
+###############################################################################
+    def __init__(self, model='UZ', sats=8, interval=1, pbn_delay=3.0,
+                 mbn_spacing=0.0, fast=False, verbose=False):
+        self.model = model
+        self.sats = sats
+        self.interval = interval	# changed by $PASHS,RCI
+        self.pbn_delay = pbn_delay	# seconds from epoch to PBN
+        self.mbn_spacing = mbn_spacing  # seconds between MBN messages
+        self.fast = fast		# don't pace output in real time
+        self.verbose = verbose
+
+        self.outputs = set()		# streaming: 'MBN', 'PBN', 'NMEA'
+        self.dal_on = False
+        self.nmea_period = 1
+        self.queue = []			# heap of (due, seq, bytes)
+        self.queue_seq = 0
+        self.inbuf = b''
+
+        # simulated GPS time; starts at the host clock
+        gps = current_gps_time() - datetime.datetime(1980, 1, 6)
+        self.week = gps.days // 7
+        self.tow = (gps.days % 7) * 86400 + gps.seconds
+        self.next_epoch = None
+        self.next_dal = None
+
+        self.position = Position(*Position(0, 0, 0).geodetic_to_ecef(
+            self.LAT, self.LON, self.HEIGHT))
+
+        self.memory = self.MakeMemory()
+
+        # counters for benchmarks
+        self.commands = 0
+        self.epochs = 0
+        self.bytes_sent = 0
+
+###############################################################################
+# Open -- create the pseudo-terminal; returns the name to give ashcomm
+###############################################################################
+    def Open(self):
+        (self.master, self.slave) = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        return self.port
+
+    def Close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+###############################################################################
+# Run -- serve commands and stream data until stopped (or for seconds)
+###############################################################################
+    def Run(self, seconds=None):
+        self.running = True
+        stop = time.monotonic() + seconds if seconds else None
+        while self.running:
+            now = time.monotonic()
+            if stop and now >= stop:
+                break
+            self.Schedule(now)
+
+            # sleep until input arrives or the next output is due
+            timeout = 0.5
+            if self.queue:
+                timeout = 0 if self.fast else \
+                    max(0, min(timeout, self.queue[0][0] - now))
+            readable = select.select([self.master], [], [], timeout)[0]
+            if readable:
+                self.ReadCommands()
+
+            now = time.monotonic()
+            while self.queue and (self.fast or self.queue[0][0] <= now):
+                (due, seq, data) = heapq.heappop(self.queue)
+                self.Send(data)
+                if self.fast and select.select([self.master], [], [], 0)[0]:
+                    break
+
+    def Stop(self):
+        self.running = False
+
+###############################################################################
+# Schedule -- queue up the messages for any epochs that are due
+###############################################################################
+    def Schedule(self, now):
+        if self.outputs & {'MBN', 'PBN'}:
+            if self.next_epoch is None:
+                self.next_epoch = now
+            # in fast mode, keep just a little ahead of the client
+            while self.next_epoch <= now and \
+                    (not self.fast or len(self.queue) < 4 * self.sats):
+                self.MakeEpoch(self.next_epoch)
+                self.next_epoch += 0 if self.fast else self.interval
+        else:
+            self.next_epoch = None
+
+        if 'NMEA' in self.outputs and self.dal_on:
+            if self.next_dal is None or self.next_dal <= now:
+                self.Queue(now, self.MakeDAL())
+                self.next_dal = now + self.nmea_period
+        else:
+            self.next_dal = None
+
+    def Queue(self, due, data):
+        heapq.heappush(self.queue, (due, self.queue_seq, data))
+        self.queue_seq += 1
+
+###############################################################################
+# Send -- write to the client
+###############################################################################
+    def Send(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        os.write(self.master, data)
+        self.bytes_sent += len(data)
+
+###############################################################################
+# Respond -- send "$PASHR,<body>*cc"
+###############################################################################
+    def Respond(self, body, checksum=True):
+        sentence = "$PASHR," + body
+        if checksum:
+            sentence += "*" + nmea_chksum(sentence)
+        self.Send(sentence + "\r\n")
+
+###############################################################################
+# ReadCommands -- collect command lines from the client and act on them
+###############################################################################
+    def ReadCommands(self):
+        try:
+            self.inbuf += os.read(self.master, 4096)
+        except OSError:
+            return
+        while b'\n' in self.inbuf or b'\r' in self.inbuf:
+            (line, sep, self.inbuf) = \
+                self.inbuf.replace(b'\r', b'\n').partition(b'\n')
+            line = line.strip().decode('ascii', 'replace')
+            if line:
+                self.Command(line)
+
+###############################################################################
+# Command -- handle one "$PASHQ" or "$PASHS" command
+###############################################################################
+    def Command(self, line):
+        self.commands += 1
+        if self.verbose:
+            print("sim got:", line)
+        line = line.split('*', 1)[0]
+        fields = line.split(',')
+        if len(fields) < 2:
+            return
+        (kind, cmd, args) = (fields[0], fields[1], fields[2:])
+
+        if kind == "$PASHQ":
+            if cmd == "RID":
+                self.Respond("RID," + self.RID[self.model])
+            elif cmd == "PRT":
+                self.Respond("PRT,A,9")
+            elif cmd == "WKN" and self.model == 'UZ':
+                self.Respond("WKN," + str(self.week % 1024))
+            elif cmd == "SID" and self.model == 'UZ':
+                # QueryRID reads a dummy date line, then the serial number
+                self.Send("$PASHR," +
+                          datetime.date.today().strftime("%m/%d/%y") + "\r\n")
+                self.Send("$PASHR," + self.SERIAL_NUMBER + "\r\n")
+            elif cmd == "FLS" and self.model == 'UZ':
+                self.Respond(self.MakeFLS())
+            elif cmd == "BLK":
+                self.SendBlock(int(args[0], 16), int(args[1], 16))
+            else:
+                self.Send("$PASHR,NAK*30\r\n")
+            return
+
+        if kind == "$PASHS":
+            if cmd == "OUT":
+                self.outputs = set(args[1:]) - {'BIN', 'ASC'}
+                if 'MBN' in self.outputs or 'PBN' in self.outputs:
+                    self.next_epoch = None
+                else:
+                    self.queue = [q for q in self.queue
+                                  if not q[2].startswith(b'$PASHR,MPC') and
+                                  not q[2].startswith(b'$PASHR,PBN')]
+                    heapq.heapify(self.queue)
+            elif cmd == "RCI":
+                self.interval = max(0.1, float(args[0]))
+            elif cmd == "NME":
+                if args[0] == "PER":
+                    self.nmea_period = float(args[1])
+                elif args[0] == "DAL":
+                    self.dal_on = args[-1] == "ON"
+                elif args[0] == "ALL":
+                    self.dal_on = self.dal_on and args[-1] == "ON"
+            elif cmd == "SPD":
+                pass		# a pty doesn't care about baud rate
+            self.Send("$PASHR,ACK*3D\r\n")
+
+###############################################################################
+# MakeEpoch -- queue one MBN per satellite, then the PBN
+###############################################################################
+    def MakeEpoch(self, when):
+        self.tow += self.interval
+        if self.tow >= 604800:
+            self.tow -= 604800
+            self.week += 1
+        self.epochs += 1
+
+        # in fast mode everything is due at once and goes out in the
+        # order queued, so each PBN follows its own MBNs
+        (spacing, delay) = (self.mbn_spacing, self.pbn_delay)
+        if self.fast:
+            (spacing, delay) = (0, 0)
+
+        prns = self.PRNS[:self.sats]
+        for (n, prn) in enumerate(prns):
+            if 'MBN' in self.outputs:
+                self.Queue(when + n * spacing,
+                           self.MakeMPC(prn, len(prns) - n - 1, n))
+        if 'PBN' in self.outputs:
+            self.Queue(when + delay, self.MakePBN())
+
+###############################################################################
+# MakeMPC -- binary MBN message for one satellite (see mben_struct)
+###############################################################################
+    def MakeMPC(self, prn, left, channel):
+        t = self.week * 604800 + self.tow
+        seq = int((self.tow % 1800) / 0.05)
+        el = int(15 + 70 * abs(math.sin(t / 7200.0 + prn)))
+        az = int(((prn * 23 + t / 240.0) % 360) / 2)
+
+        # range in meters, and its rate of change for the doppler
+        r = 21.0e6 + 2.5e6 * math.sin(t / 3600.0 + prn)
+        r_dot = 2.5e6 / 3600.0 * math.cos(t / 3600.0 + prn)
+        range_s = r / (AshtechGlobals.LIGHTSPEED * 1000.0)
+        snr = 120 + (prn * 7) % 80
+
+        blocks = []
+        for wavelength in (self.L1_WAVELENGTH, self.L1_WAVELENGTH,
+                           self.L2_WAVELENGTH):
+            blocks += [0, 24, b'\x00', snr, 8,
+                       r / wavelength, range_s,
+                       int(-r_dot / wavelength * 10000), 0]
+
+        payload = struct.pack(AshtechGlobals.mben_struct, seq, left, prn,
+                              el, az, channel, *blocks)
+        return b"$PASHR,MPC," + payload + make_chksum(payload, 1) + b"\r\n"
+
+###############################################################################
+# MakePBN -- binary PBN position message (see pben_struct)
+###############################################################################
+    def MakePBN(self):
+        (x, y, z) = self.position.xyz_float_list()
+        payload = struct.pack(AshtechGlobals.pben_struct,
+                              int(self.tow * 1000), b'SIM ', x, y, z,
+                              1.0e-9, 0.0, 0.0, 0.0, 0.0, 150)
+        return b"$PASHR,PBN," + payload + make_chksum(payload, 2) + b"\r\n"
+
+###############################################################################
+# MakeDAL -- almanac sentence; ashmessage.py only wants the week (field 13)
+###############################################################################
+    def MakeDAL(self):
+        body = "DAL,02,00,3.0E-03,319488,-7.9E-09,5153.6,0.0,-1.0,0.0," \
+            "0.0,0.0,0.0," + str(self.week % 1024)
+        sentence = "$PASHR," + body
+        return sentence + "*" + nmea_chksum(sentence) + "\r\n"
+
+###############################################################################
+# MakeFLS -- micro-Z file list: space left, total, count, then site,
+# wwwwdhhmm and size (KB) for each session
+###############################################################################
+    def MakeFLS(self):
+        sessions = [("SIM1", 120), ("SIM2", 2048), ("SIM3", 17)]
+        body = "FLS,{},{},{}".format(51200, len(sessions), len(sessions))
+        for (n, (site, size)) in enumerate(sessions):
+            body += ",{},{:04d}{}{:02d}{:02d},{}".format(
+                site, self.week % 1024, n % 7, 10 + n, 0, size)
+        return body
+
+###############################################################################
+# MakeMemory -- Z12 memory image: a FAT (see GetZ12Files in ashfile.py)
+# followed by the file data, addressed in bytes
+###############################################################################
+    FAT_SIZE = (10 + 40 * 10) * 2
+    FILE_HDR = ">l l 4s B B H l B 3s 1s 33s H l H H B B B B B B H H H"
+
+    def MakeMemory(self):
+        files = [("SIM1", 4096), ("SIM2", 65536)]
+        fat = struct.pack(">10H", *([0] * 9 + [len(files)]))
+        data = b''
+        address = self.FAT_SIZE
+        for (n, (site, size)) in enumerate(files):
+            fat += struct.pack(self.FILE_HDR, address, size // 2,
+                               site.encode('ascii'), 0, 0, self.week,
+                               int(self.tow), 0, b'', b'A', b'SIMULATED',
+                               self.week, int(self.tow), 0, 0, 0, 0, 0, 0,
+                               0, 0, 0, 0, 0)
+            data += bytes((i * 7 + n) & 0xFF for i in range(size))
+            address += size
+        fat += bytes(self.FAT_SIZE - len(fat))
+        return fat + data
+
+###############################################################################
+# SendBlock -- send part of the memory image via XMODEM-1k
+###############################################################################
+    def SendBlock(self, address, length):
+        class Block:
+            def __init__(self, data):
+                self.data = data
+                self.pos = 0
+
+            def read(self, size):
+                chunk = self.data[self.pos:self.pos + size]
+                self.pos += size
+                return chunk
+
+        def getc(size, timeout=10):
+            data = b''
+            deadline = time.monotonic() + timeout
+            while len(data) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not \
+                        select.select([self.master], [], [], remaining)[0]:
+                    break
+                data += os.read(self.master, size - len(data))
+            return data or None
+
+        def putc(data, timeout=10):
+            self.Send(data)
+            return len(data)
+
+        if self.verbose:
+            print("sim sending {} bytes from {:X}".format(length, address))
+        modem = XMODEM1k(getc, putc)
+        modem.send(Block(self.memory[address:address + length]), quiet=True)
+
+###############################################################################
+# MAIN PROGRAM
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="simulate an Ashtech receiver on a pseudo-terminal")
+    args.add_argument('--model', default='UZ', choices=['UZ', 'Z12'],
+                      help='receiver to pretend to be')
+    args.add_argument('--sats', default=8, type=int,
+                      help='number of satellites tracked (max 31)')
+    args.add_argument('--interval', default=1, type=float,
+                      help='seconds between epochs (until $PASHS,RCI)')
+    args.add_argument('--pbn_delay', default=3.0, type=float,
+                      help='seconds from epoch to PBN (a Z12 takes ~3)')
+    args.add_argument('--mbn_spacing', default=0.0, type=float,
+                      help='seconds between MBN messages (a Z12 takes ~0.11)')
+    args.add_argument('--fast', action='store_true',
+                      help="stream epochs as fast as the client takes them")
+    args.add_argument('-v', '--verbose', action='store_true',
+                      help='show commands received')
+    opts = args.parse_args()
+
+    sim = AshtechSimulator(opts.model, min(opts.sats, 31), opts.interval,
+                           opts.pbn_delay, opts.mbn_spacing, opts.fast,
+                           opts.verbose)
+    print("Simulated", opts.model, "on", sim.Open())
+    sys.stdout.flush()
+    try:
+        sim.Run()
+    except KeyboardInterrupt:
+        pass
+    print()
+    print("{} commands, {} epochs, {} bytes sent".format(
+        sim.commands, sim.epochs, sim.bytes_sent))
+    sim.Close()
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashsim.py
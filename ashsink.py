@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashsink.py    #################################
+
+# Where assembled epochs go.  The message loop hands each epoch to every
+# sink (AshtechSinks.put) and goes straight back to the serial port.  Each
+# sink has its own bounded queue and thread, so a slow disk or a slow
+# network client only holds up that one sink; if its queue is full the
+# epoch is dropped for that sink and counted, rather than waited for.
+# That's only right while a receiver is streaming: a blocking sink waits
+# for room instead, as the capture file always does and as every sink
+# does for a replay or a benchmark (AshtechSinks.set_blocking), where
+# there's no receiver to fall behind and nothing may be lost.
+#
+#   RinexSink   -- the RINEX file (see ashrinex.py)
+#   JsonSink    -- one JSON object per epoch, one per line (--json)
+#   PublishSink -- the same lines to every TCP client (--publish)
+#   StoreSink   -- columnar NumPy files (--store; see ashstore.py)
+#   CaptureSink -- raw messages to a capture file (see ashcapture.py); it
+#                  is fed by the serial port rather than by epochs
+#
+# In low latency mode an epoch whose PBN turns up later is put again with
+# update=True; the RINEX record stays as written, the JSON sinks send a
+# short record with the position.
+#
+# stats() gives each sink's counters: items given to it, written, dropped
+# and failed, how many are waiting, and the time from put to written.
+
+import sys
+import time
+import json
+import queue
+import socket
+import threading
+
+from ashrecord import *
+
+SINK_QUEUE = 100		# epochs waiting for each sink
+CLOSE_TIMEOUT = 30		# seconds close() waits for a sink to catch up
+
+# MbenRecord fields for epoch_json; the spare bytes aren't worth sending
+JSON_MBEN_KEYS = [key for key in MbenRecord.KEYS + MbenRecord.FLAGS
+                  if not key.endswith('_spare')]
+
+
+class AshtechSink:
+    QUEUE_SIZE = SINK_QUEUE
+    BLOCK = False		# wait for room rather than drop
+    POLL = 0.5			# seconds between looks at the stop flag
+
+###############################################################################
+###############################################################################
+    def __init__(self, name, size=None):
+        self.name = name
+        self.queue = queue.Queue(size or self.QUEUE_SIZE)
+        self.block = self.BLOCK
+        self.stopping = False
+
+        # counters
+        self.received = 0		# items put
+        self.written = 0		# ... handled
+        self.dropped = 0		# ... thrown away, queue full
+        self.errors = 0			# ... that raised an exception
+        self.latency = 0.0		# seconds from put to written: last
+        self.latency_max = 0.0		# ... most
+        self.latency_total = 0.0	# ... all of them
+
+        self.thread = threading.Thread(target=self.run, name=name,
+                                       daemon=True)
+        self.thread.start()
+
+###############################################################################
+# put -- queue one item for the sink's thread.  The arguments are passed
+# to handle().  Never waits unless the sink is blocking, and then only
+# while its thread is running.  Returns False if the item had to be
+# dropped.
+###############################################################################
+    def put(self, *item):
+        self.received += 1
+        record = (time.monotonic(), item)
+        if self.block:
+            while self.thread.is_alive():
+                try:
+                    self.queue.put(record, timeout=self.POLL)
+                    return True
+                except queue.Full:
+                    pass
+        else:
+            try:
+                self.queue.put_nowait(record)
+                return True
+            except queue.Full:
+                pass
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            print("Output", self.name, "is falling behind;",
+                  self.dropped, "dropped")
+        return False
+
+###############################################################################
+# run -- the sink's thread: handle items until close() and the queue is
+# empty.  An item that fails is counted and skipped.
+###############################################################################
+    def run(self):
+        while True:
+            try:
+                (stamp, item) = self.queue.get(timeout=self.POLL)
+            except queue.Empty:
+                if self.stopping:
+                    return
+                continue
+            try:
+                self.handle(*item)
+            except Exception:
+                self.errors += 1
+                if self.errors == 1 or self.errors % 100 == 0:
+                    print("Output", self.name, "error:", sys.exc_info()[1])
+                continue
+            self.latency = time.monotonic() - stamp
+            self.latency_total += self.latency
+            if self.latency > self.latency_max:
+                self.latency_max = self.latency
+            self.written += 1
+
+###############################################################################
+# handle -- write one item (runs on the sink's thread); finish -- tidy up
+# after the thread has stopped
+###############################################################################
+    def handle(self, *item):
+        pass
+
+    def finish(self):
+        pass
+
+###############################################################################
+# close -- let the thread write what's queued, then stop it
+###############################################################################
+    def close(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.thread.join(CLOSE_TIMEOUT)
+        if self.thread.is_alive():
+            print("Output", self.name, "didn't finish;",
+                  self.queue.qsize(), "items not written")
+            return
+        self.finish()
+
+###############################################################################
+# stats -- the counters as a dictionary; latencies in milliseconds
+###############################################################################
+    def stats(self):
+        mean = 0.0
+        if self.written:
+            mean = self.latency_total / self.written
+        return {'name': self.name, 'received': self.received,
+                'written': self.written, 'dropped': self.dropped,
+                'errors': self.errors, 'queued': self.queue.qsize(),
+                'latency_ms': self.latency * 1000,
+                'latency_mean_ms': mean * 1000,
+                'latency_max_ms': self.latency_max * 1000}
+
+
+class AshtechSinks:
+
+###############################################################################
+# AshtechSinks -- the set of sinks the message loop writes epochs to
+###############################################################################
+    def __init__(self):
+        self.sinks = []
+
+    def add(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def put(self, epoch, update=False):
+        for sink in self.sinks:
+            sink.put(epoch, update)
+
+###############################################################################
+# set_blocking -- make every sink wait for room instead of dropping epochs
+# (for replays and benchmarks, which have no receiver to fall behind)
+###############################################################################
+    def set_blocking(self, block=True):
+        for sink in self.sinks:
+            sink.block = block
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        return [sink.stats() for sink in self.sinks]
+
+###############################################################################
+# report -- print one line of counters per sink
+###############################################################################
+    def report(self):
+        for s in self.stats():
+            print("{:<10} {:6d} written, {:4d} dropped, {:4d} errors;"
+                  " latency {:.1f} ms mean, {:.1f} ms max".format(
+                      s['name'], s['written'], s['dropped'], s['errors'],
+                      s['latency_mean_ms'], s['latency_max_ms']))
+
+
+class RinexSink(AshtechSink):
+
+###############################################################################
+# RinexSink -- epochs to the RINEX file.  Late PBNs don't change it.
+###############################################################################
+    def __init__(self, rinex, size=None):
+        self.RINEX = rinex
+        super().__init__("rinex", size)
+
+    def handle(self, epoch, update=False):
+        if not update:
+            self.RINEX.WriteEpoch(epoch)
+
+###############################################################################
+# epoch_json -- an epoch as a line of JSON: GPS week and tow, the time, the
+# position from the PBN (null if there wasn't one) and every MbenRecord
+# field (JSON_MBEN_KEYS) for each satellite.  An update has no "sats".
+###############################################################################
+
+
+def epoch_json(epoch, update=False):
+    when = epoch.gps_time()
+    record = {'week': when.week, 'tow': when.tow,
+              'time': when.timestring()}
+    if update:
+        record['update'] = True
+    pben = epoch.pben
+    if pben is not None:
+        pben = dict((key, getattr(pben, key)) for key in PbenRecord.KEYS)
+    record['pben'] = pben
+    if not update:
+        record['sats'] = [dict((key, getattr(mben, key))
+                               for key in JSON_MBEN_KEYS)
+                          for mben in epoch.mben_list if mben]
+    return json.dumps(record) + "\n"
+
+
+class JsonSink(AshtechSink):
+
+###############################################################################
+# JsonSink -- epochs to a file as JSON lines (see epoch_json)
+###############################################################################
+    def __init__(self, filename, size=None):
+        print("Writing epochs as JSON to", filename)
+        self.file = open(filename, 'a')
+        super().__init__("json", size)
+
+    def handle(self, epoch, update=False):
+        self.file.write(epoch_json(epoch, update))
+        self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+class PublishSink(AshtechSink):
+    SEND_TIMEOUT = 1.0		# seconds a client gets to take each line
+
+###############################################################################
+# PublishSink -- epochs as JSON lines to every client connected to a TCP
+# port.  address is "port" or "host:port".  Clients are picked up as each
+# epoch goes out; one that doesn't keep up is disconnected.
+###############################################################################
+    def __init__(self, address, size=None):
+        (host, _, port) = str(address).rpartition(':')
+        try:
+            self.server = socket.create_server((host, int(port)))
+        except (OSError, ValueError):
+            print("Couldn't listen on", address, "!", sys.exc_info()[1])
+            sys.exit(1)
+        self.server.setblocking(False)
+        print("Publishing epochs on", address)
+        self.clients = []
+        self.disconnected = 0
+        super().__init__("publish", size)
+
+    def handle(self, epoch, update=False):
+        while True:
+            try:
+                (client, peer) = self.server.accept()
+            except BlockingIOError:
+                break
+            client.settimeout(self.SEND_TIMEOUT)
+            self.clients.append(client)
+
+        line = epoch_json(epoch, update).encode('ascii')
+        for client in list(self.clients):
+            try:
+                client.sendall(line)
+            except OSError:
+                client.close()
+                self.clients.remove(client)
+                self.disconnected += 1
+
+    def finish(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+
+    def stats(self):
+        stats = super().stats()
+        stats['clients'] = len(self.clients)
+        stats['disconnected'] = self.disconnected
+        return stats
+
+
+class CaptureSink(AshtechSink):
+    QUEUE_SIZE = 40 * SINK_QUEUE	# messages, not epochs
+    BLOCK = True			# a capture with holes can't be replayed
+
+###############################################################################
+# CaptureSink -- stands in for an AshtechCapture, writing on its own thread.
+# Messages keep the time they arrived (see AshtechRingBuffer.arrival), or
+# the time they were put if the caller doesn't know it.
+###############################################################################
+    def __init__(self, capture, size=None):
+        self.capture = capture
+        super().__init__("capture", size)
+
+    def write(self, frame, timestamp=None, reply=False):
+        self.put(frame, timestamp or time.monotonic_ns(), reply)
+
+    def write_meta(self, meta):
+        self.put(meta, None, False)
+
+    def handle(self, record, timestamp, reply):
+        if timestamp is None:
+            self.capture.write_meta(record)
+        else:
+            self.capture.write(record, timestamp, reply)
+
+    def finish(self):
+        self.capture.close()
+
+###############################################################################
+# start_sinks -- the RINEX sink and whichever others the options ask for
+###############################################################################
+
+
+def start_sinks(g, rinex):
+    size = g.opts.get('sink_queue') or SINK_QUEUE
+    sinks = AshtechSinks()
+    if rinex:
+        sinks.add(RinexSink(rinex, size))
+    if g.opts.get('json'):
+        sinks.add(JsonSink(g.opts['json'], size))
+    if g.opts.get('publish'):
+        sinks.add(PublishSink(g.opts['publish'], size))
+    if g.opts.get('store'):
+        from ashstore import StoreSink		# needs NumPy
+        sinks.add(StoreSink(g.opts['store'], size))
+    g.sinks = sinks
+    return sinks
+
+# end of ashsink.py
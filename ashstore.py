@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+################################  N8UR ASHCOMM  ################################
+#
+#	Copyright 2019 by John Ackermann, N8UR jra@febo.com https://febo.com
+#	Version number can be found in the ashglobal.py file
+#
+#	This program is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; either version 2 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#	Software to communicate with Ashtech GPS receivers via serial port.
+################################################################################
+
+#############################   ashstore.py    ################################
+
+# A columnar store of everything parse_mben and parse_pben decode, as an
+# alternative to RINEX text for analysis.  A store is a directory of NumPy
+# .npy files, one per field, each indexed by epoch (and PRN 0-32, like
+# mben_list):
+#
+#   time.npy		(epochs,)	int64 ns since the GPS epoch
+#   present.npy		(epochs, 33)	1 where the PRN is in the epoch
+#   <MbenRecord field>.npy	(epochs, 33)	every field and flag, decoded
+#   pben.npy		(epochs,)	1 if the epoch has its PBN
+#   <PbenRecord field>.npy	(epochs,)	every field, decoded
+#
+# Missing values are NaN (floats) or 0.  The files are appended to as
+# epochs come in (see StoreSink, --store) and a store can be reopened and
+# added to, so one directory can hold months.  Each .npy header is padded
+# to a fixed size so its shape can be rewritten in place; that's done when
+# the store is closed, and load_store works out the number of rows from
+# the file sizes anyway, so a store that's still being written (or wasn't
+# closed) can be read too.
+#
+# load_store gives back read-only memory maps, so nothing is copied:
+#   arrays = load_store("N8UR.store")
+#   l1 = window(arrays, start, end)['l1_phase'][:, 5]	# PRN 5
+#
+# NumPy is needed for this file (and --store); the rest of ashcomm runs
+# without it.
+
+import os
+import sys
+import ast
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ashrecord import *
+from ashreader import *
+from ashsink import *
+
+HEADER_LEN = 128		# bytes of .npy header, padding included
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+# dtypes of the decoded MbenRecord fields by name ending, and of PbenRecord.
+# The one-byte spare fields are kept as numbers: NumPy's S1 would drop a NUL.
+MBEN_DTYPES = {
+    'seq': '<u2', 'struct_left': 'u1', 'prn': 'u1', 'el': 'u1',
+    'az': '<u2', 'ch_id': 'u1', '_warn': 'u1', '_goodbad': 'u1',
+    '_spare': 'u1', '_snr': '<f8', '_qual': 'u1', '_phase': '<f8',
+    '_range': '<f8', '_dopp': '<f8', '_correction': '<i4', '_lli': 'u1',
+    '_sbyte': 'u1'}
+PBEN_DTYPES = {
+    'tow': '<f8', 'site': 'S4', 'navx': '<f8', 'navy': '<f8',
+    'navz': '<f8', 'offset': '<f4', 'velx': '<f4', 'vely': '<f4',
+    'velz': '<f4', 'drift': '<f4', 'pdop': '<f8'}
+
+
+def mben_dtype(name):
+    for (ending, dtype) in MBEN_DTYPES.items():
+        if name == ending or (ending[0] == '_' and name.endswith(ending)):
+            return dtype
+    raise KeyError(name)
+
+###############################################################################
+# store_columns -- (name, dtype, row shape) of every file in a store
+###############################################################################
+
+
+def store_columns():
+    columns = [('time', '<i8', ()), ('present', 'u1', (33,))]
+    for name in MbenRecord.KEYS + MbenRecord.FLAGS:
+        columns.append((name, mben_dtype(name), (33,)))
+    columns.append(('pben', 'u1', ()))
+    for name in PbenRecord.KEYS:
+        columns.append((name, PBEN_DTYPES[name], ()))
+    return columns
+
+###############################################################################
+# npy_header -- a .npy version 1.0 header, padded to HEADER_LEN
+###############################################################################
+
+
+def npy_header(dtype, shape):
+    text = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}". \
+        format(np.dtype(dtype).str, tuple(shape))
+    text = text.ljust(HEADER_LEN - len(NPY_MAGIC) - 2 - 1) + "\n"
+    return NPY_MAGIC + len(text).to_bytes(2, 'little') + text.encode('ascii')
+
+###############################################################################
+# read_npy_header -- (dtype, shape) from a store file's header
+###############################################################################
+
+
+def read_npy_header(f):
+    header = f.read(HEADER_LEN)
+    if len(header) != HEADER_LEN or not header.startswith(NPY_MAGIC):
+        raise ValueError(f.name + " isn't a store column")
+    info = ast.literal_eval(header[len(NPY_MAGIC) + 2:].decode('ascii'))
+    return np.dtype(info['descr']), tuple(info['shape'])
+
+
+class StoreColumn:
+
+###############################################################################
+# StoreColumn -- one .npy file, open for appending rows
+###############################################################################
+    def __init__(self, path, dtype, tail):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.tail = tail
+        self.row_bytes = self.dtype.itemsize * int(np.prod(tail, dtype=int))
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            (dtype, shape) = read_npy_header(self.file)
+            if dtype != self.dtype or shape[1:] != tail:
+                raise ValueError(path + " has the wrong type or shape")
+            self.rows = (os.path.getsize(path) - HEADER_LEN) // self.row_bytes
+        else:
+            self.file = open(path, 'w+b')
+            self.rows = 0
+            self.write_header()
+
+    def write_header(self):
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.rows,) + self.tail))
+
+###############################################################################
+# truncate -- drop rows past "rows" (after a crash, so the files agree)
+###############################################################################
+    def truncate(self, rows):
+        self.rows = rows
+        self.file.truncate(HEADER_LEN + rows * self.row_bytes)
+
+###############################################################################
+# append -- add a row; put -- overwrite row "row" (both numpy arrays)
+###############################################################################
+    def append(self, values):
+        self.file.seek(HEADER_LEN + self.rows * self.row_bytes)
+        self.file.write(values.tobytes())
+        self.rows += 1
+
+    def put(self, row, values):
+        self.file.seek(HEADER_LEN + row * self.row_bytes)
+        self.file.write(values.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_header()
+        self.file.close()
+
+
+class AshtechStore:
+    RECENT = 64			# rows kept track of for late PBNs
+
+###############################################################################
+# AshtechStore -- a store directory open for appending epochs (see
+# ashepoch.py); created if it isn't there
+###############################################################################
+    def __init__(self, directory):
+        if np is None:
+            print("The observation store needs NumPy (pip install numpy)!")
+            sys.exit(1)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.columns = {}
+        for (name, dtype, tail) in store_columns():
+            self.columns[name] = StoreColumn(
+                os.path.join(directory, name + ".npy"), dtype, tail)
+        rows = min(c.rows for c in self.columns.values())
+        for column in self.columns.values():
+            if column.rows != rows:
+                column.truncate(rows)
+        self.rows = {}			# epoch key (GPS ms) -> row
+
+###############################################################################
+# append -- one epoch's row in every column
+###############################################################################
+    def append(self, epoch):
+        columns = self.columns
+        mben_list = epoch.mben_list
+        row = columns['time'].rows
+        columns['time'].append(np.array(epoch.key * 10**6, '<i8'))
+        columns['present'].append(
+            np.array([m is not None for m in mben_list], 'u1'))
+        for name in MbenRecord.KEYS + MbenRecord.FLAGS:
+            column = columns[name]
+            fill = np.nan if column.dtype.kind == 'f' else 0
+            values = [getattr(m, name) if m is not None else fill
+                      for m in mben_list]
+            if name.endswith('_spare'):
+                values = [ord(v) if m is not None else fill
+                          for (v, m) in zip(values, mben_list)]
+            column.append(np.array(values, column.dtype))
+        self.write_pben(epoch.pben, None)
+
+        self.rows[epoch.key] = row
+        if len(self.rows) > self.RECENT:
+            del self.rows[min(self.rows)]
+        for column in columns.values():
+            column.flush()
+
+###############################################################################
+# update -- the PBN for an epoch already appended (low latency mode)
+###############################################################################
+    def update(self, epoch):
+        row = self.rows.get(epoch.key)
+        if row is None:
+            return
+        self.write_pben(epoch.pben, row)
+        for column in self.columns.values():
+            column.flush()
+
+###############################################################################
+# write_pben -- the pben columns, appended (row None) or overwritten
+###############################################################################
+    def write_pben(self, pben, row):
+        values = [('pben', np.array(pben is not None, 'u1'))]
+        for name in PbenRecord.KEYS:
+            dtype = np.dtype(PBEN_DTYPES[name])
+            if pben is None:
+                value = b'' if dtype.kind == 'S' else np.nan
+            elif name == 'site':
+                value = pben.site.encode('ascii', 'replace')
+            else:
+                value = getattr(pben, name)
+            values.append((name, np.array(value, dtype)))
+        for (name, value) in values:
+            if row is None:
+                self.columns[name].append(value)
+            else:
+                self.columns[name].put(row, value)
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+class StoreSink(AshtechSink):
+
+###############################################################################
+# StoreSink -- epochs to an AshtechStore, on its own thread (see ashsink.py)
+###############################################################################
+    def __init__(self, directory, size=None):
+        print("Storing epochs in", directory)
+        self.store = AshtechStore(directory)
+        super().__init__("store", size)
+
+    def handle(self, epoch, update=False):
+        if update:
+            self.store.update(epoch)
+        else:
+            self.store.append(epoch)
+
+    def finish(self):
+        self.store.close()
+
+###############################################################################
+# load_store -- every column of a store as a read-only memory map, all cut
+# to the rows every column has.  Returns a dictionary of name -> array.
+###############################################################################
+
+
+def load_store(directory):
+    if np is None:
+        print("The observation store needs NumPy (pip install numpy)!")
+        sys.exit(1)
+    found = {}
+    for (name, dtype, tail) in store_columns():
+        path = os.path.join(directory, name + ".npy")
+        with open(path, 'rb') as f:
+            (dtype, shape) = read_npy_header(f)
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=int))
+        rows = (os.path.getsize(path) - HEADER_LEN) // row_bytes
+        found[name] = (path, dtype, shape[1:], rows)
+
+    rows = min(f[3] for f in found.values())
+    arrays = {}
+    for (name, (path, dtype, tail, count)) in found.items():
+        if rows:
+            arrays[name] = np.memmap(path, dtype, mode='r',
+                                     offset=HEADER_LEN, shape=(rows,) + tail)
+        else:
+            arrays[name] = np.empty((0,) + tail, dtype)
+    return arrays
+
+###############################################################################
+# window -- views of the arrays for epochs from start up to (not including)
+# end: GPS_Time, datetime (GPS time) or ns, None for either end
+###############################################################################
+
+
+def window(arrays, start=None, end=None):
+    time = arrays['time']
+    first = 0 if start is None else \
+        int(np.searchsorted(time, time_ns(start), 'left'))
+    last = len(time) if end is None else \
+        int(np.searchsorted(time, time_ns(end), 'left'))
+    return dict((name, array[first:last]) for (name, array) in arrays.items())
+
+###############################################################################
+# MAIN PROGRAM -- say what's in a store
+###############################################################################
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description="summarize an observation store")
+    args.add_argument('store', type=str, help='store directory')
+    opts = args.parse_args()
+
+    try:
+        arrays = load_store(opts.store)
+    except (OSError, ValueError) as e:
+        print("Couldn't read", opts.store, ":", e)
+        sys.exit(1)
+
+    time = arrays['time']
+    print(len(time), "epochs,", len(arrays), "columns")
+    if len(time):
+        print("from", GPS_Time.from_ns(0, int(time[0])).timestring(),
+              "to", GPS_Time.from_ns(0, int(time[-1])).timestring())
+        prns = np.flatnonzero(arrays['present'].any(axis=0))
+        print("PRNs:", " ".join(str(p) for p in prns))
+        print("epochs with a PBN:", int(arrays['pben'].sum()))
+
+
+if __name__ == '__main__':
+    main()
+
+# end of ashstore.py
@@ -20,53 +20,124 @@
 #############################   ashtime.py    ##################################
 
 import datetime
+import functools
 
+WEEK_NS = 604800 * 10**9
+DAY_NS = 86400 * 10**9
+GPS_EPOCH = datetime.date(1980, 1, 6).toordinal()
 
+###############################################################################
+# gps_day -- calendar date for a day number counted from the GPS epoch:
+# (year, month, mday, yday).  Every epoch of a day asks for the same one,
+# so they're cached.
+###############################################################################
+
+
+@functools.lru_cache(maxsize=64)
+def gps_day(day):
+    date = datetime.date.fromordinal(GPS_EPOCH + day)
+    yday = day - (datetime.date(date.year, 1, 1).toordinal() - GPS_EPOCH) + 1
+    return date.year, date.month, date.day, yday
+
+
+@functools.total_ordering
 class GPS_Time:
 
+    # The time is kept as integer week and nanoseconds of week, so it can be
+    # compared, sorted and used as a dictionary key (e.g. for an epoch).
+    # The calendar fields and strings are only worked out when asked for.
+    __slots__ = ['week', 'ns', '_fields']
+
     def __init__(self, week, tow):
+        (week, ns) = divmod(int(week) * WEEK_NS + round(tow * 10**9), WEEK_NS)
         self.week = week
-        self.tow = tow
-        self.time_list = self.MakeTime(week, tow)
-        (self.sec, self.minute, self.hour, self.mday, self.mon, self.year,
-         self.weeknum, self.yday) = self.time_list
+        self.ns = ns
+        self._fields = None
+
+    @classmethod
+    def from_ns(cls, week, ns):
+        self = cls.__new__(cls)
+        (self.week, self.ns) = divmod(week * WEEK_NS + ns, WEEK_NS)
+        self._fields = None
+        return self
+
+    @property
+    def tow(self):
+        return self.ns / 1e9
+
+###############################################################################
+# fields -- (year, mon, mday, hour, minute, sec, weeknum, yday) as numbers;
+# sec has the fraction, weeknum is the day of the week (Sunday = 0)
+###############################################################################
+    def fields(self):
+        if self._fields is None:
+            (day, ns) = divmod(self.ns, DAY_NS)
+            (year, mon, mday, yday) = gps_day(self.week * 7 + day)
+            (hour, ns) = divmod(ns, 3600 * 10**9)
+            (minute, ns) = divmod(ns, 60 * 10**9)
+            self._fields = (year, mon, mday, hour, minute, ns / 1e9,
+                            day, yday)
+        return self._fields
 
 ###############################################################################
 # MakeTime -- take GPSWeek and TOW and return GPS time
 # (NOT UTC; no leapseconds) in list format.
+# Returns: (sec,min,hour,mday,mon,year,weeknum,yday) as strings, the way
+# strftime "%S,%M,%H,%d,%m,%Y,%w,%j" has them.
+###############################################################################
+    def MakeTime(self, week=None, tow=None):
+        if week is not None:
+            return GPS_Time(week, tow).time_list
+        (year, mon, mday, hour, minute, sec, weeknum, yday) = self.fields()
+        return ["{:02d}".format(int(sec)), "{:02d}".format(minute),
+                "{:02d}".format(hour), "{:02d}".format(mday),
+                "{:02d}".format(mon), "{:04d}".format(year),
+                "{:d}".format(weeknum), "{:03d}".format(yday)]
+
+    # the old attributes, now made when asked for
+    time_list = property(MakeTime)
+    gpstime = property(lambda self: ",".join(self.time_list))
+    sec = property(lambda self: self.time_list[0])
+    minute = property(lambda self: self.time_list[1])
+    hour = property(lambda self: self.time_list[2])
+    mday = property(lambda self: self.time_list[3])
+    mon = property(lambda self: self.time_list[4])
+    year = property(lambda self: self.time_list[5])
+    weeknum = property(lambda self: self.time_list[6])
+    yday = property(lambda self: self.time_list[7])
+
+    @property
+    def gpstimestring(self):
+        (year, mon, mday, hour, minute, sec) = self.fields()[:6]
+        return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
+            year, mon, mday, hour, minute, int(sec))
+
+###############################################################################
+# comparisons, so epochs can be sorted and looked up by time
 ###############################################################################
-    def MakeTime(self, week, tow):
-        datetime_input_format = "%Y-%m-%d %H:%M:%S"
-        datetimeformat = "%S,%M,%H,%d,%m,%Y,%w,%j"
-        epoch = datetime.datetime.strptime("1980-01-06 00:00:00",
-                                           datetime_input_format)
-        elapsed = datetime.timedelta(days=(week*7),
-                                     seconds=tow)  # Use GPS time; no leapseconds
+    def __eq__(self, other):
+        if not isinstance(other, GPS_Time):
+            return NotImplemented
+        return (self.week, self.ns) == (other.week, other.ns)
 
-        # sticks object in self.gpstime for other formatting
-        self.gpstime = datetime.datetime.strftime(
-            epoch + elapsed, datetimeformat)
-        gpstimelist = list(self.gpstime.split(','))
+    def __lt__(self, other):
+        if not isinstance(other, GPS_Time):
+            return NotImplemented
+        return (self.week, self.ns) < (other.week, other.ns)
 
-        # also make a pretty string version
-        self.gpstimestring = datetime.datetime.strftime(
-            epoch + elapsed, datetime_input_format).strip()
+    def __hash__(self):
+        return hash((self.week, self.ns))
 
-        # Returns: (sec,min,hour,mday,mon,year,weeknum,yday)
-        return gpstimelist
+    def __repr__(self):
+        return "GPS_Time({}, {})".format(self.week, self.tow)
 
 ###############################################################################
 # RINEX_fmt_obs -- return string in RINEX format for epoch header
 ###############################################################################
     def RINEX_fmt_obs(self):
-        timestring = " {:2d}".format(int(self.year) - 2000)
-        timestring += " {:2d}".format(int(self.mon))
-        timestring += " {:2d}".format(int(self.mday))
-        timestring += " {:2d}".format(int(self.hour))
-        timestring += " {:2d}".format(int(self.minute))
-        timestring += "{:11.7f}".format(float(self.sec))
-
-        return timestring
+        (year, mon, mday, hour, minute, sec) = self.fields()[:6]
+        return " {:2d} {:2d} {:2d} {:2d} {:2d}{:11.7f}".format(
+            year - 2000, mon, mday, hour, minute, sec)
 
 ###############################################################################
 # timelist -- return list of values:
@@ -120,7 +191,7 @@ class GPS_Time:
         # to give us tow to prior 30 minute point
         trunc_seconds = quotient * 1800
 
-        return seq_seconds
+        return trunc_seconds
 
 ###############################################################################
 # NOT IN GPS_Time class
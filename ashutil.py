@@ -30,55 +30,110 @@ import math
 # verify_chksum -- generate checksum from payload and compare to one or two
 # checksum_bytes, returning true if they match.  Expects that payload has
 # already been stripped of checksum bytes (they are passed as "checksum_rcvd")
+# This runs on every message, so it avoids looping over bytes in Python.
 ###############################################################################
 
 
 def verify_chksum(payload, chksum_rcvd):
     # single byte checksum is simple XOR
     if len(chksum_rcvd) == 1:
-        chksum_rcvd = chksum_rcvd[0]
-        chksum = 0
-        for c in payload:
-            chksum = chksum ^ c
+        return xor_bytes(payload) == chksum_rcvd[0]
 
     # two-byte checksum is sum of payload unpacked as unsigned shorts
     # remember to change from big-endian
-    else:
-        try:
-            chksum_rcvd, = struct.unpack('> H', chksum_rcvd)
-        except:
-            print("Couldn't read checksum!")
-            return False
-        size = len(payload)
-        words = int(size / 2)
-        odd = None
-        if size % 2 == 0:                       # length is even
-            fmt = '> ' + str(words) + 'H'
-            try:
-                shorts = struct.unpack(fmt, payload)
-            except:
-                print("Couldn't read checksum!")
-                return False
-        else:                                   # length is odd
-            fmt = '>' + str(words) + 'H B'      # get odd byte too
-            try:
-                (shorts, odd) = struct.unpack(fmt, payload)
-            except:
-                print("Couldn't read checksum!")
-                return False
-        chksum = 0
-        for i in range(0, words):
-            chksum = chksum + shorts[i]
-        if odd:
-            chksum = chksum + odd
-
-        while chksum > 65535:
-            chksum = chksum - 65536
-
-    if chksum == chksum_rcvd:
-        return True
-    else:
+    try:
+        chksum_rcvd, = struct.unpack('> H', chksum_rcvd)
+    except:
+        print("Couldn't read checksum!")
         return False
+    return sum_shorts(payload) == chksum_rcvd
+
+###############################################################################
+# xor_bytes -- XOR of all the bytes in payload.  Treat the payload as one
+# big integer and fold it in half until one byte is left: a handful of
+# big-integer operations instead of one per byte.
+###############################################################################
+
+
+XOR_MASKS = [(1 << (8 * n)) - 1 for n in range(512)]
+
+
+def xor_bytes(payload):
+    size = len(payload)
+    value = int.from_bytes(payload, 'little')
+    while size > 1:
+        half = (size + 1) >> 1
+        mask = XOR_MASKS[half] if half < 512 else (1 << (8 * half)) - 1
+        value = (value & mask) ^ (value >> (8 * half))
+        size = half
+    return value
+
+###############################################################################
+# sum_shorts -- sum of payload as big-endian unsigned shorts, modulo 65536.
+# The high bytes are the even ones and the low bytes the odd ones, so
+# that's 256 * sum(even bytes) + sum(odd bytes).  An odd byte at the end
+# is added on by itself (like make_chksum).
+###############################################################################
+
+
+def sum_shorts(payload):
+    if len(payload) % 2:
+        return (sum_shorts(payload[:-1]) + payload[-1]) & 0xFFFF
+    return (256 * sum(payload[0::2]) + sum(payload[1::2])) & 0xFFFF
+
+###############################################################################
+# verify_chksum_batch -- check many messages at once.  messages is a list
+# of payloads with their chksum_size checksum bytes still on the end;
+# returns a list of True/False.  Uses NumPy if it's installed and the
+# messages are all the same length.
+###############################################################################
+
+
+def verify_chksum_batch(messages, chksum_size):
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    sizes = set(map(len, messages))
+    if np is None or len(sizes) != 1 or \
+            (chksum_size == 2 and (sizes.pop() - 2) % 2):
+        return [verify_chksum(m[:-chksum_size], m[-chksum_size:])
+                for m in messages]
+
+    data = np.frombuffer(b''.join(messages), np.uint8).reshape(
+        len(messages), -1)
+    if chksum_size == 1:
+        good = np.bitwise_xor.reduce(data[:, :-1], axis=1) == data[:, -1]
+    else:
+        shorts = data.copy().view('>u2')
+        good = (shorts[:, :-1].sum(axis=1, dtype=np.uint64) & 0xFFFF) == \
+            shorts[:, -1]
+    return good.tolist()
+
+###############################################################################
+# make_chksum -- the other direction: return the checksum byte(s) for a
+# payload (size 1 = XOR as for MBN, size 2 = sum of shorts as for PBN).
+# Used by the receiver simulator in ashsim.py.
+###############################################################################
+
+
+def make_chksum(payload, size):
+    if size == 1:
+        return bytes([xor_bytes(payload)])
+    return struct.pack('> H', sum_shorts(payload))
+
+###############################################################################
+# nmea_chksum -- two hex digit XOR checksum of an ASCII sentence, covering
+# everything between the "$" and the "*"
+###############################################################################
+
+
+def nmea_chksum(sentence):
+    chksum = 0
+    for c in sentence.lstrip('$').encode('ascii'):
+        chksum = chksum ^ c
+    return "{:02X}".format(chksum)
 
 ###############################################################################
 # fix_gps_week_rollover -- correct Wn by adding appropriate number of weeks
@@ -95,129 +150,108 @@ def fix_rollover(Wn):
 ###############################################################################
 # make_lli -- function to create lli byte from warn and good/bad flags
 ###############################################################################
+# Z12 output:
+# warning flag bits:
+# 0		-- same as 22 in good/bad
+# 1		-- same as 24 in good/bad
+# 2		-- same as 23 in good/bad
+# 4		-- carrier phase questionable
+# 8		-- code phase (range) questionable
+# 16	-- range not precise (code phase loop not settled)
+# 32	-- Z tracking mode
+# 64	-- possible cycle slip
+# 128	-- loss of lock since last epoch
+#
+# good/bad flag (integer values):
+# 0		-- measurement not available, no further data sent
+# 22	-- code and/or carrier phase measured
+# 23	-- code and/or carrier phase measure, and nav message
+#			obtained but measurement not used to compute position
+# 24	-- code and/or carrier phase measured, nav message
+#			 obtained, and measurement used to compute position
+#
+# lli fields:
+# all zeroes -- OK or not known
+# 1		-- lost lock since previous obs; cycle slip possible
+# 2		-- opposite wavelength factor to defined (or default)
+# 4		-- observation under anti-spoofing
+# bits 0 and 1 for phase only
+#
+# The lli only depends on the warning flag (once we know there's data), so
+# it's looked up in LLI_TABLE, built once from warn_lli.
+###############################################################################
 
 
-def make_lli(warn, goodbad):
-    # Z12 output:
-    # warning flag bits:
-    # 0		-- same as 22 in good/bad
-    # 1		-- same as 24 in good/bad
-    # 2		-- same as 23 in good/bad
-    # 4		-- carrier phase questionable
-    # 8		-- code phase (range) questionable
-    # 16	-- range not precise (code phase loop not settled)
-    # 32	-- Z tracking mode
-    # 64	-- possible cycle slip
-    # 128	-- loss of lock since last epoch
-    #
-    # good/bad flag (integer values):
-    # 0		-- measurement not available, no further data sent
-    # 22	-- code and/or carrier phase measured
-    # 23	-- code and/or carrier phase measure, and nav message
-    #			obtained but measurement not used to compute position
-    # 24	-- code and/or carrier phase measured, nav message
-    #			 obtained, and measurement used to compute position
-    #
-    # lli fields:
-    # all zeroes -- OK or not known
-    # 1		-- lost lock since previous obs; cycle slip possible
-    # 2		-- opposite wavelength factor to defined (or default)
-    # 4		-- observation under anti-spoofing
-    # bits 0 and 1 for phase only
-
-    x = 0
-    LOCK_LOSS = bool(x & 0b10000000)
-    CYCLE_SLIP = bool(x & 0b01000000)
-    Z_TRACK = bool(x & 0b00100000)
-    FUZZY_RANGE = bool(x & 0b00010000)
-    FUNKY_CODE = bool(x & 0b00001000)
-    FUNKY_PHASE = bool(x & 0b00000100)
-    GROOVY_24 = bool(x & 0b00000010)
-    GROOVY_23 = bool(x & 0b00000001)
-    GROOVY_22 = bool(x & 0b00000000)
-
-    lli = 0
-    if goodbad == 0:					# no data
-        lli = 1
-        return lli
-
+def warn_lli(warn):
     if warn >= 64:					# lost lock or possible cycle slip
-        lli = 1
-        return lli
+        return 1
     if warn > 32 and warn < 64:		# Z-tracking and questionable data
-        lli = 5
-        return lli
+        return 5
     if warn == 32:					# Z-tracking mode; turn on A/S flag
-        lli = 4
-        return lli
+        return 4
     if warn >= 4 and warn < 32:		# questionable data
-        lli = 1
-        return lli
+        return 1
+    return 0						# all is well
 
-    return lli						# all is well; return 0
+
+LLI_TABLE = bytes(warn_lli(warn) for warn in range(256))
+
+
+def make_lli(warn, goodbad):
+    if goodbad == 0:					# no data
+        return 1
+    return LLI_TABLE[warn]
 
 ###############################################################################
-# make_srbyte -- function to create snr byte from snr value
+# make_sbyte -- function to create snr byte from snr value
+###############################################################################
+# we need to map analog value
+# (from 75 to 200?) into range:
+# 1 = minimum possible value
+# 5 = threshold for good S/N ratio
+# 9 = maximum possible value
+# 0 = unknown or don't care
+#
+# lots of SWAG here...  The thresholds are whole numbers, so the S-byte for
+# the integer part of the snr is the same; SBYTE_TABLE has all 256.
 ###############################################################################
+SNR_STEPS = [100, 115, 130, 145, 160, 175, 190, 205]	# S-byte 2 .. 9
 
 
-def make_sbyte(snrfloat):
-    # we need to map analog value
-    # (from 75 to 200?) into range:
-    # 1 = minimum possible value
-    # 5 = threshold for good S/N ratio
-    # 9 = maximum possible value
-    # 0 = unknown or don't care
-
-    # lots of SWAG here...
+def snr_sbyte(snr):
     snrbyte = 1				# below 100 -- don't know how low it goes
-    if snrfloat >= 100:
-        snrbyte = 2
-    if snrfloat >= 115:
-        snrbyte = 3
-    if snrfloat >= 130:
-        snrbyte = 4
-    if snrfloat >= 145:
-        snrbyte = 5
-    if snrfloat >= 160:
-        snrbyte = 6
-    if snrfloat >= 175:
-        snrbyte = 7
-    if snrfloat >= 190:
-        snrbyte = 8
-    if snrfloat >= 205:
-        snrbyte = 9
-
+    for step in SNR_STEPS:
+        if snr >= step:
+            snrbyte += 1
     return snrbyte
 
-##############################################################################
+
+SBYTE_TABLE = bytes(snr_sbyte(snr) for snr in range(256))
+
+
+def make_sbyte(snrfloat):
+    return SBYTE_TABLE[min(max(int(snrfloat), 0), 255)]
 
 ##############################################################################
 # fixphase -- used in parse_mben to validate the phase value and update lli
 # shamelessly stolen from Mark Sims' Lady Heather
+#
+# The phase should stay within +/- 1E10 cycles; if it doesn't, take off
+# whole multiples of 1E10 and set the loss-of-lock bit.  Ten or more
+# multiples out is garbage, so the phase becomes 0.  (fmod is exact, so
+# this is the same as subtracting 1E10 at a time.)
 ##############################################################################
+PHASE_LIMIT = 1.0E10
+
 
+def fixphase(phase, lli):
+    if -PHASE_LIMIT < phase < PHASE_LIMIT:		# the usual case
+        return phase, lli
 
-def fixphase(phase_in, lli):
-    phase = phase_in
-    count = 0
-    while phase >= 1.0E10:
-        phase -= 1.0E10
-        count += 1
-        lli | (1 << 0)		# set loss-of-lock bit
-        if count >= 10:
-            phase = 0.0
-            break
-
-    count = 0
-    while phase <= -1.0E10:
-        phase += 1.0E10
-        count += 1
-        lli | (1 << 0)		# set loss-of-lock bit
-        if count >= 10:
-            phase = 0.0
-            break
-    return phase, lli
+    lli |= 1				# set loss-of-lock bit
+    if abs(phase) >= 10 * PHASE_LIMIT:
+        return 0.0, lli
+    return math.fmod(phase, PHASE_LIMIT) + 0.0, lli	# no "-0.0"
 
 ###############################################################################
 # Human_Bytes -- display number in human format
@@ -41,4 +41,5 @@
 --antenna_east=0 \
 --antenna_north=0 \
 --rinex_file=''	`# if empty, build filename from site name or "NONE"` \
+--capture=none	`# raw, zlib or lzma to record messages for ashcapture.py` \
 --verbose=False